@@ -0,0 +1,234 @@
+"""
+Хранилище пользователей в SQLite.
+
+Соединения с базой открываются по одному на поток и переиспользуются между
+запросами (журнал WAL, чтение не блокируется записью), подготовленные запросы
+кэшируются модулем sqlite3 внутри соединения. Пароли хранятся как хэш scrypt
+с настраиваемой стоимостью; открытые пароли, оставшиеся от старых версий,
+один раз заменяются хэшем в init_schema. Недавно проверенные пары
+логин/пароль запоминаются, чтобы повторный вход не пересчитывал дорогой хэш. Для несуществующего логина хэш
+тоже считается (по постоянной записи), чтобы по времени ответа нельзя было
+узнать, какие логины есть в базе.
+"""
+import hashlib
+import hmac
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+SALT_BYTES = 16
+HASH_BYTES = 32
+HASH_PREFIX = 'scrypt'
+
+VERIFIED_CACHE_SIZE = 1024
+VERIFIED_CACHE_TTL = 5 * 60
+BUSY_TIMEOUT_MS = 5000
+
+
+def _scrypt(password, salt, n, r, p):
+    # Памяти нужно 128 * r * n байт, запас на служебные структуры OpenSSL
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * r * n + 1024 * 1024, dklen=HASH_BYTES)
+
+
+def hash_password(password, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    """
+    Хэш пароля в виде scrypt$n$r$p$соль$хэш (соль и хэш в hex).
+    """
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, n, r, p)
+    return f'{HASH_PREFIX}${n}${r}${p}${salt.hex()}${digest.hex()}'
+
+
+def _parse_hash(stored):
+    """
+    Разбирает сохраненный хэш. Для открытого пароля (старые записи) возвращает None.
+    """
+    parts = stored.split('$')
+    if len(parts) != 6 or parts[0] != HASH_PREFIX:
+        return None
+    n, r, p = (int(value) for value in parts[1:4])
+    return n, r, p, bytes.fromhex(parts[4]), bytes.fromhex(parts[5])
+
+
+def verify_password(password, stored):
+    """
+    Сравнивает пароль с сохраненным значением за постоянное время.
+    """
+    parsed = _parse_hash(stored)
+    if parsed is None:
+        return hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+    n, r, p, salt, digest = parsed
+    return hmac.compare_digest(_scrypt(password, salt, n, r, p), digest)
+
+
+class ConnectionPool:
+    """
+    По одному соединению SQLite на поток, открывается при первом обращении.
+    """
+
+    def __init__(self, db_path, cached_statements=64):
+        self.db_path = db_path
+        self.cached_statements = cached_statements
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=BUSY_TIMEOUT_MS / 1000,
+                                   cached_statements=self.cached_statements,
+                                   check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def close_all(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+class AuthStore:
+    """
+    Пользователи и проверка паролей поверх пула соединений.
+    """
+
+    def __init__(self, db_path, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, max_concurrent_hashes=None,
+                 cache_size=VERIFIED_CACHE_SIZE, cache_ttl=VERIFIED_CACHE_TTL):
+        self.pool = ConnectionPool(db_path)
+        self.params = (n, r, p)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.hits = 0
+        self.misses = 0
+        # Каждый расчет scrypt занимает 128 * r * n байт; во время наплыва входов
+        # одновременно считаем не больше хэшей, чем ядер, остальные ждут
+        self._hash_slots = threading.BoundedSemaphore(max_concurrent_hashes or os.cpu_count() or 1)
+        self._verified = OrderedDict()  # ключ пары логин/пароль -> (сохраненный хэш, срок)
+        self._cache_lock = threading.Lock()
+        # Пароли в кэше не хранятся: ключ - HMAC с секретом, живущим только в памяти процесса
+        self._cache_secret = os.urandom(32)
+        # Хэш для проверки при неизвестном логине, считается при первой такой проверке
+        self._dummy_hash = None
+
+    def init_schema(self):
+        conn = self.pool.connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                username TEXT NOT NULL UNIQUE,
+                password TEXT NOT NULL
+            )
+        ''')
+        conn.commit()
+        self._hash_plaintext(conn)
+
+    def _hash_plaintext(self, conn):
+        """
+        Однократная миграция: открытые пароли старых записей заменяются хэшем scrypt.
+        """
+        rows = conn.execute('SELECT id, password FROM users WHERE password NOT LIKE ?',
+                            (HASH_PREFIX + '$%',)).fetchall()
+        for user_id, stored in rows:
+            with conn:
+                conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                             (self._hash(stored), user_id, stored))
+
+    def _hash(self, password):
+        with self._hash_slots:
+            return hash_password(password, *self.params)
+
+    def _verify(self, password, stored):
+        with self._hash_slots:
+            return verify_password(password, stored)
+
+    def add_user(self, username, password):
+        """
+        Добавляет пользователя. Возвращает False, если такой логин уже есть.
+        """
+        conn = self.pool.connection()
+        try:
+            with conn:
+                conn.execute('INSERT INTO users (username, password) VALUES (?, ?)',
+                             (username, self._hash(password)))
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def _verify_dummy(self, password):
+        """
+        Проверка пароля против постоянного хэша: столько же времени, сколько настоящая.
+        """
+        if self._dummy_hash is None:
+            self._dummy_hash = self._hash(os.urandom(16).hex())
+        self._verify(password, self._dummy_hash)
+
+    def _cache_key(self, username, password):
+        message = f'{username}\0{password}'.encode('utf-8')
+        return hmac.new(self._cache_secret, message, hashlib.sha256).digest()
+
+    def _cached(self, key, stored):
+        with self._cache_lock:
+            entry = self._verified.get(key)
+            if entry is None:
+                return False
+            if entry[0] != stored or entry[1] < time.monotonic():
+                # Пароль сменили или запись устарела
+                del self._verified[key]
+                return False
+            self._verified.move_to_end(key)
+            return True
+
+    def _remember(self, key, stored):
+        with self._cache_lock:
+            self._verified[key] = (stored, time.monotonic() + self.cache_ttl)
+            self._verified.move_to_end(key)
+            while len(self._verified) > self.cache_size:
+                self._verified.popitem(last=False)
+
+    def _needs_rehash(self, stored):
+        parsed = _parse_hash(stored)
+        return parsed is None or parsed[:3] != self.params
+
+    def validate_user(self, username, password):
+        """
+        Проверяет логин и пароль. Возвращает (id, username) или None.
+        """
+        conn = self.pool.connection()
+        row = conn.execute('SELECT id, password FROM users WHERE username = ?', (username,)).fetchone()
+        if row is None:
+            self.misses += 1
+            self._verify_dummy(password)
+            return None
+        user_id, stored = row
+
+        key = self._cache_key(username, password)
+        if self._cached(key, stored):
+            self.hits += 1
+            return user_id, username
+        self.misses += 1
+        if not self._verify(password, stored):
+            return None
+
+        if self._needs_rehash(stored):
+            # Старые параметры scrypt - сохраняем хэш с текущими
+            new_stored = self._hash(password)
+            with conn:
+                conn.execute('UPDATE users SET password = ? WHERE id = ? AND password = ?',
+                             (new_stored, user_id, stored))
+            stored = new_stored
+        self._remember(key, stored)
+        return user_id, username
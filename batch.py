@@ -0,0 +1,195 @@
+"""
+Пакетная сверка: один эталонный реестр против многих файлов учреждений.
+
+Эталон разбирается и индексируется по идентификатору обучающегося один раз.
+Файлы учреждений разбираются параллельно пулом процессов (разбор xlsx -
+самая долгая часть), и каждый сравнивается с эталоном сразу, как только
+готов, пока остальные еще читаются. Поэтому общее время близко ко времени
+разбора самих файлов.
+
+Результат в выходном каталоге:
+    summary.csv         - сводка по каждому файлу: строки, совпавшие с эталоном,
+                          отсутствующие в эталоне, число различий по полям, ошибка
+    diffs.csv           - все различия всех файлов со столбцом file
+    report_<поле>.txt   - общие отчеты по полям с разделами по файлам
+
+Пример:
+    python batch.py reestr.xlsx colleges/*.xlsx --out batch_out --workers 4
+"""
+import argparse
+import csv
+import itertools
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import diff_engine
+import excel_stream
+import exports
+from reconcile import ReconcileError
+from workbook_cache import WorkbookCache
+
+SUMMARY_FILE = 'summary.csv'
+DIFFS_FILE = 'diffs.csv'
+SUMMARY_COLUMNS = ['file', 'rows', 'matched', 'not_in_reference'] + diff_engine.REPORT_KEYS + ['total', 'error']
+
+
+def _parse(path, cache_dir):
+    """
+    Разбирает один файл (только столбцы сверки). Выполняется в процессе пула.
+    """
+    if cache_dir:
+        return WorkbookCache(cache_dir).load(path, diff_engine.REQUIRED_COLUMNS)
+    return excel_stream.read_frame(path, diff_engine.REQUIRED_COLUMNS)
+
+
+def _file_result(name, data, reference):
+    """
+    Сравнивает один файл с проиндексированным эталоном. Возвращает (строка сводки, различия).
+    """
+    missing = diff_engine.missing_columns(data)
+    if missing:
+        return dict(file=name, error=f'Отсутствует обязательный столбец: {missing[0]}'), None
+
+    indexed = diff_engine.index_by_id(data)
+    left, right = diff_engine.align_indexed(reference, indexed)
+    diffs = diff_engine.evaluate_rules(left, right)
+    counts = diffs['field'].value_counts()
+    summary = dict(file=name, rows=len(indexed), matched=len(left),
+                   not_in_reference=len(indexed) - len(left), total=len(diffs), error='')
+    summary.update({key: int(counts.get(key, 0)) for key in diff_engine.REPORT_KEYS})
+    return summary, diffs
+
+
+def write_summary(summary, path):
+    with open(path, 'w', encoding='utf-8-sig', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS, restval='')
+        writer.writeheader()
+        writer.writerows(summary)
+
+
+def write_diffs(results, path):
+    """
+    Пишет различия всех файлов в один CSV, файлы в порядке входного списка.
+    """
+    rows = itertools.chain.from_iterable(exports.frame_rows(diffs, diff_engine.DIFF_COLUMNS, (name,))
+                                         for name, diffs in results)
+    exports.write_csv(['file'] + diff_engine.DIFF_COLUMNS, rows, path)
+
+
+def _combined_report_lines(results, key, today):
+    for name, diffs in results:
+        entries = diff_engine.iter_report_entries(diffs, key, today)
+        first = next(entries, None)
+        if first is None:
+            continue
+        yield f"\nФайл: {name}\n"
+        for diff in itertools.chain([first], entries):
+            yield ", ".join([f"{column}: {value}" for column, value in diff.items()]) + "\n"
+
+
+def write_combined_report(results, key, path, today=None):
+    """
+    Общий текстовый отчет по полю: раздел на каждый файл с различиями.
+    Если различий нет ни в одном файле, файл не создается и возвращается False.
+    """
+    lines = _combined_report_lines(results, key, today)
+    first = next(lines, None)
+    if first is None:
+        return False
+    rule = diff_engine.get_rule(key)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(f"Изменения по {rule['title']}:\n")
+        f.write(", ".join(diff_engine.report_headers(rule)) + "\n")
+        f.write(first)
+        f.writelines(lines)
+    return True
+
+
+def run_batch(reference_path, paths, out_dir, names=None, cache_dir=None, workers=None, progress=None,
+              today=None):
+    """
+    Сверяет эталон reference_path с каждым файлом из paths и пишет отчеты в out_dir.
+
+    names - имена файлов для сводки и отчетов (по умолчанию имена путей),
+    progress(готово, всего) вызывается после каждого файла.
+    Возвращает {'summary': строки сводки, 'reports': {ключ отчета: имя файла}}.
+    """
+    names = list(names) if names is not None else [os.path.basename(path) for path in paths]
+    workers = min(workers or os.cpu_count() or 1, len(paths) + 1)
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Процессы через spawn: fork из многопоточного веб-сервера небезопасен
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        reference_future = pool.submit(_parse, reference_path, cache_dir)
+        futures = [pool.submit(_parse, path, cache_dir) for path in paths]
+
+        try:
+            try:
+                reference_data = reference_future.result()
+            except Exception as e:
+                raise ReconcileError(f'Ошибка при чтении эталонного файла: {e}')
+            missing = diff_engine.missing_columns(reference_data)
+            if missing:
+                raise ReconcileError(f'В эталонном файле отсутствует обязательный столбец: {missing[0]}')
+            reference = diff_engine.index_by_id(reference_data)
+        except BaseException:
+            # Без эталона сверять не с чем: разборы из очереди отменяем, а не ждем
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+        summary = [None] * len(paths)
+        results = [None] * len(paths)
+        indexes = dict(zip(futures, range(len(paths))))
+        # Сравниваем файлы в порядке готовности, пока остальные еще разбираются
+        for done, future in enumerate(as_completed(futures), 1):
+            index = indexes[future]
+            try:
+                summary[index], results[index] = _file_result(names[index], future.result(), reference)
+            except Exception as e:
+                summary[index] = dict(file=names[index], error=f'Ошибка при чтении файла: {e}')
+            if progress is not None:
+                progress(done, len(paths))
+
+    results = [(name, diffs) for name, diffs in zip(names, results) if diffs is not None]
+    write_summary(summary, os.path.join(out_dir, SUMMARY_FILE))
+    write_diffs(results, os.path.join(out_dir, DIFFS_FILE))
+    reports = {}
+    for key in diff_engine.REPORT_KEYS:
+        filename = f'report_{key}.txt'
+        if write_combined_report(results, key, os.path.join(out_dir, filename), today):
+            reports[key] = filename
+    return {'summary': summary, 'reports': reports}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Пакетная сверка эталонного реестра с файлами учреждений')
+    parser.add_argument('reference', help='эталонный файл (xlsx)')
+    parser.add_argument('files', nargs='+', help='файлы учреждений (xlsx)')
+    parser.add_argument('--out', required=True, help='каталог для отчетов')
+    parser.add_argument('--workers', type=int, default=None, help='число процессов разбора (по умолчанию - по числу ядер)')
+    parser.add_argument('--cache-dir', default=None, help='каталог кэша снимков разобранных файлов')
+    args = parser.parse_args(argv)
+
+    def progress(done, total):
+        print(f'{done}/{total}', file=sys.stderr)
+
+    try:
+        result = run_batch(args.reference, args.files, args.out, cache_dir=args.cache_dir,
+                           workers=args.workers, progress=progress)
+    except ReconcileError as e:
+        print(e, file=sys.stderr)
+        return 1
+    for row in result['summary']:
+        if row.get('error'):
+            print(f"{row['file']}: {row['error']}", file=sys.stderr)
+        else:
+            print(f"{row['file']}: строк {row['rows']}, различий {row['total']}, "
+                  f"нет в эталоне {row['not_in_reference']}", file=sys.stderr)
+    print(args.out)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
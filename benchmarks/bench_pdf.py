@@ -0,0 +1,77 @@
+"""
+Замер построения общего PDF отчета на синтетической таблице различий.
+
+Пример: python benchmarks/bench_pdf.py --rows 100000
+Печатает JSON со временем построения, размером файла и пиковой памятью процесса.
+"""
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import diff_engine  # noqa: E402
+import pdf_report  # noqa: E402
+
+
+def synthetic_diffs(rows, seed=0):
+    """
+    Таблица различий в формате diff_engine с равномерно распределенными по правилам строками.
+    """
+    rng = np.random.default_rng(seed)
+    keys = np.array(diff_engine.REPORT_KEYS)
+    fields = keys[rng.integers(0, len(keys), rows)]
+    base = date(2024, 1, 1)
+    dates = np.array([base + timedelta(days=int(d)) for d in rng.integers(0, 1500, 512)], dtype=object)
+    return pd.DataFrame({
+        'field': fields,
+        'ID': np.char.add('ID', rng.permutation(rows * 2)[:rows].astype(str)).astype(object),
+        'value1': np.char.add('значение ', rng.integers(0, 1000, rows).astype(str)).astype(object),
+        'value2': np.char.add('значение ', rng.integers(0, 1000, rows).astype(str)).astype(object),
+        'extra1': dates[rng.integers(0, len(dates), rows)],
+        'extra2': dates[rng.integers(0, len(dates), rows)],
+    }, columns=diff_engine.DIFF_COLUMNS)
+
+
+def peak_rss_mb():
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000, help='число строк в таблице различий')
+    parser.add_argument('--font', default=None, help='путь к TTF шрифту с кириллицей')
+    args = parser.parse_args()
+
+    diffs = synthetic_diffs(args.rows)
+    pdf_report.register_font(args.font)
+    rss_before = peak_rss_mb()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = os.path.join(tmp, 'report_all.pdf')
+        started = time.perf_counter()
+        pdf_report.render_pdf(diffs, pdf_path)
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(pdf_path)
+
+    print(json.dumps({
+        'rows': args.rows,
+        'seconds': round(elapsed, 3),
+        'rows_per_second': round(args.rows / elapsed),
+        'pdf_bytes': size,
+        'peak_rss_mb_before': round(rss_before, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+    }, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
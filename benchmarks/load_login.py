@@ -0,0 +1,165 @@
+"""
+Нагрузочный тест входа: одновременные POST /login и перцентили времени ответа.
+
+По умолчанию приложение поднимается в этом же процессе на временной базе
+пользователей и опрашивается через тестовый клиент Flask из пула потоков.
+С --url запросы идут на уже запущенный сервер (пользователи должны существовать).
+
+Два прохода: холодный (каждый пользователь входит впервые, считается scrypt)
+и повторный (те же пары логин/пароль, проверка из кэша). Каждый проход
+сравнивается со своим допустимым p99: повторный с --p99-target-ms, холодный
+с --cold-p99-target-ms. Холодный проход упирается в число ядер: одновременно
+считается не больше хэшей scrypt, чем ядер, остальные входы ждут в очереди.
+Поэтому по умолчанию его p99 не может быть ниже времени очереди, и допустимое
+значение считается из замера: допустимый повторный p99 плюс время одного хэша, умноженное
+на число волн (concurrency / ядра), с запасом COLD_MARGIN. На одном ядре при
+200 входах и ~70 мс на хэш это ~17.7 с при замеренном p99 ~13 с; превышение
+значит, что сверх очереди хэшей появились другие задержки. Код выхода 1, если хотя бы один проход с
+ошибками или выше своего p99.
+
+Пример: python benchmarks/load_login.py --concurrency 200
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import auth_store  # noqa: E402
+
+COLD_MARGIN = 1.25
+CALIBRATION_ROUNDS = 5
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def local_login_factory(users):
+    """
+    Поднимает приложение на временной базе и возвращает функцию входа через тестовый клиент.
+    """
+    tmp = tempfile.mkdtemp()
+    os.environ['USERS_DB'] = os.path.join(tmp, 'users.db')
+    os.chdir(tmp)  # папки uploads приложение создает в текущем каталоге
+    import test1
+
+    test1.init_db()
+    for username, password in users:
+        test1.add_user(username, password)
+    clients = threading.local()
+
+    def login(username, password):
+        client = getattr(clients, 'client', None)
+        if client is None:
+            client = clients.client = test1.app.test_client()
+        response = client.post('/login', data={'username': username, 'password': password})
+        return response.status_code == 302 and response.headers['Location'].endswith('/upload')
+    return login
+
+
+def remote_login_factory(url):
+    base = url.rstrip('/')
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    opener = urllib.request.build_opener(NoRedirect)
+
+    def login(username, password):
+        body = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+        try:
+            opener.open(base + '/login', data=body, timeout=60)
+        except urllib.error.HTTPError as e:
+            return e.code == 302 and e.headers['Location'].endswith('/upload')
+        return False
+    return login
+
+
+def hash_ms():
+    """
+    Время одного хэша scrypt с параметрами по умолчанию (медиана нескольких замеров).
+    """
+    timings = []
+    for _ in range(CALIBRATION_ROUNDS):
+        started = time.perf_counter()
+        auth_store.hash_password('calibration')
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def cold_target_ms(warm_target_ms, concurrency, hash_slots):
+    """
+    Допустимый p99 первого входа: входы сверх числа слотов ждут очереди хэшей scrypt.
+    """
+    waves = -(-concurrency // hash_slots)
+    return round(warm_target_ms + COLD_MARGIN * waves * hash_ms(), 1)
+
+
+def run_pass(login, users, concurrency):
+    start_barrier = threading.Barrier(min(concurrency, len(users)))
+
+    def one(user):
+        try:
+            start_barrier.wait(timeout=30)
+        except threading.BrokenBarrierError:
+            pass
+        started = time.perf_counter()
+        ok = login(*user)
+        return (time.perf_counter() - started) * 1000, ok
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, users))
+    latencies = [ms for ms, _ in results]
+    return {
+        'requests': len(results),
+        'failed': sum(1 for _, ok in results if not ok),
+        'p50_ms': round(statistics.median(latencies), 1),
+        'p99_ms': round(percentile(latencies, 99), 1),
+        'max_ms': round(max(latencies), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный тест входа')
+    parser.add_argument('--concurrency', type=int, default=200, help='число одновременных входов')
+    parser.add_argument('--p99-target-ms', type=float, default=500, help='допустимый p99 повторного входа')
+    parser.add_argument('--cold-p99-target-ms', type=float, default=None,
+                        help='допустимый p99 первого входа (по умолчанию из замера scrypt, см. выше)')
+    parser.add_argument('--hash-slots', type=int, default=os.cpu_count() or 1,
+                        help='сколько хэшей сервер считает одновременно (по умолчанию число ядер)')
+    parser.add_argument('--url', default=None, help='адрес запущенного сервера вместо локального приложения')
+    parser.add_argument('--user-prefix', default='load', help='префикс логинов тестовых пользователей')
+    args = parser.parse_args()
+
+    users = [(f'{args.user_prefix}{i}', f'secret-{i}') for i in range(args.concurrency)]
+    login = remote_login_factory(args.url) if args.url else local_login_factory(users)
+
+    cold_target = args.cold_p99_target_ms
+    if cold_target is None:
+        cold_target = cold_target_ms(args.p99_target_ms, args.concurrency, args.hash_slots)
+    targets = {'cold': cold_target, 'warm': args.p99_target_ms}
+    report = {'concurrency': args.concurrency, 'hash_slots': args.hash_slots}
+    for name in ('cold', 'warm'):
+        result = run_pass(login, users, args.concurrency)
+        result['p99_target_ms'] = targets[name]
+        result['ok'] = result['failed'] == 0 and result['p99_ms'] <= targets[name]
+        report[name] = result
+    report['ok'] = report['cold']['ok'] and report['warm']['ok']
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if report['ok'] else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,280 @@
+"""
+Нагрузочный сценарий: вход, загрузка двух файлов частями, сверка, скачивание отчетов.
+
+Для каждого числа процессов из --workers поднимает gunicorn (gunicorn.conf.py,
+wsgi:app) на временных базах и папке загрузок и прогоняет --users виртуальных
+пользователей, каждый --iterations раз проходит сценарий:
+
+    POST /login -> POST /uploads, PUT частей, POST /uploads/use -> GET /process
+    -> опрос /jobs/<id>/status до готовности -> GET /download/<id>/reports.zip
+
+Для каждого прогона пишется число сценариев в минуту, перцентили времени
+каждого шага и ускорение относительно первого значения --workers. С --url
+сценарий идет на уже запущенный сервер (пользователи должны существовать).
+
+Пример:
+    python benchmarks/load_scenario.py --workers 1 2 4 --users 8 --rows 10000
+"""
+import argparse
+import hashlib
+import http.cookiejar
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+STEPS = ('login', 'upload', 'process', 'download')
+STATUS_POLL_INTERVAL = 0.2
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def ensure_workbooks(rows, data_dir):
+    from make_workbooks import make_pair
+
+    paths = [os.path.join(data_dir, f'registry_{rows}_{side}.xlsx') for side in (1, 2)]
+    if not all(os.path.exists(path) for path in paths):
+        paths = make_pair(rows, data_dir)
+    return paths
+
+
+class Client:
+    """
+    Один виртуальный пользователь: свои cookie сессии, без перехода по перенаправлениям.
+    """
+
+    def __init__(self, base):
+        self.base = base.rstrip('/')
+
+        class NoRedirect(urllib.request.HTTPRedirectHandler):
+            def redirect_request(self, *args, **kwargs):
+                return None
+
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), NoRedirect)
+
+    def request(self, method, path, data=None, headers=None):
+        """
+        Возвращает (код ответа, тело). Тело читается целиком, как это сделал бы браузер.
+        """
+        req = urllib.request.Request(self.base + path, data=data, headers=headers or {}, method=method)
+        try:
+            with self.opener.open(req, timeout=600) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def json(self, method, path, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else None
+        status, body = self.request(method, path, data, {'Content-Type': 'application/json',
+                                                         'Accept': 'application/json'})
+        return status, json.loads(body) if body else None
+
+
+def upload(client, path):
+    with open(path, 'rb') as f:
+        content = f.read()
+    status, upload_state = client.json('POST', '/uploads', {'filename': os.path.basename(path), 'size': len(content)})
+    if status != 201:
+        raise RuntimeError(f'POST /uploads: {status} {upload_state}')
+    chunk_size = upload_state['chunk_size']
+    for index in range(upload_state['chunks']):
+        chunk = content[index * chunk_size:(index + 1) * chunk_size]
+        status, body = client.request('PUT', f"/uploads/{upload_state['id']}/chunks/{index}", chunk,
+                                      {'X-Chunk-SHA256': hashlib.sha256(chunk).hexdigest()})
+        if status != 200:
+            raise RuntimeError(f'PUT части {index}: {status} {body[:200]!r}')
+    return upload_state['id']
+
+
+def scenario(client, username, password, files):
+    """
+    Один проход сценария. Возвращает {шаг: секунды}.
+    """
+    timings = {}
+    started = time.perf_counter()
+    body = urllib.parse.urlencode({'username': username, 'password': password}).encode()
+    status, _ = client.request('POST', '/login', body, {'Content-Type': 'application/x-www-form-urlencoded'})
+    if status != 302:
+        raise RuntimeError(f'POST /login: {status}')
+    timings['login'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    upload_ids = [upload(client, path) for path in files]
+    status, body = client.json('POST', '/uploads/use', {'file1': upload_ids[0], 'file2': upload_ids[1]})
+    if status != 200:
+        raise RuntimeError(f'POST /uploads/use: {status} {body}')
+    timings['upload'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    status, job = client.json('GET', '/process')
+    if status != 202:
+        raise RuntimeError(f'GET /process: {status} {job}')
+    while True:
+        status, state = client.json('GET', f"/jobs/{job['job_id']}/status")
+        if status != 200:
+            raise RuntimeError(f'GET /jobs/<id>/status: {status} {state}')
+        if state['status'] in ('done', 'failed'):
+            break
+        time.sleep(STATUS_POLL_INTERVAL)
+    if state['status'] != 'done':
+        raise RuntimeError(f"Сверка не удалась: {state['error']}")
+    timings['process'] = time.perf_counter() - started
+
+    started = time.perf_counter()
+    status, archive = client.request('GET', f"/download/{job['job_id']}/reports.zip")
+    if status != 200 or not archive.startswith(b'PK'):
+        raise RuntimeError(f'GET reports.zip: {status}')
+    timings['download'] = time.perf_counter() - started
+    return timings
+
+
+def run_load(base, users, iterations, files):
+    """
+    Прогоняет сценарий всеми пользователями одновременно и возвращает сводку.
+    """
+    errors = []
+    results = []
+    lock = threading.Lock()
+
+    def run_user(user):
+        client = Client(base)
+        for _ in range(iterations):
+            try:
+                timings = scenario(client, *user, files)
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                results.append(timings)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(users)) as pool:
+        list(pool.map(run_user, users))
+    seconds = time.perf_counter() - started
+
+    report = {
+        'scenarios': len(results),
+        'failed': len(errors),
+        'seconds': round(seconds, 2),
+        'scenarios_per_minute': round(len(results) / seconds * 60, 2),
+        'steps': {},
+    }
+    for step in STEPS:
+        values = [timings[step] * 1000 for timings in results]
+        if values:
+            report['steps'][step] = {'p50_ms': round(statistics.median(values), 1),
+                                     'p95_ms': round(percentile(values, 95), 1)}
+    if errors:
+        report['errors'] = sorted(set(errors))[:5]
+    return report
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(base, process, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn завершился с кодом {process.returncode}')
+        try:
+            urllib.request.urlopen(base + '/', timeout=2).read()
+            return
+        except urllib.error.HTTPError:
+            return  # Сервер отвечает, код ответа не важен
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('gunicorn не ответил')
+
+
+def create_users(users, env, workdir):
+    """
+    Заводит пользователей в базе из env отдельным процессом, чтобы приложение не грузилось в этот.
+    """
+    code = ('import sys, test1\n'
+            'test1.init_db()\n'
+            'for line in sys.stdin.read().split():\n'
+            '    test1.add_user(*line.split(":", 1))\n')
+    subprocess.run([sys.executable, '-c', code], input='\n'.join(f'{u}:{p}' for u, p in users),
+                   text=True, env=env, cwd=workdir, check=True, stdout=subprocess.DEVNULL)
+
+
+def run_with_gunicorn(workers, threads, users, iterations, files):
+    workdir = tempfile.mkdtemp(prefix='load-scenario-')
+    port = free_port()
+    base = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''),
+               USERS_DB=os.path.join(workdir, 'users.db'), SECRET_KEY='load-scenario',
+               BIND=f'127.0.0.1:{port}', WEB_CONCURRENCY=str(workers), WEB_THREADS=str(threads),
+               LOG_LEVEL='WARNING')
+    create_users(users, env, workdir)
+    # Приложение создает папки загрузок в текущем каталоге - запускаем во временном
+    process = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                                'wsgi:app'], env=env, cwd=workdir)
+    try:
+        wait_ready(base, process)
+        return run_load(base, users, iterations, files)
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Нагрузочный сценарий: вход, загрузка, сверка, скачивание')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='числа процессов gunicorn')
+    parser.add_argument('--threads', type=int, default=8, help='потоков на процесс gunicorn')
+    parser.add_argument('--users', type=int, default=8, help='одновременных пользователей')
+    parser.add_argument('--iterations', type=int, default=2, help='проходов сценария на пользователя')
+    parser.add_argument('--rows', type=int, default=5000, help='строк в синтетических файлах')
+    parser.add_argument('--data', default=os.path.join(BENCH_DIR, 'data'), help='каталог синтетических файлов')
+    parser.add_argument('--files', nargs=2, default=None, help='свои файлы вместо синтетических')
+    parser.add_argument('--url', default=None, help='адрес запущенного сервера вместо gunicorn')
+    parser.add_argument('--user-prefix', default='load', help='префикс логинов тестовых пользователей')
+    args = parser.parse_args()
+
+    files = args.files or ensure_workbooks(args.rows, args.data)
+    users = [(f'{args.user_prefix}{i}', f'secret-{i}') for i in range(args.users)]
+
+    report = {'users': args.users, 'iterations': args.iterations, 'files': [os.path.basename(f) for f in files],
+              'cpus': os.cpu_count(), 'runs': []}
+    if args.url:
+        report['runs'].append(dict(url=args.url, **run_load(args.url, users, args.iterations, files)))
+    else:
+        for workers in args.workers:
+            run = dict(workers=workers, threads=args.threads,
+                       **run_with_gunicorn(workers, args.threads, users, args.iterations, files))
+            report['runs'].append(run)
+            print(json.dumps(run, ensure_ascii=False), file=sys.stderr)
+        base_rate = report['runs'][0]['scenarios_per_minute']
+        for run in report['runs']:
+            run['speedup'] = round(run['scenarios_per_minute'] / base_rate, 2) if base_rate else None
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    sys.exit(0 if all(run['failed'] == 0 for run in report['runs']) else 1)
+
+
+if __name__ == '__main__':
+    main()
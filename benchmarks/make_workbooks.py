@@ -0,0 +1,324 @@
+"""
+Генератор синтетических выгрузок реестра обучающихся для замеров.
+
+Пишет пару файлов в формате настоящей выгрузки: 5 строк шапки отчета,
+строка заголовков и строка подзаголовков (как в образцах в корне репозитория),
+затем строки студентов. Второй файл получается из первого с заданной долей
+расхождений по каждому полю сверки, часть строк удаляется и добавляется новыми,
+порядок строк перемешивается.
+
+Пример:
+    python benchmarks/make_workbooks.py --rows 100000 --out benchmarks/data
+    python benchmarks/make_workbooks.py --rows 10000 --mismatch 0.02 --field-rate iik=0.1
+"""
+import argparse
+import os
+import sys
+import tempfile
+import zipfile
+from datetime import date, timedelta
+from xml.sax.saxutils import escape
+
+import numpy as np
+from openpyxl.utils import get_column_letter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import diff_engine  # noqa: E402
+import excel_stream  # noqa: E402
+
+SIZES = [1000, 10000, 100000, 500000]
+CHUNK_ROWS = 10000
+
+PREAMBLE = [
+    ['Период отчета', None, None, None, '10 января 2025'],
+    ['Статус отчета', None, None, None, 'Сохранен'],
+    ['Экологический коэффициент', None, None, None, 'Не имеет'],
+    ['Имеет филиалы с экологическим коэффициентом', None, None, None, 'Нет'],
+    [],
+]
+
+HEADER = [
+    'Фамилия', 'Имя', 'Отчество', 'Идентификатор обучающегося', 'ИИН', 'Гражданство', 'ИИК', 'БИК',
+    'Отчислен', 'Форма оплаты', 'Вид стипендии', 'Академическая степень', 'Курс', 'Год поступления на 1 курс',
+    'Выпускной курс', 'ГОП', 'Квота', 'Дополнительный статус', 'Экологический статус обучающегося',
+    'Примечание от ОВПО', 'Общая успеваемость', 'Приказ о зачислении', None, None,
+    'Приказ о назначении стипендии', None, None, 'Приказ об академическом отпуске', None, None, None, None,
+    None, None, None, 'Приказ об отчислении', None, None, 'Имеет инвалидность по слуху',
+    'Дата начала инвалидности', 'Дата окончания инвалидности', 'Имеет инвалидность по зрению',
+    'Дата начала инвалидности', 'Дата окончания инвалидности', 'Сирота',
+    'Сирота на полном государственном обеспечении', 'Комментарий от Оператора', 'Стипендия предусмотрена',
+    'Сумма стипендии', 'Формула расчета', 'Статус оплаты', 'Причина возврата платежа',
+]
+
+SUBHEADER = [None] * 21 + [
+    'Дата приказа', 'Номер приказа', 'Дата движения по приказу', 'Дата приказа', 'Номер приказа',
+    'Период назначения стипендии (начало и конец)', 'Дата приказа', 'Номер приказа',
+    'Дата движения по приказу', 'Дата начала академического отпуска', 'Дата окончания академического отпуска',
+    'Причина', 'Дата начала справки', 'Дата окончания справки', 'Дата приказа', 'Номер приказа',
+    'Дата движения по приказу',
+] + [None] * 14
+
+# Имена столбцов так, как их видит сверка (Unnamed: N, суффиксы .1)
+COLUMNS = excel_stream.column_names(HEADER)
+
+SURNAMES = ['Хамидулла', 'Ахметов', 'Иванова', 'Сапаров', 'Ким', 'Нургалиева', 'Петров', 'Жумабаев']
+NAMES = ['Айдос', 'Алия', 'Данияр', 'Мария', 'Ерлан', 'Асель', 'Тимур', 'Дана']
+PATRONYMICS = ['Салауатұлы', 'Маратовна', 'Серикович', 'Болатқызы', None]
+BANKS = ['HSBKKZKX', 'KCJBKZKX', 'CASPKZKA', 'HCSKKZKA', 'ALFAKZKA']
+SCHOLARSHIPS = ['Государственный грант', 'Президентская стипендия', None, None]
+YES_NO = ['Да', 'Нет']
+FILLER = ['очная', 'бакалавр', 'грант', 'нет', '2', '3', '6B01101', 'Оплачено']
+
+
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '<Override PartName="/xl/sharedStrings.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+    '</Types>'
+)
+_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="xl/workbook.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="Лист1" sheetId="1" r:id="rId1"/></sheets></workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+    '<Relationship Id="rId2" Target="styles.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+    '<Relationship Id="rId3" Target="sharedStrings.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings"/>'
+    '</Relationships>'
+)
+# Стиль 1 - дата (встроенный формат 14)
+_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+    '<borders count="1"><border/></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="14" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+    '</styleSheet>'
+)
+_EXCEL_EPOCH = date(1899, 12, 30)
+
+
+class XlsxWriter:
+    """
+    Потоковая запись листа xlsx с таблицей общих строк, как в выгрузках из Excel.
+    Строки листа пишутся во временный файл, в память попадают только уникальные тексты.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.strings = {}
+        self.rows = 0
+        self._letters = [get_column_letter(index + 1) for index in range(len(HEADER))]
+        self._sheet = tempfile.NamedTemporaryFile('w', encoding='utf-8', suffix='.xml', delete=False)
+
+    def _cell(self, ref, value):
+        if isinstance(value, str):
+            index = self.strings.setdefault(value, len(self.strings))
+            return f'<c r="{ref}" t="s"><v>{index}</v></c>'
+        if isinstance(value, date):
+            return f'<c r="{ref}" s="1"><v>{(value - _EXCEL_EPOCH).days}</v></c>'
+        return f'<c r="{ref}"><v>{value}</v></c>'
+
+    def append(self, row):
+        self.rows += 1
+        cells = ''.join(self._cell(f'{letter}{self.rows}', value)
+                        for letter, value in zip(self._letters, row) if value is not None)
+        self._sheet.write(f'<row r="{self.rows}">{cells}</row>')
+
+    def close(self):
+        self._sheet.close()
+        try:
+            with zipfile.ZipFile(self.path, 'w', zipfile.ZIP_DEFLATED) as book:
+                book.writestr('[Content_Types].xml', _CONTENT_TYPES)
+                book.writestr('_rels/.rels', _ROOT_RELS)
+                book.writestr('xl/workbook.xml', _WORKBOOK)
+                book.writestr('xl/_rels/workbook.xml.rels', _WORKBOOK_RELS)
+                book.writestr('xl/styles.xml', _STYLES)
+                book.writestr('xl/sharedStrings.xml', ''.join([
+                    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>',
+                    f'<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                    f'uniqueCount="{len(self.strings)}">',
+                    *(f'<si><t>{escape(text)}</t></si>' for text in self.strings),
+                    '</sst>',
+                ]))
+                with book.open('xl/worksheets/sheet1.xml', 'w') as sheet, \
+                        open(self._sheet.name, 'rb') as rows:
+                    sheet.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                                b'<sheetData>')
+                    for block in iter(lambda: rows.read(1024 * 1024), b''):
+                        sheet.write(block)
+                    sheet.write(b'</sheetData></worksheet>')
+        finally:
+            os.remove(self._sheet.name)
+
+
+def _choice(rng, values, n):
+    return np.array(values, dtype=object)[rng.integers(0, len(values), n)]
+
+
+def _digits(rng, n, length):
+    return np.array([''.join(map(str, row)) for row in rng.integers(0, 10, (n, length))], dtype=object)
+
+
+def _dates(rng, n, start, days):
+    base = np.array([start + timedelta(days=int(day)) for day in range(days)], dtype=object)
+    return base[rng.integers(0, days, n)]
+
+
+def generate_chunk(rng, ids):
+    """
+    Строки студентов с заданными идентификаторами: словарь имя столбца -> массив значений.
+    """
+    n = len(ids)
+    data = {column: _choice(rng, FILLER + [None], n) for column in COLUMNS}
+    data.update({
+        'Фамилия': _choice(rng, SURNAMES, n),
+        'Имя': _choice(rng, NAMES, n),
+        'Отчество': _choice(rng, PATRONYMICS, n),
+        diff_engine.ID_COLUMN: ids.astype(object),
+        'ИИН': _digits(rng, n, 12),
+        'Гражданство': _choice(rng, ['Казах', 'Русский', 'Узбек', None], n),
+        'ИИК': np.char.add('KZ', _digits(rng, n, 18).astype(str)).astype(object),
+        'БИК': _choice(rng, BANKS, n),
+        diff_engine.SCHOLARSHIP_COLUMN: _choice(rng, SCHOLARSHIPS, n),
+        # Успеваемость вне проверяемого списка правила step, расхождения по нему вносит _mutate
+        diff_engine.PERFORMANCE_COLUMN: _choice(rng, [2, 4, 5], n),
+        'Квота': _choice(rng, YES_NO, n),
+        'Приказ о назначении стипендии': np.array(
+            [day.strftime('%d.%m.%Y') for day in _dates(rng, n, date(2023, 9, 1), 700)], dtype=object),
+        'Unnamed: 26': _choice(rng, ['01.09.2024 - 31.01.2025', '01.02.2025 - 30.06.2025'], n),
+        'Имеет инвалидность по слуху': _choice(rng, YES_NO[1:] * 9 + YES_NO[:1], n),
+        'Дата окончания инвалидности': _dates(rng, n, date(2024, 1, 1), 1000),
+        'Имеет инвалидность по зрению': _choice(rng, YES_NO[1:] * 9 + YES_NO[:1], n),
+        'Дата окончания инвалидности.1': _dates(rng, n, date(2024, 1, 1), 1000),
+        'Сирота': _choice(rng, YES_NO[1:] * 19 + YES_NO[:1], n),
+    })
+    return data
+
+
+def _mutate(rng, rule, data, rows):
+    """
+    Вносит расхождение по правилу в выбранные строки второго файла.
+    """
+    if rule['key'] == 'step':
+        # Стипендия есть, успеваемость из проверяемого списка
+        data[diff_engine.SCHOLARSHIP_COLUMN][rows] = 'Государственный грант'
+        data[diff_engine.PERFORMANCE_COLUMN][rows] = _choice(rng, rule['performance'], len(rows))
+        return
+    column = rule['columns'][0]
+    values = data[column]
+    if column in ('ИИК', 'ИИН'):
+        values[rows] = [value[:-1] + str((int(value[-1]) + 1) % 10) for value in values[rows]]
+    elif column == 'БИК':
+        values[rows] = [BANKS[(BANKS.index(value) + 1) % len(BANKS)] for value in values[rows]]
+    elif set(values[rows]) <= set(YES_NO):
+        values[rows] = ['Нет' if value == 'Да' else 'Да' for value in values[rows]]
+    else:
+        values[rows] = [f'{value} (изм.)' for value in values[rows]]
+
+
+def make_pair(rows, out_dir, mismatch=0.01, field_rates=None, missing=0.005, seed=0, name=None):
+    """
+    Пишет file1/file2 на rows строк. Возвращает пути к файлам.
+    """
+    field_rates = field_rates or {}
+    rng = np.random.default_rng(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    name = name or f'registry_{rows}'
+    paths = [os.path.join(out_dir, f'{name}_1.xlsx'), os.path.join(out_dir, f'{name}_2.xlsx')]
+
+    sheets = [XlsxWriter(path) for path in paths]
+    for sheet in sheets:
+        for row in PREAMBLE + [HEADER, SUBHEADER]:
+            sheet.append(row)
+
+    ids = rng.permutation(np.arange(100000, 100000 + rows * 2))
+    # Вторая половина перестановки - идентификаторы новых студентов второго файла
+    next_new = rows
+    for start in range(0, rows, CHUNK_ROWS):
+        chunk_ids = ids[start:min(start + CHUNK_ROWS, rows)]
+        n = len(chunk_ids)
+        first = generate_chunk(rng, chunk_ids)
+        second = {column: values.copy() for column, values in first.items()}
+
+        for rule in diff_engine.PLAN['rules']:
+            rate = field_rates.get(rule['key'], mismatch)
+            changed = np.flatnonzero(rng.random(n) < rate)
+            if len(changed):
+                _mutate(rng, rule, second, changed)
+
+        # Часть студентов выбыла, на их место пришли новые
+        keep = rng.random(n) >= missing
+        added = int(n - keep.sum())
+        extra = generate_chunk(rng, ids[next_new:next_new + added]) if added else None
+        next_new += added
+        order = rng.permutation(int(keep.sum()) + added)
+
+        rows1 = zip(*(first[column].tolist() for column in COLUMNS))
+        columns2 = [np.concatenate([second[column][keep], extra[column]]) if added else second[column][keep]
+                    for column in COLUMNS]
+        rows2 = zip(*(values[order].tolist() for values in columns2))
+        for row in rows1:
+            sheets[0].append(row)
+        for row in rows2:
+            sheets[1].append(row)
+
+    for sheet in sheets:
+        sheet.close()
+    return paths
+
+
+def _field_rate(text):
+    key, _, rate = text.partition('=')
+    if key not in diff_engine.REPORT_KEYS:
+        raise argparse.ArgumentTypeError(f'неизвестное поле {key!r}, допустимые: {", ".join(diff_engine.REPORT_KEYS)}')
+    return key, float(rate)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Генератор синтетических выгрузок реестра')
+    parser.add_argument('--rows', type=int, nargs='+', default=SIZES, help='размеры файлов в строках')
+    parser.add_argument('--out', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+    parser.add_argument('--mismatch', type=float, default=0.01, help='доля расхождений по каждому полю')
+    parser.add_argument('--field-rate', type=_field_rate, action='append', default=[],
+                        help='доля расхождений для отдельного поля, например iik=0.05')
+    parser.add_argument('--missing', type=float, default=0.005, help='доля строк, которых нет во втором файле')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    for rows in args.rows:
+        paths = make_pair(rows, args.out, args.mismatch, dict(args.field_rate), args.missing, args.seed)
+        print(*paths)
+
+
+if __name__ == '__main__':
+    main()
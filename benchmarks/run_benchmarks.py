@@ -0,0 +1,190 @@
+"""
+Замеры этапов сверки на синтетических выгрузках.
+
+Для каждого размера генерирует (если их еще нет) пару файлов make_workbooks.py
+и в отдельном процессе по очереди замеряет этапы: разбор xlsx (холодный кэш),
+повторное чтение из кэша снимков, сопоставление студентов, таблицу различий,
+текстовые отчеты, PDF и сравнение столбцов по ключу. Для каждого этапа записывается время и пиковая
+память процесса после него. Отдельный процесс на размер нужен, чтобы пиковая
+память одного размера не переходила в замер следующего.
+
+Результаты пишутся в JSON. С --baseline сравнивает с прошлым прогоном и
+завершается с кодом 1, если какой-то этап стал медленнее больше чем на --threshold.
+
+Пример:
+    python benchmarks/run_benchmarks.py --sizes 1000 10000 100000
+    python benchmarks/run_benchmarks.py --baseline benchmarks/results/previous.json
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+# Этапы короче этого не сравниваем с прошлым прогоном: там шум больше самого замера
+MIN_COMPARABLE_SECONDS = 0.25
+
+
+def peak_rss_mb():
+    # На Linux ru_maxrss в килобайтах
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_stages(file1, file2, workers):
+    """
+    Замеряет этапы на одной паре файлов. Выполняется в отдельном процессе.
+    """
+    import column_compare
+    import diff_engine
+    import matching
+    import pdf_report
+    import reconcile
+    from workbook_cache import WorkbookCache
+
+    stages = {}
+
+    def timed(name, func):
+        started = time.perf_counter()
+        result = func()
+        stages[name] = {'seconds': round(time.perf_counter() - started, 3), 'peak_rss_mb': peak_rss_mb()}
+        return result
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = WorkbookCache(os.path.join(tmp, 'cache'))
+        columns = diff_engine.REQUIRED_COLUMNS
+
+        data1, data2 = timed('parse', lambda: (cache.load(file1, columns), cache.load(file2, columns)))
+        timed('parse_cached', lambda: (cache.load(file1, columns), cache.load(file2, columns)))
+
+        keyed1, keyed2 = (diff_engine.index_by_id(cache.load(path, reconcile.read_columns()))
+                          for path in (file1, file2))
+        timed('match', lambda: matching.match_records(keyed1, keyed2))
+        diffs = timed('diff', lambda: diff_engine.build_diff_table(data1, data2, workers=workers))
+
+        def text_reports():
+            for key in diff_engine.REPORT_KEYS:
+                diff_engine.write_text_report(diffs, key, os.path.join(tmp, f'report_{key}.txt'))
+        timed('text_reports', text_reports)
+
+        pdf_report.register_font()
+        timed('pdf', lambda: pdf_report.render_pdf(diffs, os.path.join(tmp, 'report_all.pdf')))
+
+        pairs = [column for column in columns if column != diff_engine.ID_COLUMN]
+        timed('compare', lambda: column_compare.compare_by_key(
+            data1, data2, diff_engine.ID_COLUMN, diff_engine.ID_COLUMN, pairs, pairs))
+
+    return {'rows1': len(data1), 'rows2': len(data2), 'diff_rows': len(diffs), 'stages': stages}
+
+
+def ensure_workbooks(rows, data_dir, seed):
+    from make_workbooks import make_pair
+
+    paths = [os.path.join(data_dir, f'registry_{rows}_{side}.xlsx') for side in (1, 2)]
+    if not all(os.path.exists(path) for path in paths):
+        print(f'Генерация файлов на {rows} строк...', file=sys.stderr)
+        paths = make_pair(rows, data_dir, seed=seed)
+    return paths
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_with_baseline(results, baseline, threshold):
+    """
+    Печатает изменение времени каждого этапа относительно прошлого прогона.
+    Возвращает список замедлившихся этапов.
+    """
+    previous = {entry['rows']: entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        old = previous.get(entry['rows'])
+        if old is None:
+            continue
+        for stage, measured in entry['stages'].items():
+            before = old['stages'].get(stage)
+            if not before or not before['seconds']:
+                continue
+            ratio = measured['seconds'] / before['seconds']
+            mark = ''
+            if ratio > 1 + threshold and measured['seconds'] >= MIN_COMPARABLE_SECONDS:
+                mark = '  <-- медленнее'
+                regressions.append((entry['rows'], stage, ratio))
+            print(f"{entry['rows']:>8} {stage:<13} {before['seconds']:>9.3f} -> {measured['seconds']:>9.3f} с"
+                  f"  x{ratio:.2f}{mark}", file=sys.stderr)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Замеры этапов сверки')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES, help='размеры файлов в строках')
+    parser.add_argument('--data', default=os.path.join(BENCH_DIR, 'data'), help='каталог со сгенерированными файлами')
+    parser.add_argument('--out', default=None, help='файл результатов (по умолчанию benchmarks/results/<время>.json)')
+    parser.add_argument('--workers', type=int, default=1, help='число процессов для проверки правил')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', default=None, help='результаты прошлого прогона для сравнения')
+    parser.add_argument('--threshold', type=float, default=0.2, help='допустимое замедление этапа, доля')
+    parser.add_argument('--worker', nargs=2, metavar=('FILE1', 'FILE2'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_stages(*args.worker, workers=args.workers)))
+        return
+
+    sys.path.insert(0, BENCH_DIR)
+    results = []
+    for rows in args.sizes:
+        file1, file2 = ensure_workbooks(rows, args.data, args.seed)
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--worker', file1, file2,
+                                 '--workers', str(args.workers)], capture_output=True, text=True, check=True)
+        entry = dict(json.loads(output.stdout.strip().splitlines()[-1]), rows=rows)
+        results.append(entry)
+        stages = ', '.join(f"{name} {stage['seconds']:.2f} с" for name, stage in entry['stages'].items())
+        print(f'{rows:>8}: {stages}; пик памяти {max(s["peak_rss_mb"] for s in entry["stages"].values())} МБ',
+              file=sys.stderr)
+
+    import numpy
+    import pandas
+
+    report = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'git': git_revision(),
+            'python': platform.python_version(),
+            'pandas': pandas.__version__,
+            'numpy': numpy.__version__,
+            'cpu_count': os.cpu_count(),
+            'platform': platform.platform(),
+            'workers': args.workers,
+        },
+        'results': results,
+    }
+    out = args.out or os.path.join(BENCH_DIR, 'results', datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(out)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_with_baseline(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
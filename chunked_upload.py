@@ -0,0 +1,222 @@
+"""
+Загрузка больших файлов частями с докачкой.
+
+Клиент заводит загрузку (имя, размер, при желании SHA-256 всего файла) и
+отправляет части в любом порядке и параллельно; каждая часть потоком пишется
+во временный файл, не накапливаясь в памяти, проверяется по SHA-256 из
+заголовка и только потом занимает свое место, так что неудачный повтор не
+портит уже принятую часть. После обрыва клиент запрашивает состояние загрузки
+и досылает только недостающие части. Когда приходит последняя часть, части
+склеиваются в файл, он переносится во входные файлы рабочего каталога под
+именем по содержимому и сразу передается на разбор (on_complete), не дожидаясь
+запуска сверки.
+"""
+import hashlib
+import json
+import os
+import shutil
+import uuid
+
+from workspaces import is_valid_id
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+COPY_CHUNK_SIZE = 256 * 1024
+ALLOWED_EXTENSIONS = ('.xlsx',)
+
+
+class UploadError(Exception):
+    """
+    Ошибка загрузки, текст которой можно показать пользователю. status - HTTP код ответа.
+    """
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _write_json(path, data):
+    tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+class ChunkedUploads:
+    """
+    Загрузки частями внутри рабочих каталогов: uploads/<id>/ с описанием и принятыми частями (chunks/<номер>).
+    """
+
+    def __init__(self, workspaces, chunk_size=DEFAULT_CHUNK_SIZE, max_bytes=DEFAULT_MAX_BYTES, on_complete=None):
+        self.workspaces = workspaces
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        # Вызывается с путем к собранному файлу, чтобы начать его разбор заранее
+        self.on_complete = on_complete
+
+    def _dir(self, workspace_id, upload_id, *parts):
+        if not is_valid_id(upload_id):
+            raise UploadError('Загрузка не найдена.', 404)
+        return self.workspaces.path(workspace_id, 'uploads', upload_id, *parts)
+
+    def _meta(self, workspace_id, upload_id):
+        try:
+            return _read_json(self._dir(workspace_id, upload_id, 'meta.json'))
+        except FileNotFoundError:
+            raise UploadError('Загрузка не найдена.', 404)
+
+    def create(self, workspace_id, filename, size, sha256=None):
+        """
+        Заводит загрузку и возвращает ее состояние (идентификатор, размер части, число частей).
+        """
+        filename = os.path.basename(filename or '')
+        if not filename.lower().endswith(ALLOWED_EXTENSIONS):
+            raise UploadError('Можно загружать только файлы .xlsx.')
+        try:
+            size = int(size)
+        except (TypeError, ValueError):
+            raise UploadError('Не указан размер файла.')
+        if size <= 0 or size > self.max_bytes:
+            raise UploadError(f'Размер файла должен быть от 1 байта до {self.max_bytes // (1024 * 1024)} МБ.', 413)
+        if sha256 is not None and (len(sha256) != 64 or any(c not in '0123456789abcdef' for c in sha256.lower())):
+            raise UploadError('Некорректная контрольная сумма файла.')
+
+        upload_id = uuid.uuid4().hex
+        path = self._dir(workspace_id, upload_id)
+        os.makedirs(os.path.join(path, 'chunks'))
+        meta = {
+            'id': upload_id,
+            'filename': filename,
+            'size': size,
+            'sha256': sha256.lower() if sha256 else None,
+            'chunk_size': self.chunk_size,
+            'chunks': -(-size // self.chunk_size),
+        }
+        _write_json(os.path.join(path, 'meta.json'), meta)
+        self.workspaces.touch(workspace_id)
+        return self.status(workspace_id, upload_id)
+
+    def status(self, workspace_id, upload_id):
+        """
+        Состояние загрузки: какие части получены, каких не хватает, готов ли файл.
+        """
+        meta = self._meta(workspace_id, upload_id)
+        received = sorted(int(name) for name in os.listdir(self._dir(workspace_id, upload_id, 'chunks'))
+                          if name.isdigit())
+        result_path = self._dir(workspace_id, upload_id, 'result.json')
+        result = _read_json(result_path) if os.path.exists(result_path) else None
+        received_set = set(received)
+        return dict(meta, received=received,
+                    missing=[index for index in range(meta['chunks']) if index not in received_set],
+                    complete=result is not None and 'file' in result,
+                    error=result.get('error') if result else None,
+                    file=result.get('file') if result else None)
+
+    def write_chunk(self, workspace_id, upload_id, index, stream, checksum=None):
+        """
+        Потоково пишет часть с номером index из stream и возвращает состояние загрузки.
+        Часть пишется во временный файл и заменяет прежнюю только после проверки размера
+        и контрольной суммы. Если это была последняя недостающая часть, собирает файл.
+        """
+        meta = self._meta(workspace_id, upload_id)
+        if not 0 <= index < meta['chunks']:
+            raise UploadError('Неверный номер части.')
+        status = self.status(workspace_id, upload_id)
+        if status['complete']:
+            return status  # Повтор части после обрыва ответа: файл уже собран
+        offset = index * meta['chunk_size']
+        expected = min(meta['chunk_size'], meta['size'] - offset)
+
+        chunk_path = self._dir(workspace_id, upload_id, 'chunks', str(index))
+        tmp_path = f'{chunk_path}.{uuid.uuid4().hex}.tmp'
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                while written <= expected:
+                    block = stream.read(min(COPY_CHUNK_SIZE, expected + 1 - written))
+                    if not block:
+                        break
+                    if written + len(block) > expected:
+                        raise UploadError(f'Часть {index} больше ожидаемых {expected} байт.')
+                    f.write(block)
+                    digest.update(block)
+                    written += len(block)
+            if written != expected:
+                raise UploadError(f'Часть {index} получена не полностью: {written} из {expected} байт.')
+            if checksum is not None and digest.hexdigest() != checksum.lower():
+                raise UploadError(f'Контрольная сумма части {index} не совпала, отправьте ее еще раз.', 422)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        # Каждая часть - отдельный файл, чтобы параллельные части не спорили за meta.json
+        os.replace(tmp_path, chunk_path)
+        self.workspaces.touch(workspace_id)
+
+        status = self.status(workspace_id, upload_id)
+        if not status['missing'] and not status['complete']:
+            self._finish(workspace_id, upload_id, meta)
+            status = self.status(workspace_id, upload_id)
+        return status
+
+    def _finish(self, workspace_id, upload_id, meta):
+        """
+        Собирает файл из частей: сверяет SHA-256, переносит во входные файлы и передает на разбор.
+        Если последние части пришли одновременно, сборку выполняет только один запрос.
+        """
+        try:
+            fd = os.open(self._dir(workspace_id, upload_id, 'finishing'), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return
+        os.close(fd)
+
+        finishing_path = self._dir(workspace_id, upload_id, 'finishing')
+        data_path = self._dir(workspace_id, upload_id, 'data.part')
+        chunk_paths = [self._dir(workspace_id, upload_id, 'chunks', str(index)) for index in range(meta['chunks'])]
+        try:
+            digest = hashlib.sha256()
+            with open(data_path, 'wb') as out:
+                for chunk_path in chunk_paths:
+                    with open(chunk_path, 'rb') as f:
+                        for block in iter(lambda: f.read(1024 * 1024), b''):
+                            digest.update(block)
+                            out.write(block)
+            if meta['sha256'] and digest.hexdigest() != meta['sha256']:
+                # Части по отдельности сошлись, а файл целиком нет - начинаем заново
+                os.remove(data_path)
+                shutil.rmtree(self._dir(workspace_id, upload_id, 'chunks'))
+                os.makedirs(self._dir(workspace_id, upload_id, 'chunks'))
+                os.remove(finishing_path)
+                _write_json(self._dir(workspace_id, upload_id, 'result.json'),
+                            {'error': 'Контрольная сумма файла не совпала, загрузите его заново.'})
+                return
+
+            path = self.workspaces.store_input(workspace_id, data_path, digest.hexdigest())
+            _write_json(self._dir(workspace_id, upload_id, 'result.json'), {'file': os.path.basename(path)})
+            # Данные частей больше не нужны, пустые файлы остаются отметками полученных частей
+            for chunk_path in chunk_paths:
+                open(chunk_path, 'w').close()
+            if self.on_complete is not None:
+                self.on_complete(path)
+        except BaseException:
+            # Сборка не удалась (нет места, сбой диска): снимаем отметку и недособранный файл,
+            # чтобы повтор последней части собрал файл заново из сохраненных частей
+            for leftover in (data_path, finishing_path):
+                if os.path.exists(leftover):
+                    os.remove(leftover)
+            raise
+
+    def file_name(self, workspace_id, upload_id):
+        """
+        Имя собранного входного файла в рабочем каталоге или UploadError, если загрузка не завершена.
+        """
+        status = self.status(workspace_id, upload_id)
+        if not status['complete']:
+            raise UploadError(f"Файл {status['filename']} загружен не полностью.", 409)
+        return status['file']
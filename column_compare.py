@@ -0,0 +1,138 @@
+"""
+Сравнение выбранных пользователем столбцов двух файлов.
+
+Строки сопоставляются не по номеру, а по ключевому столбцу (например,
+идентификатору обучающегося): обе выборки индексируются по ключу и
+соединяются через хэш-таблицу индекса, после чего каждая пара столбцов
+сравнивается целиком. Отдельно собираются ключи, которые есть только в одном файле.
+"""
+import pandas as pd
+
+import column_types
+from diff_engine import index_by_id, values_differ
+
+CHANGE_COLUMNS = ['key', 'column', 'value1', 'value2']
+
+
+def _integral(values):
+    """
+    Целые числа, прочитанные как float из-за пустых ячеек (229020.0), переводит в целый тип,
+    чтобы они записывались как 229020 и совпадали с тем же значением, сохраненным текстом.
+    """
+    if pd.api.types.is_float_dtype(values.dtype):
+        present = values.dropna()
+        if (present == present.round()).all():
+            return values.astype('Int64')
+    return values
+
+
+def _as_text(values):
+    """
+    Значения столбца в виде строк, как их видит пользователь; пустые остаются пустыми.
+    """
+    values = _integral(values)
+    return values.astype(object).where(values.notna()).map(str, na_action='ignore')
+
+
+def _key_column(data, key):
+    return data.assign(**{key: _integral(data[key])})
+
+
+def _display(value):
+    return '' if pd.isna(value) else value
+
+
+def compare_by_key(data1, data2, key1, key2, columns1, columns2):
+    """
+    Сравнивает пары столбцов (columns1[i], columns2[i]) у строк с одинаковым ключом.
+
+    Возвращает словарь:
+    changes - различия (ключ, столбец, значение в файле 1, значение в файле 2)
+              в порядке строк первого файла и пар столбцов;
+    only1, only2 - ключи, которые есть только в первом или только во втором файле;
+    duplicates1, duplicates2 - сколько строк отброшено из-за повторяющегося ключа.
+    """
+    indexed1 = index_by_id(_key_column(data1, key1), key1)
+    indexed2 = index_by_id(_key_column(data2, key2), key2)
+
+    in_right = indexed1.index.isin(indexed2.index)
+    in_left = indexed2.index.isin(indexed1.index)
+    common = indexed1.index[in_right]
+    left = indexed1.loc[common]
+    right = indexed2.loc[common]
+
+    parts = []
+    for column1, column2 in zip(columns1, columns2):
+        values1, values2 = column_types.comparable(left[column1], right[column2], column1)
+        if values1.dtype == values2.dtype:
+            differ = values_differ(values1, values2)
+        else:
+            # Разные типы (число в одном файле и текст в другом) сравниваем по записи значения
+            differ = values_differ(_as_text(values1), _as_text(values2))
+        mask = differ.to_numpy(dtype=bool)
+        if not mask.any():
+            continue
+        label = column1 if column1 == column2 else f"{column1} / {column2}"
+        parts.append(pd.DataFrame({
+            'position': mask.nonzero()[0],
+            'key': common[mask],
+            'column': label,
+            'value1': column_types.as_text(left[column1], column1).to_numpy(dtype=object)[mask],
+            'value2': column_types.as_text(right[column2], column2).to_numpy(dtype=object)[mask],
+        }))
+
+    if parts:
+        # Сортировка устойчивая: внутри строки пары столбцов остаются в порядке выбора
+        changes = pd.concat(parts, ignore_index=True).sort_values('position', kind='stable')
+        changes = changes[CHANGE_COLUMNS].reset_index(drop=True)
+    else:
+        changes = pd.DataFrame(columns=CHANGE_COLUMNS)
+
+    return {
+        'key1': key1,
+        'key2': key2,
+        'changes': changes,
+        'only1': indexed1.index[~in_right].tolist(),
+        'only2': indexed2.index[~in_left].tolist(),
+        'duplicates1': int(data1[key1].notna().sum()) - len(indexed1),
+        'duplicates2': int(data2[key2].notna().sum()) - len(indexed2),
+    }
+
+
+def has_differences(result):
+    """
+    Есть ли в результате различия или строки, которых нет в одном из файлов.
+    """
+    return not result['changes'].empty or bool(result['only1']) or bool(result['only2'])
+
+
+def iter_report_lines(result):
+    """
+    Отдает строки текстового отчета по одной, чтобы его можно было сразу отправлять клиенту.
+    """
+    key1, key2 = result['key1'], result['key2']
+    key_label = key1 if key1 == key2 else f"{key1} / {key2}"
+    changes = result['changes']
+    yield f"Ключ: {key_label}"
+    yield (f"Строк с различиями: {changes['key'].nunique()}, "
+           f"только в файле 1: {len(result['only1'])}, только в файле 2: {len(result['only2'])}")
+    for number, count in ((1, result['duplicates1']), (2, result['duplicates2'])):
+        if count:
+            yield f"В файле {number} повторяется ключ, пропущено строк: {count}"
+    yield ""
+
+    # Различия одной строки идут подряд, собираем их в одну строку отчета
+    current, row_diff = None, []
+    for key, column, value1, value2 in changes.itertuples(index=False, name=None):
+        if key != current and row_diff:
+            yield f"{current}: " + "; ".join(row_diff)
+            row_diff = []
+        current = key
+        row_diff.append(f"{column}: {_display(value1)} -> {_display(value2)}")
+    if row_diff:
+        yield f"{current}: " + "; ".join(row_diff)
+
+    for key in result['only1']:
+        yield f"{key}: нет во втором файле"
+    for key in result['only2']:
+        yield f"{key}: нет в первом файле"
@@ -0,0 +1,130 @@
+"""
+Явные типы ключевых столбцов реестра.
+
+Из xlsx идентификаторы и реквизиты приходят вперемешку текстом и числами,
+а в столбцах с пустыми ячейками - как float (229020.0, 1.2e11), из-за чего
+у ИИН пропадают ведущие нули и появляются ложные различия. После чтения
+эти столбцы приводятся к компактным типам с точным сравнением:
+
+    Идентификатор обучающегося - текст в единой записи (см. ниже): ведущие нули
+        значимы, а "000123" и "123" - разные студенты, поэтому в число не переводится
+    ИИН - Int64 (12 цифр, ведущие нули восстанавливаются при выводе)
+    ИИК - 20 байт фиксированной длины (pyarrow fixed_size_binary)
+    БИК - category
+
+Если значение в тип не укладывается (ИИН с буквами, ИИК не из 20 символов),
+столбец остается текстом, но в единой записи: без пробелов по краям, целые
+числа без ".0", ИИН дополнен нулями до 12 цифр, ИИК и БИК в верхнем регистре.
+"""
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+except ImportError:  # pyarrow необязателен, без него ИИК остается текстом
+    pa = None
+
+ID_COLUMN = "Идентификатор обучающегося"
+IIN_WIDTH = 12
+IIK_WIDTH = 20
+
+# Столбец -> вид значения
+SCHEMA = {
+    ID_COLUMN: 'id',
+    "ИИН": 'iin',
+    "ИИК": 'iik',
+    "БИК": 'bik',
+}
+
+
+def _text(values):
+    """
+    Единая текстовая запись значений: без пробелов по краям, целые числа без ".0". Пустые остаются пустыми.
+    """
+    return values.astype('str').str.strip().str.replace(r'^(-?\d+)\.0$', r'\1', regex=True)
+
+
+def to_date(values):
+    """
+    Даты из реестра: ISO (ГГГГ-ММ-ДД) разбирается как есть, остальные записи - день первым
+    (ДД.ММ.ГГГГ). Нераспознанные значения становятся NaT.
+    """
+    iso = pd.to_datetime(values, errors='coerce', format='ISO8601')
+    return iso.fillna(pd.to_datetime(values, errors='coerce', format='mixed', dayfirst=True))
+
+
+def _all_match(text, pattern):
+    return bool((text.isna() | text.str.fullmatch(pattern)).all())
+
+
+def _id(values):
+    return _text(values)
+
+
+def _iin(values):
+    text = _text(values)
+    if _all_match(text, r'\d{1,%d}' % IIN_WIDTH):
+        return text.astype('Int64')
+    # ИИН, сохраненный числом, потерял ведущие нули - возвращаем их
+    digits = text.str.fullmatch(r'\d{1,%d}' % IIN_WIDTH)
+    return text.where(~digits, text.str.zfill(IIN_WIDTH))
+
+
+def _iik(values):
+    text = _text(values).str.upper()
+    if pa is None or not _all_match(text, r'[0-9A-Z]{%d}' % IIK_WIDTH):
+        return text
+    strings = pa.array(text.to_numpy(dtype=object), type=pa.string(), from_pandas=True)
+    fixed = pc.cast(pc.cast(strings, pa.binary()), pa.binary(IIK_WIDTH))
+    return pd.Series(pd.arrays.ArrowExtensionArray(fixed), index=values.index, name=values.name)
+
+
+def _bik(values):
+    return _text(values).str.upper().astype('category')
+
+
+CONVERTERS = {
+    'id': _id,
+    'iin': _iin,
+    'iik': _iik,
+    'bik': _bik,
+}
+
+
+def apply_schema(data):
+    """
+    Приводит столбцы из SCHEMA, которые есть в таблице, к их типам.
+    """
+    converted = {column: CONVERTERS[kind](data[column]) for column, kind in SCHEMA.items()
+                 if column in data.columns}
+    return data.assign(**converted) if converted else data
+
+
+def as_text(values, column=None):
+    """
+    Значения столбца так, как их видит пользователь: ИИН из 12 цифр, ИИК и БИК строками.
+    Столбцы обычных типов возвращаются без изменений.
+    """
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        return values.astype('str')
+    if isinstance(dtype, pd.ArrowDtype) and pa is not None and pa.types.is_fixed_size_binary(dtype.pyarrow_dtype):
+        strings = pc.cast(pc.cast(pa.array(values.array), pa.binary()), pa.string())
+        return strings.to_pandas().astype('str').set_axis(values.index).rename(values.name)
+    if isinstance(dtype, pd.Int64Dtype):
+        text = values.astype('str')
+        return text.str.zfill(IIN_WIDTH) if SCHEMA.get(column) == 'iin' else text
+    return values
+
+
+def comparable(values1, values2, column=None):
+    """
+    Приводит два столбца к одному типу для поэлементного сравнения: у категорий
+    объединяются наборы значений, разные типы сравниваются по текстовой записи.
+    """
+    if isinstance(values1.dtype, pd.CategoricalDtype) and isinstance(values2.dtype, pd.CategoricalDtype):
+        categories = values1.cat.categories.union(values2.cat.categories)
+        return values1.cat.set_categories(categories), values2.cat.set_categories(categories)
+    if values1.dtype == values2.dtype:
+        return values1, values2
+    return as_text(values1, column), as_text(values2, column)
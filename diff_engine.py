@@ -0,0 +1,467 @@
+"""
+Движок сверки двух выгрузок реестра обучающихся.
+
+Оба файла один раз выравниваются по идентификатору обучающегося, после чего
+все поля сравниваются целыми столбцами. Результат - одна таблица различий,
+из которой строятся все отчеты по полям.
+
+Что и как сравнивается, описано в реестре правил RULE_REGISTRY. Чтобы добавить
+новое поле, достаточно добавить в него запись.
+"""
+import hashlib
+import itertools
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import column_types
+
+ID_COLUMN = column_types.ID_COLUMN
+SCHOLARSHIP_COLUMN = "Вид стипендии"  # Проверяем наличие данных
+PERFORMANCE_COLUMN = "Общая успеваемость"  # Проверяем, входит ли в [0, 1, 3]
+
+# Реестр правил сверки, порядок записей - порядок отчетов.
+#   key       - ключ отчета
+#   title     - как поле называется в заголовке отчета ("Изменения по ...")
+#   label     - подпись значений в строках отчета (File1_<label>, File2_<label>)
+#   columns   - сравниваемые столбцы
+#   normalize - приведение значений перед сравнением: raw, strip, upper, date
+#   predicate - проверка: differs (значения расходятся) или scholarship
+#   expiry    - столбец с датой окончания, которая выводится вместе с расхождением
+RULE_REGISTRY = [
+    {'key': 'iik', 'title': 'ИИК', 'label': 'ИИК', 'columns': ["ИИК"], 'normalize': 'upper'},
+    {'key': 'bik', 'title': 'БИК', 'label': 'БИК', 'columns': ["БИК"], 'normalize': 'upper'},
+    {'key': 'iin', 'title': 'ИИН', 'label': 'IIN', 'columns': ["ИИН"], 'normalize': 'strip'},
+    {'key': 'date', 'title': 'датам приказов', 'label': 'Date',
+     'columns': ["Приказ о назначении стипендии"], 'normalize': 'strip'},
+    {'key': 'sirota', 'title': 'сиротам', 'label': 'SIROTA', 'columns': ["Сирота"], 'normalize': 'strip'},
+    {'key': 'kvota', 'title': 'квоте', 'label': 'Kvota', 'columns': ["Квота"], 'normalize': 'strip'},
+    {'key': 'hear', 'title': 'слуху', 'label': 'Hear', 'columns': ["Имеет инвалидность по слуху"],
+     'normalize': 'strip', 'expiry': "Дата окончания инвалидности"},
+    {'key': 'step', 'title': 'стипендий', 'label': ('Вид_стипендий', 'Общая_успеваемость'),
+     'columns': [SCHOLARSHIP_COLUMN, PERFORMANCE_COLUMN], 'predicate': 'scholarship',
+     'performance': [0, 1, 3]},
+    {'key': 'vision', 'title': 'зрению', 'label': 'vision', 'columns': ["Имеет инвалидность по зрению"],
+     'normalize': 'strip', 'expiry': "Дата окончания инвалидности.1"},
+    {'key': 'period', 'title': 'периоду', 'label': 'Period', 'columns': ["Unnamed: 26"], 'normalize': 'strip'},
+]
+
+RULE_DEFAULTS = {'normalize': 'raw', 'predicate': 'differs', 'expiry': None}
+
+# Столбцы таблицы различий: поле, идентификатор, значения из обоих файлов
+# и дополнительные значения (даты инвалидности, успеваемость)
+DIFF_COLUMNS = ['field', 'ID', 'value1', 'value2', 'extra1', 'extra2']
+
+# Параллельная проверка включается, когда на каждый процесс приходится хотя бы столько строк
+MIN_CHUNK_ROWS = 5000
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def _strip(values):
+    if isinstance(values.dtype, pd.StringDtype):
+        return values.str.strip()
+    if values.dtype == object:
+        return values.map(lambda value: value.strip() if isinstance(value, str) else value)
+    return values
+
+
+def _upper(values):
+    values = _strip(values)
+    if isinstance(values.dtype, pd.StringDtype):
+        return values.str.upper()
+    if values.dtype == object:
+        return values.map(lambda value: value.upper() if isinstance(value, str) else value)
+    return values
+
+
+def _to_date(values):
+    # Так же, как даты рождения в matching; нераспознанные даты становятся NaT
+    return column_types.to_date(values)
+
+
+# Приведение значений перед сравнением. Пустые значения остаются пустыми.
+NORMALIZERS = {
+    'raw': lambda values: values,
+    'strip': _strip,
+    'upper': _upper,
+    'date': _to_date,
+}
+
+
+def compile_plan(registry=None):
+    """
+    Собирает из реестра план проверки: правила с заполненными значениями
+    по умолчанию и список пар (столбец, приведение), которые нужно вычислить.
+    Каждая пара вычисляется один раз на всю таблицу, сколько бы правил ее ни использовало.
+    """
+    rules = [dict(RULE_DEFAULTS, **rule) for rule in (RULE_REGISTRY if registry is None else registry)]
+    prepared = []
+    for rule in rules:
+        if rule['normalize'] not in NORMALIZERS:
+            raise ValueError(f"Неизвестное приведение {rule['normalize']!r} в правиле {rule['key']!r}")
+        if rule['predicate'] not in PREDICATES:
+            raise ValueError(f"Неизвестная проверка {rule['predicate']!r} в правиле {rule['key']!r}")
+        needed = [(column, rule['normalize']) for column in rule['columns']]
+        if rule['expiry']:
+            needed.append((rule['expiry'], 'date'))
+        for item in needed:
+            if item not in prepared:
+                prepared.append(item)
+    return {'rules': rules, 'prepared': prepared}
+
+
+def report_headers(rule):
+    """
+    Названия столбцов в заголовке текстового отчета по правилу.
+    """
+    if rule['predicate'] == 'scholarship':
+        return ["ID"] + [f"File1_{label}" for label in rule['label']]
+    return ["ID", f"File1_{rule['label']}", f"File2_{rule['label']}"]
+
+
+def missing_columns(data):
+    """
+    Возвращает обязательные столбцы, которых нет в таблице.
+    """
+    return [col for col in REQUIRED_COLUMNS if col not in data.columns]
+
+
+def index_by_id(data, column=ID_COLUMN):
+    """
+    Индексирует таблицу по идентификатору обучающегося (или другому ключевому столбцу).
+
+    Строки без идентификатора (например, строка подзаголовков под шапкой)
+    отбрасываются, из повторяющихся идентификаторов остается первый.
+    """
+    data = data[data[column].notna().to_numpy()]
+    ids = column_types.as_text(data[column], column).astype(str)
+    first = ~ids.duplicated(keep='first').to_numpy()
+    # Индекс из обычных строк Python: поиск по нему (isin, loc) идет через хэш-таблицу
+    index = pd.Index(ids[first].to_numpy(dtype=object), dtype=object, name=column)
+    return data[first].set_axis(index, axis=0)
+
+
+def align_frames(data1, data2):
+    """
+    Выравнивает обе таблицы по общим идентификаторам (в порядке первого файла).
+    """
+    return align_indexed(index_by_id(data1), index_by_id(data2))
+
+
+def align_indexed(left, right):
+    """
+    Выравнивает уже проиндексированные таблицы (index_by_id). Позволяет проиндексировать
+    эталонный файл один раз и сравнивать с ним много других.
+    """
+    common_ids = left.index[left.index.isin(right.index)]
+    return left.loc[common_ids], right.loc[common_ids]
+
+
+def values_differ(values1, values2):
+    """
+    Сравнивает два выровненных столбца целиком.
+
+    Пустые значения с обеих сторон считаются совпадающими, пустое значение
+    против заполненного - различием.
+    """
+    if values1.dtype != values2.dtype:
+        values1 = values1.astype(object)
+        values2 = values2.astype(object)
+    both_missing = values1.isna() & values2.isna()
+    # У типов с пропусками (Int64, pyarrow) сравнение с пустым дает NA, а не False
+    equal = values1.eq(values2).fillna(False).astype(bool)
+    return ~(equal | both_missing)
+
+
+def _step_flags(data, performance):
+    """
+    Отмечает студентов, у которых есть вид стипендии и успеваемость из списка.
+    Одна маска на всю таблицу, без прохода по строкам.
+    """
+    flags = data[SCHOLARSHIP_COLUMN].notna().to_numpy() & data[PERFORMANCE_COLUMN].isin(performance).to_numpy()
+    return pd.Series(flags, index=data.index, dtype=bool)
+
+
+def expired_flags(dates, today):
+    """
+    Отмечает даты окончания раньше today. Столбец переводится в даты один раз
+    и сравнивается с одной датой целиком; пустые и нераспознанные даты не считаются истекшими.
+    """
+    return (pd.to_datetime(pd.Series(dates, dtype=object), errors='coerce') < pd.Timestamp(today)).to_numpy()
+
+
+def _check_differs(rule, left, right, normalized1, normalized2):
+    """
+    Строки, где приведенные значения поля в файлах расходятся.
+    В отчет попадают исходные значения.
+    """
+    column = rule['columns'][0]
+    mask = values_differ(*column_types.comparable(
+        normalized1[(column, rule['normalize'])], normalized2[(column, rule['normalize'])], column))
+    if not mask.any():
+        return None
+    part = pd.DataFrame({
+        'field': rule['key'],
+        'ID': left.index[mask.to_numpy()],
+        'value1': column_types.as_text(left.loc[mask, column], column).to_numpy(dtype=object),
+        'value2': column_types.as_text(right.loc[mask, column], column).to_numpy(dtype=object),
+    })
+    if rule['expiry']:
+        part['extra1'] = normalized1[(rule['expiry'], 'date')][mask].dt.date.to_numpy(dtype=object)
+        part['extra2'] = normalized2[(rule['expiry'], 'date')][mask].dt.date.to_numpy(dtype=object)
+    return part
+
+
+def _check_scholarship(rule, left, right, normalized1, normalized2):
+    """
+    Есть вид стипендии при недопустимой успеваемости, проверяется в каждом файле отдельно.
+    """
+    step1 = _step_flags(left, rule['performance'])
+    step2 = _step_flags(right, rule['performance'])
+    step = step1 | step2
+    if not step.any():
+        return None
+    return pd.DataFrame({
+        'field': rule['key'],
+        'ID': left.index[step.to_numpy()],
+        'value1': left.loc[step, SCHOLARSHIP_COLUMN].where(step1[step]).to_numpy(dtype=object),
+        'value2': right.loc[step, SCHOLARSHIP_COLUMN].where(step2[step]).to_numpy(dtype=object),
+        'extra1': left.loc[step, PERFORMANCE_COLUMN].where(step1[step]).to_numpy(dtype=object),
+        'extra2': right.loc[step, PERFORMANCE_COLUMN].where(step2[step]).to_numpy(dtype=object),
+    })
+
+
+# Проверки, на которые ссылаются правила реестра
+PREDICATES = {
+    'differs': _check_differs,
+    'scholarship': _check_scholarship,
+}
+
+PLAN = compile_plan()
+
+REQUIRED_COLUMNS = [ID_COLUMN] + [column for column, _ in PLAN['prepared']
+                                  if column != ID_COLUMN]
+
+# Отчеты по полям: ключ, заголовок и названия столбцов в тексте отчета
+REPORTS = [(rule['key'], rule['title'], report_headers(rule)) for rule in PLAN['rules']]
+
+REPORT_KEYS = [key for key, _, _ in REPORTS]
+
+
+def _evaluate_chunk(plan, left, right):
+    """
+    Вычисляет приведенные столбцы один раз и применяет к ним все правила плана.
+    """
+    normalized1 = {}
+    normalized2 = {}
+    for column, normalize in plan['prepared']:
+        normalized1[(column, normalize)] = NORMALIZERS[normalize](left[column])
+        normalized2[(column, normalize)] = NORMALIZERS[normalize](right[column])
+    return [PREDICATES[rule['predicate']](rule, left, right, normalized1, normalized2)
+            for rule in plan['rules']]
+
+
+def _get_pool(workers):
+    """
+    Пул процессов создается один раз и переиспользуется между сверками.
+    Процессы запускаются через spawn: fork из многопоточного веб-сервера небезопасен.
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = workers
+        return _pool
+
+
+def evaluate_rules(left, right, plan=None, workers=1):
+    """
+    Применяет правила к выровненным таблицам.
+
+    При workers > 1 и достаточном числе строк таблицы делятся на части по строкам,
+    которые обрабатываются пулом процессов. Результаты собираются в порядке
+    правил, а внутри правила - в порядке частей, поэтому совпадают с последовательным вариантом.
+    """
+    plan = PLAN if plan is None else plan
+    chunks = min(workers, len(left) // MIN_CHUNK_ROWS)
+
+    if chunks <= 1:
+        results = [_evaluate_chunk(plan, left, right)]
+    else:
+        pool = _get_pool(workers)
+        bounds = np.linspace(0, len(left), chunks + 1, dtype=int)
+        futures = [
+            pool.submit(_evaluate_chunk, plan, left.iloc[start:stop], right.iloc[start:stop])
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ]
+        results = [future.result() for future in futures]
+
+    parts = [chunk_parts[i] for i in range(len(plan['rules'])) for chunk_parts in results
+             if chunk_parts[i] is not None]
+    if not parts:
+        return pd.DataFrame(columns=DIFF_COLUMNS)
+    return pd.concat(parts, ignore_index=True).reindex(columns=DIFF_COLUMNS)
+
+
+def build_diff_table(data1, data2, workers=1):
+    """
+    Строит таблицу различий между двумя выгрузками.
+
+    Каждая строка - одно расхождение по полю для одного студента.
+    """
+    left, right = align_frames(data1, data2)
+    return evaluate_rules(left, right, workers=workers)
+
+
+def plan_signature(plan=None):
+    """
+    Отпечаток набора правил: сохраненные результаты годятся только для того же плана.
+    """
+    plan = PLAN if plan is None else plan
+    return hashlib.sha256(repr(plan['rules']).encode('utf-8')).hexdigest()
+
+
+def row_fingerprints(data, plan=None):
+    """
+    Хэш сравниваемых столбцов каждой строки, индекс - идентификатор обучающегося.
+    """
+    plan = PLAN if plan is None else plan
+    columns = list(dict.fromkeys(column for column, _ in plan['prepared']))
+    return pd.util.hash_pandas_object(data[columns], index=False)
+
+
+def build_diff_table_incremental(data1, data2, previous=None, workers=1, aligned=None):
+    """
+    Строит таблицу различий, пересчитывая только добавленные, удаленные
+    и измененные с прошлого запуска строки.
+
+    previous - состояние, возвращенное прошлым вызовом (или None).
+    aligned - уже выровненные строки (left, right), например после сопоставления
+    модулем matching; по умолчанию таблицы выравниваются по идентификатору.
+    Возвращает (таблица различий, новое состояние, статистика).
+    Результат совпадает с build_diff_table для тех же файлов.
+    """
+    left, right = aligned if aligned is not None else align_frames(data1, data2)
+    fingerprints1 = row_fingerprints(left)
+    fingerprints2 = row_fingerprints(right)
+    signature = plan_signature()
+
+    if previous is None or previous.get('plan') != signature:
+        diffs = evaluate_rules(left, right, workers=workers)
+        stats = {'inserted': len(left), 'deleted': 0, 'changed': 0, 'evaluated': len(left)}
+    else:
+        # Строки, которых не было среди общих в прошлый раз, пересчитываются целиком
+        inserted = ~left.index.isin(previous['fingerprints1'].index)
+        old1 = previous['fingerprints1'].reindex(left.index, fill_value=0).to_numpy()
+        old2 = previous['fingerprints2'].reindex(left.index, fill_value=0).to_numpy()
+        changed = ~inserted & ((old1 != fingerprints1.to_numpy()) | (old2 != fingerprints2.to_numpy()))
+        dirty = inserted | changed
+
+        old_diffs = previous['diffs']
+        deleted_ids = previous['fingerprints1'].index.difference(left.index)
+        kept = old_diffs[old_diffs['ID'].isin(left.index[~dirty])]
+        fresh = evaluate_rules(left[dirty], right[dirty], workers=workers)
+
+        # Порядок как при полном пересчете: по правилам, внутри правила - по порядку строк
+        rule_order = {rule['key']: i for i, rule in enumerate(PLAN['rules'])}
+        row_order = pd.Series(np.arange(len(left)), index=left.index)
+        parts = [part for part in (kept, fresh) if len(part)]
+        diffs = pd.concat(parts, ignore_index=True) if parts else fresh
+        order = np.lexsort((row_order.reindex(diffs['ID']).to_numpy(),
+                            diffs['field'].map(rule_order).to_numpy()))
+        diffs = diffs.iloc[order].reset_index(drop=True)
+        stats = {'inserted': int(inserted.sum()), 'deleted': len(deleted_ids),
+                 'changed': int(changed.sum()), 'evaluated': int(dirty.sum())}
+
+    state = {
+        'plan': signature,
+        'fingerprints1': fingerprints1,
+        'fingerprints2': fingerprints2,
+        'diffs': diffs,
+    }
+    return diffs, state, stats
+
+
+def get_rule(key):
+    """
+    Возвращает правило плана по ключу отчета.
+    """
+    return next(rule for rule in PLAN['rules'] if rule['key'] == key)
+
+
+def iter_report_entries(diffs, key, today=None):
+    """
+    Отдает строки отчета по полю по одной, в виде словарей, как они пишутся в текстовый отчет.
+    """
+    today = today or datetime.today().date()
+    rule = get_rule(key)
+    rows = diffs[diffs['field'] == key]
+
+    if rule['predicate'] == 'scholarship':
+        value_label, extra_label = rule['label']
+        for row in rows.itertuples(index=False):
+            if pd.notna(row.value1):
+                yield {
+                    "ID": row.ID,
+                    f"File1_{value_label}": row.value1,
+                    f"File1_{extra_label}": row.extra1
+                }
+            if pd.notna(row.value2):
+                yield {
+                    "ID": row.ID,
+                    f"File2_{value_label}": row.value2,
+                    f"File2_{extra_label}": row.extra2
+                }
+        return
+
+    if not rule['expiry']:
+        for row in rows.itertuples(index=False):
+            yield {"ID": row.ID, f"File1_{rule['label']}": row.value1, f"File2_{rule['label']}": row.value2}
+        return
+
+    # Истечение сроков считается сразу для всех строк отчета
+    expired1 = expired_flags(rows['extra1'], today)
+    expired2 = expired_flags(rows['extra2'], today)
+    for row, is_expired1, is_expired2 in zip(rows.itertuples(index=False), expired1, expired2):
+        yield {
+            "ID": row.ID,
+            f"File1_{rule['label']}": row.value1,
+            f"File2_{rule['label']}": row.value2,
+            "File1_Date": row.extra1 if pd.notna(row.extra1) else None,
+            "File2_Date": row.extra2 if pd.notna(row.extra2) else None,
+            "Expired_File1": "Да" if is_expired1 else "Нет",
+            "Expired_File2": "Да" if is_expired2 else "Нет"
+        }
+
+
+def report_entries(diffs, key, today=None):
+    """
+    Возвращает строки отчета по полю списком.
+    """
+    return list(iter_report_entries(diffs, key, today))
+
+
+def write_text_report(diffs, key, report_path, today=None):
+    """
+    Пишет текстовый отчет по полю построчно. Если различий нет, файл не создается и возвращается False.
+    """
+    entries = iter_report_entries(diffs, key, today)
+    first = next(entries, None)
+    if first is None:
+        return False
+    rule = get_rule(key)
+    with open(report_path, 'w', encoding='utf-8') as f:
+        f.write(f"Изменения по {rule['title']}:\n")
+        f.write(", ".join(report_headers(rule)) + "\n")
+        for diff in itertools.chain([first], entries):
+            f.write(", ".join([f"{name}: {value}" for name, value in diff.items()]) + "\n")
+    return True
@@ -0,0 +1,127 @@
+"""
+Потоковое чтение больших выгрузок Excel.
+
+Лист читается построчно в режиме read-only, строка заголовков определяется
+один раз, а данные отдаются пачками (DataFrame) только по нужным столбцам.
+При обходе iter_batches память зависит от размера пачки и числа выбранных
+столбцов, а не от размера файла. read_frame склеивает все пачки в одну
+таблицу, поэтому держит в памяти выбранные столбцы файла целиком (но не
+лишние столбцы и не промежуточные объекты openpyxl).
+"""
+from openpyxl import load_workbook
+import pandas as pd
+
+import column_types
+
+# В выгрузках реестра над таблицей идет шапка отчета из 5 строк
+PREAMBLE_ROWS = 5
+BATCH_SIZE = 5000
+
+
+def header_skiprows(first_row):
+    """
+    Проверяет первую строку и определяет, нужно ли skiprows=5 на основе количества Unnamed столбцов.
+    """
+    unnamed_columns = sum(value is None for value in first_row)  # Считаем "Unnamed" столбцы
+    if unnamed_columns > len(first_row) / 2:  # Если более половины столбцов "Unnamed"
+        return PREAMBLE_ROWS
+    return 0
+
+
+def column_names(header):
+    """
+    Формирует имена столбцов так же, как pandas.read_excel:
+    пустые ячейки становятся "Unnamed: N", повторы получают суффикс ".1", ".2"...
+    """
+    names = []
+    seen = {}
+    for i, value in enumerate(header):
+        name = f"Unnamed: {i}" if value is None else value
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _cell_value(value):
+    # Как и pandas, целые числа из Excel не оставляем float
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _open_rows(file_path):
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    sheet = workbook.active
+    return workbook, sheet.max_column, sheet.iter_rows(values_only=True)
+
+
+def _read_header(rows, width):
+    """
+    Читает строки до заголовка включительно и возвращает имена столбцов.
+    """
+    first_row = next(rows, ())
+    if width and len(first_row) < width:
+        first_row = tuple(first_row) + (None,) * (width - len(first_row))
+    header = first_row
+    for _ in range(header_skiprows(first_row)):
+        header = next(rows, ())
+    return column_names(header)
+
+
+def read_header(file_path):
+    """
+    Возвращает список столбцов файла, не читая сами данные.
+    """
+    workbook, width, rows = _open_rows(file_path)
+    try:
+        return _read_header(rows, width)
+    finally:
+        workbook.close()
+
+
+def iter_batches(file_path, columns=None, batch_size=BATCH_SIZE):
+    """
+    Построчно читает лист и отдает пачки DataFrame по выбранным столбцам.
+
+    Полностью пустые строки пропускаются. Столбцы, которых нет в файле,
+    в пачках отсутствуют - проверка обязательных столбцов остается за вызывающим кодом.
+    """
+    workbook, width, rows = _open_rows(file_path)
+    try:
+        names = _read_header(rows, width)
+        if columns is None:
+            selected = list(enumerate(names))
+        else:
+            wanted = set(columns)
+            selected = [(i, name) for i, name in enumerate(names) if name in wanted]
+
+        buffers = {name: [] for _, name in selected}
+        count = 0
+        yielded = False
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            for i, name in selected:
+                buffers[name].append(_cell_value(row[i]) if i < len(row) else None)
+            count += 1
+            if count == batch_size:
+                yield pd.DataFrame(buffers, columns=[name for _, name in selected])
+                buffers = {name: [] for _, name in selected}
+                count = 0
+                yielded = True
+        if count or not yielded:
+            yield pd.DataFrame(buffers, columns=[name for _, name in selected])
+    finally:
+        workbook.close()
+
+
+def read_frame(file_path, columns=None, batch_size=BATCH_SIZE):
+    """
+    Собирает пачки в одну таблицу. В памяти хранятся только выбранные столбцы,
+    идентификаторы и реквизиты приводятся к своим типам (column_types).
+    """
+    return column_types.apply_schema(pd.concat(list(iter_batches(file_path, columns, batch_size)), ignore_index=True))
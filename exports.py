@@ -0,0 +1,196 @@
+"""
+Выгрузка различий в CSV, XLSX и Parquet и zip-архив отчетов потоком.
+
+Выгрузки строятся из строк таблицы различий (кортежи в порядке столбцов),
+а не из готовых текстовых отчетов: строки берутся по одной из DataFrame
+(frame_rows) или из курсора хранилища результатов, поэтому выгрузка любой
+выборки не требует держать ее в памяти целиком. CSV отдается кусками прямо
+в ответ, XLSX пишется openpyxl в режиме write-only, Parquet - группами строк.
+
+Zip-архив собирается на лету: каждый файл дописывается в архив кусками,
+и готовые байты сразу уходят клиенту, архив целиком нигде не хранится.
+"""
+import csv
+import io
+import zipfile
+from datetime import date, datetime
+
+FORMATS = ('csv', 'xlsx', 'parquet')
+MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'parquet': 'application/vnd.apache.parquet',
+    'zip': 'application/zip',
+}
+BATCH_ROWS = 10000
+COPY_CHUNK_SIZE = 256 * 1024
+SHEET_TITLE = 'Различия'
+
+
+def _cell(value):
+    """
+    Значение для выгрузки: пустые - None, скаляры numpy - обычные числа Python.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    try:
+        if value != value:  # NaN, NaT
+            return None
+    except TypeError:
+        return None  # pd.NA не сравнивается
+    if hasattr(value, 'item') and not isinstance(value, (datetime, date)):
+        return value.item()
+    return value
+
+
+def _text(value):
+    value = _cell(value)
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def frame_rows(diffs, columns, prefix=()):
+    """
+    Строки таблицы различий diffs по столбцам columns; prefix добавляется в начало каждой строки.
+    """
+    for row in zip(*(diffs[column] for column in columns)):
+        yield tuple(prefix) + tuple(_cell(value) for value in row)
+
+
+def _batches(rows, size=BATCH_ROWS):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def iter_csv(columns, rows):
+    """
+    CSV (UTF-8 с BOM, чтобы Excel открыл кириллицу) кусками байтов по BATCH_ROWS строк.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+    for batch in _batches(rows):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(['' if value is None else _text(value) for value in row] for row in batch)
+        yield buffer.getvalue().encode('utf-8')
+
+
+def write_csv(columns, rows, path):
+    with open(path, 'wb') as f:
+        for chunk in iter_csv(columns, rows):
+            f.write(chunk)
+
+
+def _xlsx_value(value):
+    value = _cell(value)
+    if value is None or isinstance(value, (str, int, float, datetime, date)):
+        return value
+    return str(value)
+
+
+def write_xlsx(columns, rows, path):
+    """
+    XLSX в режиме write-only: строки сразу пишутся во временный XML листа, а не копятся в книге.
+    """
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(SHEET_TITLE)
+    sheet.append(list(columns))
+    for row in rows:
+        sheet.append([_xlsx_value(value) for value in row])
+    workbook.save(path)
+
+
+def write_parquet(columns, rows, path):
+    """
+    Parquet со строковыми столбцами, по группе строк на BATCH_ROWS различий.
+    Значения различий бывают разных типов, поэтому пишутся текстом, как в хранилище результатов.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in _batches(rows):
+            arrays = [pa.array([_text(row[index]) for row in batch], type=pa.string())
+                      for index in range(len(columns))]
+            writer.write_batch(pa.record_batch(arrays, schema=schema))
+        # Пустая выборка - файл только со схемой
+
+
+WRITERS = {
+    'csv': write_csv,
+    'xlsx': write_xlsx,
+    'parquet': write_parquet,
+}
+
+
+def write(fmt, columns, rows, path):
+    """
+    Пишет строки в файл формата fmt из FORMATS.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f'Неизвестный формат выгрузки: {fmt}')
+    WRITERS[fmt](columns, rows, path)
+    return path
+
+
+def file_chunks(path, chunk_size=COPY_CHUNK_SIZE):
+    with open(path, 'rb') as f:
+        yield from iter(lambda: f.read(chunk_size), b'')
+
+
+class _ZipStream(io.RawIOBase):
+    """
+    Поток без перемотки, в который пишет ZipFile: записанное забирается через take().
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(entries):
+    """
+    Zip-архив кусками байтов. entries - пары (имя в архиве, куски байтов содержимого).
+    Размер содержимого заранее не нужен: ZipFile пишет его после данных файла.
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, chunks in entries:
+            info = zipfile.ZipInfo(name, date_time=datetime.now().timetuple()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            with archive.open(info, 'w', force_zip64=True) as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    data = stream.take()
+                    if data:
+                        yield data
+            data = stream.take()
+            if data:
+                yield data
+    yield stream.take()
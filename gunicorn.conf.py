@@ -0,0 +1,54 @@
+"""
+Настройки gunicorn для промышленного запуска (файл подхватывается автоматически):
+
+    gunicorn wsgi:app
+
+Несколько процессов (prefork), в каждом пул потоков (gthread): пока один поток
+принимает загрузку или отдает архив медленному клиенту, остальные обслуживают
+вход и опрос задач. Сверка в поток запроса не попадает - она идет в фоновых
+задачах (JobQueue) и пулах процессов, а состояние задач и ключ сессий общие
+для всех процессов. За nginx загрузки буферизует и файлы отчетов отдает сам
+nginx (deploy/nginx.conf).
+
+Переменные окружения:
+    BIND             адрес, по умолчанию 127.0.0.1:8000
+    WEB_CONCURRENCY  число процессов, по умолчанию ядра + 1, но не больше 8
+    WEB_THREADS      потоков на процесс, по умолчанию 8
+    WEB_TIMEOUT      секунд на запрос, по умолчанию 120
+а также JOB_WORKERS, DIFF_WORKERS, BATCH_WORKERS приложения - по умолчанию
+они делят ядра между процессами, чтобы задачи разных процессов не дрались за CPU.
+
+Очередь задач (JOB_WORKERS, JOB_QUEUE_DEPTH) и метрики /metrics у каждого
+процесса свои: общая емкость - число процессов, умноженное на эти значения,
+а /metrics показывает только процесс, принявший запрос (см. metrics.py).
+"""
+import os
+
+_cpus = os.cpu_count() or 1
+
+bind = os.environ.get('BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', min(_cpus + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 8))
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+# Фоновые задачи процесса доделываются при плавной перезагрузке
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 300))
+keepalive = 5
+
+# Приложение загружается в каждом процессе после fork: соединения SQLite и потоки
+# очереди задач не должны переходить из главного процесса в рабочие
+preload_app = False
+# Процесс с незавершенными задачами не перезапускаем по числу запросов
+max_requests = 0
+# Отметки живости процессов - в памяти, а не на диске
+worker_tmp_dir = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+# Запросы и так пишутся JSON-логом "reconcile" (metrics.py)
+accesslog = None
+errorlog = '-'
+forwarded_allow_ips = os.environ.get('FORWARDED_ALLOW_IPS', '127.0.0.1')
+
+# Одна фоновая сверка на процесс, пулы процессов сверки делят ядра между процессами сервера
+os.environ.setdefault('JOB_WORKERS', '1')
+os.environ.setdefault('DIFF_WORKERS', str(max(1, _cpus // workers)))
+os.environ.setdefault('BATCH_WORKERS', str(max(1, _cpus // workers)))
@@ -0,0 +1,324 @@
+"""
+Фоновые задачи сверки.
+
+Тяжелая обработка (чтение файлов, сравнение, отчеты, PDF) выполняется пулом
+рабочих потоков, а HTTP-запрос сразу получает идентификатор задачи и затем
+опрашивает ее состояние. Число одновременно выполняемых задач и длина очереди ограничены.
+
+Если задано хранилище (JobStore), состояние и результат задачи пишутся еще и
+в SQLite: под сервером с несколькими процессами запрос о задаче может прийти
+в другой процесс, и тот прочитает ее оттуда. Опрос состояния читает только
+столбцы состояния, результат загружается, только когда его показывают.
+
+Процесс, у которого есть незавершенные задачи, раз в HEARTBEAT_INTERVAL секунд
+отмечается в их строках. Если отметки нет дольше HEARTBEAT_TIMEOUT, процесс
+считается упавшим, а задача - прерванной. Это работает и с процессами на
+других машинах и в других контейнерах, где номер процесса ничего не говорит.
+Очередь и ее ограничения у каждого процесса свои.
+"""
+import os
+import pickle
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from auth_store import ConnectionPool
+from reconcile import ReconcileError
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Завершенные задачи хранятся час, затем забываются
+FINISHED_JOB_TTL = 60 * 60
+# Как часто процесс отмечается в своих незавершенных задачах и через сколько без отметки он считается упавшим
+HEARTBEAT_INTERVAL = 10
+HEARTBEAT_TIMEOUT = 60
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        owner TEXT,
+        status TEXT NOT NULL,
+        stage TEXT,
+        rows_processed INTEGER,
+        rows_total INTEGER,
+        error TEXT,
+        created REAL NOT NULL,
+        started REAL,
+        finished REAL,
+        worker TEXT,
+        heartbeat REAL,
+        result BLOB
+    );
+    CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (finished);
+'''
+STATE_COLUMNS = ('id', 'kind', 'owner', 'status', 'stage', 'rows_processed', 'rows_total', 'error',
+                 'created', 'started', 'finished', 'worker', 'heartbeat')
+# Столбцы, добавленные после первой версии таблицы
+ADDED_COLUMNS = {'worker': 'TEXT', 'heartbeat': 'REAL'}
+
+_worker = (None, None)
+
+
+def worker_id():
+    """
+    Идентификатор текущего процесса: машина, номер процесса и случайная часть. Номер процесса
+    после перезапуска может достаться другому процессу, случайная часть - нет.
+    Считается заново после fork.
+    """
+    global _worker
+    pid = os.getpid()
+    if _worker[0] != pid:
+        _worker = (pid, f'{socket.gethostname()}:{pid}:{uuid.uuid4().hex[:8]}')
+    return _worker[1]
+
+
+class JobError(Exception):
+    """
+    Ошибка задачи, текст которой можно показать пользователю.
+    Ошибки сверки (ReconcileError) показываются так же.
+    """
+
+
+class QueueFullError(Exception):
+    """
+    Очередь задач заполнена.
+    """
+
+
+class Job:
+    """
+    Состояние одной задачи: этап, прогресс по строкам, результат или ошибка.
+    """
+
+    def __init__(self, kind, owner=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.owner = owner
+        self.status = QUEUED
+        self.stage = 'В очереди'
+        self.rows_processed = 0
+        self.rows_total = None
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        # Процесс, который выполняет задачу, и время его последней отметки в хранилище
+        self.worker = worker_id()
+        self.heartbeat = self.created
+        # Вызывается с задачей после каждого update (сохранение в JobStore)
+        self.on_update = None
+
+    def update(self, stage=None, rows_processed=None, rows_total=None):
+        """
+        Обновляет этап и счетчики прогресса. Вызывается из самой задачи.
+        """
+        if stage is not None:
+            self.stage = stage
+        if rows_processed is not None:
+            self.rows_processed = rows_processed
+        if rows_total is not None:
+            self.rows_total = rows_total
+        if self.on_update is not None:
+            self.on_update(self)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'stage': self.stage,
+            'rows_processed': self.rows_processed,
+            'rows_total': self.rows_total,
+            'error': self.error,
+        }
+
+
+class JobStore:
+    """
+    Состояние задач в SQLite, общее для всех процессов сервера. Результат хранится
+    в pickle и записывается один раз, когда задача завершилась.
+    """
+
+    def __init__(self, db_path):
+        self.pool = ConnectionPool(db_path)
+
+    def init_schema(self):
+        conn = self.pool.connection()
+        conn.executescript(SCHEMA)
+        present = {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}
+        for column, column_type in ADDED_COLUMNS.items():
+            if column not in present:
+                conn.execute(f'ALTER TABLE jobs ADD COLUMN {column} {column_type}')
+        conn.commit()
+
+    def save(self, job, with_result=False):
+        job.heartbeat = time.time()
+        values = [getattr(job, column) for column in STATE_COLUMNS]
+        conn = self.pool.connection()
+        with conn:
+            if with_result:
+                result = pickle.dumps(job.result, protocol=pickle.HIGHEST_PROTOCOL)
+                conn.execute(f'INSERT OR REPLACE INTO jobs ({", ".join(STATE_COLUMNS)}, result) '
+                             f'VALUES ({", ".join("?" * len(STATE_COLUMNS))}, ?)', values + [result])
+            else:
+                # Результат, если он уже записан, не трогаем
+                assignments = ', '.join(f'{column} = excluded.{column}' for column in STATE_COLUMNS[1:])
+                conn.execute(f'INSERT INTO jobs ({", ".join(STATE_COLUMNS)}) '
+                             f'VALUES ({", ".join("?" * len(STATE_COLUMNS))}) '
+                             f'ON CONFLICT (id) DO UPDATE SET {assignments}', values)
+
+    def load(self, job_id, with_result=False):
+        """
+        Задача из хранилища или None. Результат (pickle, бывает большим) читается, только если
+        задан with_result и задача завершена. Задача, процесс которой давно не отмечался
+        (сервер перезапущен или упал посреди обработки), помечается упавшей.
+        """
+        conn = self.pool.connection()
+        row = conn.execute(f'SELECT {", ".join(STATE_COLUMNS)} FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = Job.__new__(Job)
+        for column, value in zip(STATE_COLUMNS, row):
+            setattr(job, column, value)
+        job.result = None
+        job.on_update = None
+        if job.status in (QUEUED, RUNNING) and time.time() - (job.heartbeat or job.created) > HEARTBEAT_TIMEOUT:
+            job.status = FAILED
+            job.error = 'Обработка прервана перезапуском сервера, запустите ее еще раз.'
+            job.finished = time.time()
+            self.save(job)
+        if with_result and job.status == DONE:
+            result = conn.execute('SELECT result FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if result is not None and result[0] is not None:
+                job.result = pickle.loads(result[0])
+        return job
+
+    def heartbeat(self, worker, job_ids):
+        """
+        Отмечает, что процесс worker жив, в строках его незавершенных задач.
+        """
+        if not job_ids:
+            return
+        conn = self.pool.connection()
+        with conn:
+            conn.execute(f'UPDATE jobs SET heartbeat = ? WHERE worker = ? AND status IN (?, ?) '
+                         f'AND id IN ({", ".join("?" * len(job_ids))})',
+                         [time.time(), worker, QUEUED, RUNNING] + list(job_ids))
+
+    def prune(self, deadline):
+        conn = self.pool.connection()
+        with conn:
+            conn.execute('DELETE FROM jobs WHERE finished < ?', (deadline,))
+
+
+class JobQueue:
+    """
+    Очередь задач поверх пула потоков с ограничением параллельности и глубины очереди.
+    Ограничения действуют в пределах процесса: под gunicorn с N процессами одновременно
+    выполняется до N * max_workers задач, а в очередях ждут до N * max_queued.
+    """
+
+    def __init__(self, max_workers=2, max_queued=8, on_finish=None, store=None):
+        self.max_queued = max_queued
+        # Вызывается с задачей после ее завершения (метрики, логи)
+        self.on_finish = on_finish
+        # Общее для процессов хранилище состояния задач, необязательно
+        self.store = store
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._heartbeat_thread = None
+
+    def submit(self, kind, func, *args, owner=None):
+        """
+        Ставит func(job, *args) в очередь. Если очередь заполнена - QueueFullError.
+        """
+        job = Job(kind, owner)
+        with self._lock:
+            self._prune()
+            queued = sum(1 for known in self._jobs.values() if known.status == QUEUED)
+            if queued >= self.max_queued:
+                raise QueueFullError('Слишком много задач в очереди, попробуйте позже.')
+            self._jobs[job.id] = job
+        if self.store is not None:
+            job.on_update = self.store.save
+            self.store.save(job)
+            self._start_heartbeat()
+        self._executor.submit(self._run, job, func, args)
+        return job
+
+    def get(self, job_id, with_result=False):
+        """
+        Задача по идентификатору: из памяти процесса, а если ее запускал другой процесс - из хранилища
+        (with_result - вместе с результатом; для опроса состояния он не нужен).
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.load(job_id, with_result)
+        return job
+
+    def _start_heartbeat(self):
+        """
+        Запускает поток отметок в том процессе, где ставятся задачи (после fork потоков нет).
+        """
+        with self._lock:
+            if self._heartbeat_thread is not None and self._heartbeat_thread.is_alive():
+                return
+            self._heartbeat_thread = threading.Thread(target=self._heartbeat_loop, name='job-heartbeat', daemon=True)
+            self._heartbeat_thread.start()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(HEARTBEAT_INTERVAL)
+            with self._lock:
+                active = [job.id for job in self._jobs.values() if job.status in (QUEUED, RUNNING)]
+            try:
+                self.store.heartbeat(worker_id(), active)
+            except Exception:
+                pass  # База занята или недоступна - отметимся в следующий раз
+
+    def counts(self):
+        """
+        Число задач в памяти по состояниям.
+        """
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+        return {status: statuses.count(status) for status in (QUEUED, RUNNING, DONE, FAILED)}
+
+    def _run(self, job, func, args):
+        job.status = RUNNING
+        job.started = time.time()
+        if self.store is not None:
+            self.store.save(job)
+        try:
+            job.result = func(job, *args)
+            job.status = DONE
+            job.stage = 'Готово'
+        except (JobError, ReconcileError) as e:
+            job.error = str(e)
+            job.status = FAILED
+        except Exception as e:
+            job.error = f'Ошибка при обработке: {e}'
+            job.status = FAILED
+        finally:
+            job.finished = time.time()
+            if self.store is not None:
+                self.store.save(job, with_result=job.status == DONE)
+            if self.on_finish is not None:
+                self.on_finish(job)
+
+    def _prune(self):
+        deadline = time.time() - FINISHED_JOB_TTL
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.finished is not None and job.finished < deadline]:
+            del self._jobs[job_id]
+        if self.store is not None:
+            self.store.prune(deadline)
@@ -0,0 +1,220 @@
+"""
+Сопоставление студентов двух выгрузок, когда идентификаторы не совпадают.
+
+Сначала строки сопоставляются по идентификатору обучающегося. Оставшиеся
+(студента перерегистрировали с новым идентификатором, идентификатор набрали
+с ошибкой) сопоставляются по ступеням:
+
+    iin            - по ИИН;
+    name_birthdate - по ФИО (без регистра, знаков и разницы е/ё) и дате рождения.
+                     Если столбца с датой рождения нет, она берется из ИИН
+                     (первые 6 цифр - ГГММДД, 7-я - век), поэтому ступень ловит
+                     и ИИН с опечаткой в последних цифрах.
+
+На каждой ступени строки группируются по ключу (блокировка), пары по всем
+строкам не перебираются: ключ, который встречается ровно один раз в каждом
+файле, дает пару, а ключ с несколькими кандидатами хотя бы в одном файле -
+неоднозначное совпадение, такие строки не сопоставляются и дальше не идут.
+Все, что осталось, - строки только первого или только второго файла.
+"""
+import re
+
+import pandas as pd
+
+import column_types
+
+IIN_COLUMN = "ИИН"
+NAME_COLUMNS = ["Фамилия", "Имя", "Отчество"]
+BIRTHDATE_COLUMN = "Дата рождения"
+# Столбцы, которые нужно прочитать для сопоставления (кроме сравниваемых правилами)
+MATCH_COLUMNS = [IIN_COLUMN] + NAME_COLUMNS + [BIRTHDATE_COLUMN]
+
+ID = 'id'
+IIN = 'iin'
+NAME_BIRTHDATE = 'name_birthdate'
+STAGES = (IIN, NAME_BIRTHDATE)
+
+MATCHED = 'matched'
+AMBIGUOUS = 'ambiguous'
+ONLY1 = 'only1'
+ONLY2 = 'only2'
+# Столбцы таблицы сопоставления: итог, ступень, идентификаторы из обоих файлов, ключ блока
+MATCH_TABLE_COLUMNS = ['status', 'method', 'ID1', 'ID2', 'key']
+
+# Век рождения по 7-й цифре ИИН
+_IIN_CENTURY = {'1': '18', '2': '18', '3': '19', '4': '19', '5': '20', '6': '20'}
+_NOT_LETTERS = re.compile(r'[\W_]+')
+
+
+def iin_keys(data):
+    """
+    ИИН из 12 цифр; пустые и некорректные значения - пропуски.
+    """
+    if IIN_COLUMN not in data.columns:
+        return pd.Series(pd.NA, index=data.index, dtype='str')
+    text = column_types.as_text(data[IIN_COLUMN], IIN_COLUMN).astype('str').str.strip()
+    return text.where(text.str.fullmatch(r'\d{12}').fillna(False).astype(bool))
+
+
+def _normalize_name(parts):
+    name = _NOT_LETTERS.sub(' ', ' '.join(part for part in parts if isinstance(part, str)))
+    return name.casefold().replace('ё', 'е').strip() or None
+
+
+def normalize_names(data):
+    """
+    ФИО одной строкой: нижний регистр, ё -> е, без знаков препинания и лишних пробелов.
+    """
+    # Регулярное выражение Python, а не pyarrow: в RE2 \W не знает кириллицы
+    columns = [data[column].astype('str').to_numpy(dtype=object) for column in NAME_COLUMNS
+               if column in data.columns]
+    names = [_normalize_name(parts) for parts in zip(*columns)] if columns else [None] * len(data)
+    return pd.Series(names, index=data.index, dtype='str')
+
+
+def birthdates(data):
+    """
+    Дата рождения ГГГГ-ММ-ДД: из столбца BIRTHDATE_COLUMN, если он заполнен, иначе из ИИН.
+    """
+    from_iin = iin_keys(data)
+    century = from_iin.str[6].map(_IIN_CENTURY)
+    derived = pd.to_datetime(century + from_iin.str[:6], format='%Y%m%d', errors='coerce')
+    if BIRTHDATE_COLUMN in data.columns:
+        given = column_types.to_date(data[BIRTHDATE_COLUMN])
+        derived = given.fillna(derived)
+    return derived.dt.strftime('%Y-%m-%d').astype('str')
+
+
+def name_birthdate_keys(data):
+    names = normalize_names(data)
+    dates = birthdates(data)
+    keys = names + '|' + dates
+    return keys.where(names.notna() & dates.notna())
+
+
+KEY_BUILDERS = {
+    IIN: iin_keys,
+    NAME_BIRTHDATE: name_birthdate_keys,
+}
+
+
+def _block_flags(keys, own_counts, other_counts):
+    """
+    Для каждой строки: однозначная пара (ключ по одному разу в обоих файлах)
+    и неоднозначное совпадение (ключ есть в обоих, но где-то повторяется).
+    """
+    own = keys.map(own_counts).to_numpy(dtype=float)
+    other = keys.map(other_counts).fillna(0).to_numpy(dtype=float)
+    unique = (own == 1) & (other == 1)
+    return unique, (other >= 1) & ~unique
+
+
+def block_match(keys1, keys2):
+    """
+    Сопоставляет строки по равенству ключа (индексы keys1, keys2 - идентификаторы строк).
+    Возвращает (пары: DataFrame ID1, ID2, key; ключи неоднозначных строк первого
+    и второго файла: Series с теми же индексами).
+    """
+    keys1 = keys1.dropna()
+    keys2 = keys2.dropna()
+    counts1 = keys1.value_counts()
+    counts2 = keys2.value_counts()
+    unique1, ambiguous1 = _block_flags(keys1, counts1, counts2)
+    unique2, ambiguous2 = _block_flags(keys2, counts2, counts1)
+
+    # Ключ однозначен - по нему в каждом файле ровно одна строка
+    left = keys1[unique1]
+    right = keys2[unique2]
+    right = pd.Series(right.index, index=right.to_numpy())
+    pairs = pd.DataFrame({
+        'ID1': left.index.to_numpy(dtype=object),
+        'ID2': right.reindex(left.to_numpy()).to_numpy(dtype=object),
+        'key': left.to_numpy(dtype=object),
+    })
+    return pairs, keys1[ambiguous1], keys2[ambiguous2]
+
+
+def match_records(left, right):
+    """
+    Сопоставляет строки таблиц, проиндексированных по идентификатору (diff_engine.index_by_id).
+
+    Возвращает словарь:
+    pairs     - DataFrame ID1, ID2, method, key: все пары в порядке первого файла
+                (method - id или ступень из STAGES, key - ключ блока ступени);
+    ambiguous - DataFrame method, key, ID1, ID2: строки неоднозначных совпадений,
+                у каждой заполнен идентификатор только своего файла;
+    only1, only2 - идентификаторы строк, оставшихся без пары.
+    """
+    common = left.index[left.index.isin(right.index)]
+    pairs = [pd.DataFrame({'ID1': common.to_numpy(dtype=object), 'ID2': common.to_numpy(dtype=object),
+                           'key': None, 'method': ID})]
+    ambiguous = []
+    rest1 = left.index[~left.index.isin(right.index)]
+    rest2 = right.index[~right.index.isin(left.index)]
+
+    for stage in STAGES:
+        if not len(rest1) or not len(rest2):
+            break
+        build_keys = KEY_BUILDERS[stage]
+        keys1 = build_keys(left.loc[rest1])
+        keys2 = build_keys(right.loc[rest2])
+        stage_pairs, candidates1, candidates2 = block_match(keys1, keys2)
+        pairs.append(stage_pairs.assign(method=stage))
+        ambiguous.append(pd.DataFrame({'method': stage, 'key': candidates1.to_numpy(dtype=object),
+                                       'ID1': candidates1.index.to_numpy(dtype=object), 'ID2': None}))
+        ambiguous.append(pd.DataFrame({'method': stage, 'key': candidates2.to_numpy(dtype=object),
+                                       'ID1': None, 'ID2': candidates2.index.to_numpy(dtype=object)}))
+        # Сопоставленные и неоднозначные строки на следующие ступени не идут
+        rest1 = rest1[~rest1.isin(stage_pairs['ID1']) & ~rest1.isin(candidates1.index)]
+        rest2 = rest2[~rest2.isin(stage_pairs['ID2']) & ~rest2.isin(candidates2.index)]
+
+    pairs = pd.concat(pairs, ignore_index=True)
+    # Порядок пар - порядок строк первого файла, как при сопоставлении только по идентификатору
+    order = pd.Series(range(len(left)), index=left.index).reindex(pairs['ID1']).to_numpy()
+    pairs = pairs.iloc[order.argsort(kind='stable')].reset_index(drop=True)
+    ambiguous = pd.concat(ambiguous, ignore_index=True) if ambiguous else pd.DataFrame()
+    return {
+        'pairs': pairs[['ID1', 'ID2', 'method', 'key']],
+        'ambiguous': ambiguous.reindex(columns=['method', 'key', 'ID1', 'ID2']),
+        'only1': list(rest1),
+        'only2': list(rest2),
+    }
+
+
+def align_matched(left, right, matches):
+    """
+    Выравнивает таблицы по найденным парам. Строки второго файла получают
+    идентификатор своей пары из первого, поэтому различия пишутся под ним.
+    """
+    pairs = matches['pairs']
+    index = pd.Index(pairs['ID1'].to_numpy(dtype=object), dtype=object, name=left.index.name)
+    return left.loc[pairs['ID1']].set_axis(index), right.loc[pairs['ID2']].set_axis(index)
+
+
+def match_counts(matches):
+    """
+    Число пар по ступеням, неоднозначных строк и строк без пары.
+    """
+    counts = matches['pairs']['method'].value_counts()
+    result = {method: int(counts.get(method, 0)) for method in (ID,) + STAGES}
+    result.update({AMBIGUOUS: len(matches['ambiguous']), ONLY1: len(matches['only1']),
+                   ONLY2: len(matches['only2'])})
+    return result
+
+
+def iter_match_rows(matches):
+    """
+    Строки таблицы сопоставления в порядке MATCH_TABLE_COLUMNS: пары, найденные не
+    по идентификатору, неоднозначные совпадения и строки без пары.
+    """
+    pairs = matches['pairs']
+    fallback = pairs[pairs['method'] != ID]
+    for method, id1, id2, key in zip(fallback['method'], fallback['ID1'], fallback['ID2'], fallback['key']):
+        yield MATCHED, method, id1, id2, key
+    ambiguous = matches['ambiguous']
+    for method, key, id1, id2 in zip(ambiguous['method'], ambiguous['key'], ambiguous['ID1'], ambiguous['ID2']):
+        yield AMBIGUOUS, method, id1, id2, key
+    for id1 in matches['only1']:
+        yield ONLY1, None, id1, None, None
+    for id2 in matches['only2']:
+        yield ONLY2, None, None, id2, None
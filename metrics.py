@@ -0,0 +1,359 @@
+"""
+Метрики, структурные логи и выборочный профилировщик.
+
+Метрики копятся в памяти процесса и отдаются в текстовом формате Prometheus
+(эндпоинт /metrics): время запросов и этапов сверки, число обработанных строк,
+память процесса, попадания в кэши, состояние очереди задач. Каждое событие
+(запрос, этап, задача) дополнительно пишется одной JSON-строкой в лог "reconcile".
+
+Общего для процессов хранилища метрик нет: под gunicorn с несколькими процессами
+/metrics отдает счетчики того процесса, в который попал запрос (его видно по
+метке worker у reconcile_process_info), и при каждом опросе это может быть другой
+процесс. Чтобы видеть все, каждый процесс нужно опрашивать отдельно: запускать
+экземпляры gunicorn с WEB_CONCURRENCY=1 на своих портах (в nginx - несколько
+server в upstream) и указывать в Prometheus каждый порт, а суммировать в запросах.
+
+Профилировщик включается явно для одного запроса или задачи: фоновый поток
+раз в несколько миллисекунд снимает стек профилируемого потока и пишет
+свернутые стеки (формат flamegraph.pl / speedscope).
+"""
+import json
+import logging
+import os
+import resource
+import socket
+import sys
+import threading
+import time
+from collections import Counter as _StackCounter
+from contextlib import contextmanager
+
+logger = logging.getLogger('reconcile')
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+PROFILE_INTERVAL = 0.005
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels_text(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name}: ожидались метки {self.labelnames}, получены {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_labels_text(self.labelnames, key)} {_format_number(value)}'
+                                for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    Значение на момент опроса. Если задан callback, он возвращает список пар (метки, значение).
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def collect(self):
+        if self.callback is not None:
+            items = sorted((self._key(labels), value) for labels, value in self.callback())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_labels_text(self.labelnames, key)} {_format_number(value)}'
+                                for key, value in items]
+
+
+class CallbackCounter(Gauge):
+    """
+    Счетчик, который ведется в другом объекте и читается в момент опроса.
+    """
+    kind = 'counter'
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=SECONDS_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self._values[key] = (counts, total + value)
+
+    def collect(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total)) for key, (counts, total) in self._values.items())
+        lines = self.header()
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _labels_text(self.labelnames, key, [('le', _format_number(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _labels_text(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_number(total)}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+def peak_rss_bytes():
+    # На Linux ru_maxrss в килобайтах
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def current_rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()  # /proc есть не везде, тогда отдаем пик
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUESTS = REGISTRY.register(Counter(
+    'reconcile_http_requests_total', 'HTTP запросы по эндпоинтам и кодам ответа.', ('endpoint', 'method', 'status')))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'reconcile_http_request_seconds', 'Время обработки HTTP запроса.', ('endpoint',)))
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'reconcile_stage_seconds', 'Время этапа задачи (чтение, сравнение, отчеты, PDF).', ('kind', 'stage')))
+STAGE_ROWS = REGISTRY.register(Counter(
+    'reconcile_stage_rows_total', 'Строки, обработанные на этапе задачи.', ('kind', 'stage')))
+JOB_SECONDS = REGISTRY.register(Histogram(
+    'reconcile_job_seconds', 'Полное время задачи от запуска до завершения.', ('kind', 'status')))
+REGISTRY.register(Gauge(
+    'reconcile_process_peak_rss_bytes', 'Пиковая память процесса.',
+    callback=lambda: [({}, peak_rss_bytes())]))
+REGISTRY.register(Gauge(
+    'reconcile_process_rss_bytes', 'Текущая память процесса.',
+    callback=lambda: [({}, current_rss_bytes())]))
+REGISTRY.register(Gauge(
+    'reconcile_process_info', 'Процесс сервера, отдавший метрики (машина:номер процесса).', ('worker',),
+    callback=lambda: [({'worker': f'{socket.gethostname()}:{os.getpid()}'}, 1)]))
+
+
+def register_cache(name, cache):
+    """
+    Публикует счетчики попаданий и промахов кэша (атрибуты hits и misses объекта).
+    """
+    REGISTRY.register(CallbackCounter(
+        f'reconcile_{name}_cache_hits_total', f'Попадания в кэш {name}.',
+        callback=lambda: [({}, cache.hits)]))
+    REGISTRY.register(CallbackCounter(
+        f'reconcile_{name}_cache_misses_total', f'Промахи кэша {name}.',
+        callback=lambda: [({}, cache.misses)]))
+
+
+def register_job_queue(queue):
+    REGISTRY.register(Gauge(
+        'reconcile_jobs', 'Задачи в памяти очереди по состояниям.', ('status',),
+        callback=lambda: [({'status': status}, count) for status, count in queue.counts().items()]))
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Одна JSON-строка на запись: время, уровень, событие и поля события.
+    """
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)),
+            'level': record.levelname.lower(),
+            'event': record.getMessage(),
+        }
+        entry.update(getattr(record, 'fields', {}))
+        if record.exc_info:
+            entry['error'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level=None):
+    """
+    Включает JSON-логи "reconcile" в stderr, если обработчики еще не настроены.
+    """
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.propagate = False
+    logger.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO'))
+
+
+def log_event(event, level=logging.INFO, **fields):
+    logger.log(level, event, extra={'fields': fields})
+
+
+class _StageTimer:
+    def __init__(self):
+        self.rows = None
+
+
+@contextmanager
+def stage(kind, name, rows=None, **fields):
+    """
+    Замеряет этап задачи. Число строк можно задать сразу или после этапа через timer.rows.
+    """
+    timer = _StageTimer()
+    timer.rows = rows
+    started = time.perf_counter()
+    status = 'ok'
+    try:
+        yield timer
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        STAGE_SECONDS.observe(seconds, kind=kind, stage=name)
+        event = {'kind': kind, 'stage': name, 'status': status, 'seconds': round(seconds, 4),
+                 'peak_rss_mb': round(peak_rss_bytes() / 1024 / 1024, 1)}
+        if timer.rows is not None:
+            STAGE_ROWS.inc(timer.rows, kind=kind, stage=name)
+            event['rows'] = timer.rows
+            event['rows_per_second'] = round(timer.rows / seconds) if seconds > 0 else None
+        log_event('stage', **event, **fields)
+
+
+def observe_request(endpoint, method, status, seconds, **fields):
+    REQUESTS.inc(endpoint=endpoint, method=method, status=status)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint)
+    log_event('request', endpoint=endpoint, method=method, status=status, seconds=round(seconds, 4),
+              peak_rss_mb=round(peak_rss_bytes() / 1024 / 1024, 1), **fields)
+
+
+def observe_job(job):
+    seconds = (job.finished or time.time()) - (job.started or job.created)
+    JOB_SECONDS.observe(seconds, kind=job.kind, status=job.status)
+    log_event('job', level=logging.WARNING if job.error else logging.INFO, job_id=job.id, kind=job.kind,
+              status=job.status, seconds=round(seconds, 4), rows=job.rows_processed, error=job.error)
+
+
+class SamplingProfiler:
+    """
+    Снимает стек одного потока с заданным интервалом и считает одинаковые стеки.
+    Результат - свернутые стеки "кадр;кадр;... число", по одному на строку.
+    """
+
+    def __init__(self, thread_id=None, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id or threading.get_ident()
+        self.interval = interval
+        self.samples = _StackCounter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self._sample, name='profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def write_folded(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        return path
+
+
+def profiled(func, folder):
+    """
+    Оборачивает функцию задачи func(job, ...): пока она выполняется, ее поток профилируется,
+    стеки пишутся в folder/job-<id задачи>.folded.
+    """
+    def wrapper(job, *args, **kwargs):
+        profiler = SamplingProfiler().start()
+        try:
+            return func(job, *args, **kwargs)
+        finally:
+            profiler.stop()
+            path = profiler.write_folded(os.path.join(folder, f'job-{job.id}.folded'))
+            log_event('profile', job_id=job.id, path=path, samples=sum(profiler.samples.values()))
+    return wrapper
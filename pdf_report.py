@@ -0,0 +1,197 @@
+"""
+Общий PDF отчет по различиям.
+
+Отчет строится прямо из таблицы различий, без промежуточных текстовых файлов:
+строки отдаются генератором и сразу рисуются на странице в виде таблицы.
+Страницы сжимаются по мере заполнения, поэтому в памяти не держится ни полный
+список строк, ни несжатое содержимое страниц.
+"""
+import os
+
+from reportlab.lib.pagesizes import A4, landscape
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+import diff_engine
+
+FONT_NAME = 'ReportFont'
+# Шрифт с кириллицей, который поставляется вместе с приложением
+BUNDLED_FONT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fonts', 'DejaVuSans.ttf')
+
+PAGE_SIZE = landscape(A4)
+MARGIN = 36
+TITLE_SIZE = 14
+SECTION_SIZE = 11
+FONT_SIZE = 8
+ROW_HEIGHT = 13
+CELL_PADDING = 3
+
+_font_path = None
+
+
+def register_font(path=None):
+    """
+    Регистрирует шрифт отчета один раз за время работы приложения.
+    Если указанного файла нет, используется встроенный DejaVu Sans.
+    """
+    global _font_path
+    if _font_path is not None:
+        return _font_path
+    for candidate in (path, BUNDLED_FONT):
+        if candidate and os.path.exists(candidate):
+            pdfmetrics.registerFont(TTFont(FONT_NAME, candidate))
+            _font_path = candidate
+            return candidate
+    raise FileNotFoundError(f'Шрифт для PDF отчета не найден: {path or BUNDLED_FONT}')
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    try:
+        if value != value:  # NaN
+            return ''
+    except (TypeError, ValueError):
+        pass
+    return str(value)
+
+
+def _fit(text, width):
+    """
+    Обрезает текст до ширины ячейки, добавляя многоточие.
+    """
+    available = width - 2 * CELL_PADDING
+    if pdfmetrics.stringWidth(text, FONT_NAME, FONT_SIZE) <= available:
+        return text
+    while text and pdfmetrics.stringWidth(text + '…', FONT_NAME, FONT_SIZE) > available:
+        text = text[:-1]
+    return text + '…'
+
+
+def _table_layout(rule):
+    """
+    Заголовки столбцов таблицы и функция, превращающая строку отчета в ячейки.
+    """
+    if rule['predicate'] == 'scholarship':
+        header = ['ID', 'Файл', 'Вид стипендии', 'Общая успеваемость']
+
+        def cells(entry):
+            values = list(entry.values())
+            side = '2' if list(entry)[1].startswith('File2') else '1'
+            return [values[0], side] + values[1:]
+        return header, cells
+
+    header = ['ID', 'Файл 1', 'Файл 2']
+    if rule['expiry']:
+        header += ['Дата окончания 1', 'Дата окончания 2', 'Истекла 1', 'Истекла 2']
+    return header, lambda entry: list(entry.values())
+
+
+class _TableWriter:
+    """
+    Рисует секции с таблицами, переходя на новую страницу и повторяя шапку таблицы.
+    """
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.width, self.height = PAGE_SIZE
+        self.page = 1
+        self.y = self.height - MARGIN
+        self.header = None
+        self.widths = None
+        self.table_width = 0
+
+    def _new_page(self):
+        self._footer()
+        self.pdf.showPage()
+        self.page += 1
+        self.y = self.height - MARGIN
+        if self.header:
+            self._draw_row(self.header, bold=True)
+
+    def _footer(self):
+        self.pdf.setFont(FONT_NAME, FONT_SIZE)
+        self.pdf.drawRightString(self.width - MARGIN, MARGIN / 2, f'Стр. {self.page}')
+
+    def _ensure_space(self, needed):
+        if self.y - needed < MARGIN:
+            self._new_page()
+
+    def title(self, text):
+        self.pdf.setFont(FONT_NAME, TITLE_SIZE)
+        self.y -= TITLE_SIZE
+        self.pdf.drawString(MARGIN, self.y, text)
+        self.y -= TITLE_SIZE / 2
+
+    def section(self, text, header):
+        # Заголовок секции не оставляем внизу страницы без строк таблицы
+        self.header = None
+        self._ensure_space(SECTION_SIZE * 2 + ROW_HEIGHT * 2)
+        self.y -= SECTION_SIZE * 1.5
+        self.pdf.setFont(FONT_NAME, SECTION_SIZE)
+        self.pdf.drawString(MARGIN, self.y, text)
+        self.y -= SECTION_SIZE / 2
+        usable = self.width - 2 * MARGIN
+        self.widths = [usable / len(header)] * len(header)
+        self.table_width = usable
+        self.header = header
+        self._draw_row(header, bold=True)
+
+    def row(self, cells):
+        self._ensure_space(ROW_HEIGHT)
+        self._draw_row([_cell_text(value) for value in cells])
+
+    def _draw_row(self, cells, bold=False):
+        pdf = self.pdf
+        top = self.y
+        self.y -= ROW_HEIGHT
+        right = MARGIN + self.table_width
+        if bold:
+            pdf.setFillGray(0.9)
+            pdf.rect(MARGIN, self.y, self.table_width, ROW_HEIGHT, stroke=0, fill=1)
+            pdf.setFillGray(0)
+        # Один текстовый объект на строку: ячейки сдвигаются курсором, а не отдельными drawString
+        text = pdf.beginText(MARGIN + CELL_PADDING, self.y + 4)
+        text.setFont(FONT_NAME, FONT_SIZE)
+        previous = 0
+        for value, width in zip(cells, self.widths):
+            text.moveCursor(previous, 0)
+            text.textOut(_fit(value, width))
+            previous = width
+        pdf.drawText(text)
+        pdf.setLineWidth(0.3)
+        pdf.line(MARGIN, self.y, right, self.y)
+        if bold:
+            pdf.line(MARGIN, top, right, top)
+
+    def finish(self):
+        self._footer()
+
+
+def render_pdf(diffs, pdf_path, today=None):
+    """
+    Пишет общий отчет по всем полям. Возвращает False, если различий нет и файл не создан.
+    """
+    if diffs.empty:
+        return False
+
+    register_font()
+    pdf = canvas.Canvas(pdf_path, pagesize=PAGE_SIZE, pageCompression=1)
+    writer = _TableWriter(pdf)
+    writer.title("Общий отчет по различиям")
+
+    for key, title, _ in diff_engine.REPORTS:
+        entries = diff_engine.iter_report_entries(diffs, key, today)
+        first = next(entries, None)
+        if first is None:
+            continue
+        header, cells = _table_layout(diff_engine.get_rule(key))
+        writer.section(f"Изменения по {title}", header)
+        writer.row(cells(first))
+        for entry in entries:
+            writer.row(cells(entry))
+
+    writer.finish()
+    pdf.save()
+    return True
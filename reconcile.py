@@ -0,0 +1,258 @@
+"""
+Сверка двух выгрузок без веб-приложения: библиотека и командная строка.
+
+Здесь собраны этапы сверки, которые использует и веб-приложение: чтение
+файлов, таблица различий (с пересчетом только изменившихся строк, если
+задан файл состояния) и отчеты в нужных форматах: текстовые по полям, PDF
+и выгрузки таблицы различий в CSV, XLSX и Parquet (модуль exports).
+
+Студенты, у которых не совпал идентификатор, сопоставляются по ИИН, затем
+по ФИО и дате рождения (модуль matching); найденные пары сверяются наравне
+с остальными, а итоги сопоставления пишутся в matching.csv.
+
+Flask не нужен, а pandas и reportlab импортируются только при первой сверке
+(reportlab - только для PDF), поэтому запуск из cron и скриптов стоит недорого.
+
+Пример:
+    python reconcile.py file1.xlsx file2.xlsx --out reports --format txt,xlsx,pdf
+"""
+import argparse
+import itertools
+import os
+import sys
+import threading
+
+import exports
+
+FORMATS = ('txt', 'pdf') + exports.FORMATS
+DEFAULT_FORMATS = ('txt', 'pdf')
+PDF_FILE = 'report_all.pdf'
+# Выгрузки таблицы различий: diffs.csv, diffs.xlsx, diffs.parquet
+EXPORT_FILES = {fmt: f'diffs.{fmt}' for fmt in exports.FORMATS}
+MATCHING_FILE = 'matching.csv'
+
+
+class ReconcileError(Exception):
+    """
+    Ошибка сверки, текст которой можно показать пользователю (нет столбца, файл не читается).
+    """
+
+
+def read_columns():
+    """
+    Столбцы, которые читаются из файлов: сравниваемые правилами и нужные для сопоставления.
+    """
+    import diff_engine
+    import matching
+
+    return diff_engine.REQUIRED_COLUMNS + [column for column in matching.MATCH_COLUMNS
+                                           if column not in diff_engine.REQUIRED_COLUMNS]
+
+
+def read_inputs(file1_path, file2_path, loader=None):
+    """
+    Читает оба файла (только столбцы read_columns) и проверяет обязательные столбцы.
+    loader(путь) - чтение таблицы, по умолчанию потоковое чтение xlsx без кэша.
+    """
+    import diff_engine
+
+    if loader is None:
+        import excel_stream
+
+        def default_loader(path):
+            return excel_stream.read_frame(path, read_columns())
+
+        loader = default_loader
+
+    try:
+        data1 = loader(file1_path)
+        data2 = loader(file2_path)
+    except Exception as e:
+        raise ReconcileError(f'Ошибка при чтении Excel файлов: {e}')
+
+    for data in (data1, data2):
+        missing = diff_engine.missing_columns(data)
+        if missing:
+            raise ReconcileError(f'Отсутствует обязательный столбец: {missing[0]}')
+    return data1, data2
+
+
+def load_run_state(state_path):
+    """
+    Читает состояние прошлой сверки (отпечатки строк и различия) или возвращает None.
+    """
+    import pandas as pd
+
+    if not os.path.exists(state_path):
+        return None
+    try:
+        return pd.read_pickle(state_path)
+    except Exception:
+        return None  # Поврежденное состояние - просто считаем все заново
+
+
+def save_run_state(state_path, state):
+    """
+    Сохраняет состояние сверки через временный файл.
+    """
+    import pandas as pd
+
+    os.makedirs(os.path.dirname(os.path.abspath(state_path)), exist_ok=True)
+    tmp_path = f'{state_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    pd.to_pickle(state, tmp_path)
+    os.replace(tmp_path, state_path)
+
+
+def match_inputs(data1, data2):
+    """
+    Сопоставляет студентов обоих файлов: по идентификатору, затем по ИИН и по ФИО с датой рождения.
+    Возвращает (выровненные строки (left, right) для build_diffs, результат matching.match_records).
+    """
+    import diff_engine
+    import matching
+
+    left = diff_engine.index_by_id(data1)
+    right = diff_engine.index_by_id(data2)
+    matches = matching.match_records(left, right)
+    return matching.align_matched(left, right, matches), matches
+
+
+def write_matching(matches, out_dir):
+    """
+    Пишет итоги сопоставления (пары не по идентификатору, неоднозначные, без пары) в MATCHING_FILE.
+    Если все студенты сопоставились по идентификатору, файл не создается и возвращается False.
+    """
+    import matching
+
+    rows = matching.iter_match_rows(matches)
+    first = next(rows, None)
+    if first is None:
+        return False
+    os.makedirs(out_dir, exist_ok=True)
+    exports.write_csv(matching.MATCH_TABLE_COLUMNS, itertools.chain([first], rows),
+                      os.path.join(out_dir, MATCHING_FILE))
+    return True
+
+
+def build_diffs(data1, data2, state_path=None, workers=1, aligned=None):
+    """
+    Строит таблицу различий. Если задан state_path, пересчитываются только строки,
+    изменившиеся с прошлой сверки с тем же файлом состояния.
+    aligned - строки, выровненные match_inputs; без него сверяются только совпавшие идентификаторы.
+    Возвращает (таблица различий, статистика пересчета).
+    """
+    import diff_engine
+
+    previous = load_run_state(state_path) if state_path else None
+    diffs, state, stats = diff_engine.build_diff_table_incremental(data1, data2, previous, workers=workers,
+                                                                   aligned=aligned)
+    if state_path:
+        save_run_state(state_path, state)
+    return diffs, stats
+
+
+def write_reports(diffs, out_dir, formats=DEFAULT_FORMATS, today=None, font_path=None):
+    """
+    Пишет отчеты в out_dir. Возвращает {ключ отчета: имя файла} только для созданных файлов:
+    текстовые отчеты по полям - по ключу поля, PDF - 'all', выгрузки различий - по формату
+    ('csv', 'xlsx', 'parquet').
+    """
+    import diff_engine
+
+    unknown = set(formats) - set(FORMATS)
+    if unknown:
+        raise ValueError(f'Неизвестный формат отчета: {", ".join(sorted(unknown))}')
+    os.makedirs(out_dir, exist_ok=True)
+
+    reports = {}
+    if 'txt' in formats:
+        for report_key in diff_engine.REPORT_KEYS:
+            report_filename = f'report_{report_key}.txt'
+            if diff_engine.write_text_report(diffs, report_key, os.path.join(out_dir, report_filename), today):
+                reports[report_key] = report_filename
+    for fmt in exports.FORMATS:
+        if fmt in formats and len(diffs):
+            exports.write(fmt, diff_engine.DIFF_COLUMNS, exports.frame_rows(diffs, diff_engine.DIFF_COLUMNS),
+                          os.path.join(out_dir, EXPORT_FILES[fmt]))
+            reports[fmt] = EXPORT_FILES[fmt]
+    if 'pdf' in formats:
+        import pdf_report
+
+        pdf_report.register_font(font_path)
+        if pdf_report.render_pdf(diffs, os.path.join(out_dir, PDF_FILE), today):
+            reports['all'] = PDF_FILE
+    return reports
+
+
+def reconcile(file1_path, file2_path, out_dir, formats=DEFAULT_FORMATS, loader=None, state_path=None,
+              workers=1, today=None, font_path=None, match=True):
+    """
+    Полная сверка двух файлов: чтение, сопоставление студентов (если match), различия, отчеты.
+    Возвращает {'diffs': таблица различий, 'stats': статистика пересчета,
+    'matching': числа matching.match_counts или None, 'reports': созданные отчеты}.
+    """
+    import matching
+
+    data1, data2 = read_inputs(file1_path, file2_path, loader)
+    aligned, matches = match_inputs(data1, data2) if match else (None, None)
+    diffs, stats = build_diffs(data1, data2, state_path, workers, aligned)
+    reports = write_reports(diffs, out_dir, formats, today, font_path)
+    if matches is not None and write_matching(matches, out_dir):
+        reports['matching'] = MATCHING_FILE
+    return {'diffs': diffs, 'stats': stats, 'reports': reports,
+            'matching': matching.match_counts(matches) if matches is not None else None}
+
+
+def parse_formats(value):
+    formats = tuple(part.strip().lower() for part in value.split(',') if part.strip())
+    unknown = set(formats) - set(FORMATS)
+    if unknown or not formats:
+        raise argparse.ArgumentTypeError(f'форматы через запятую из: {", ".join(FORMATS)}')
+    return formats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Сверка двух выгрузок реестра обучающихся')
+    parser.add_argument('file1', help='первый файл (xlsx)')
+    parser.add_argument('file2', help='второй файл (xlsx)')
+    parser.add_argument('--out', required=True, help='каталог для отчетов')
+    parser.add_argument('--format', type=parse_formats, default=DEFAULT_FORMATS,
+                        help=f'форматы отчетов через запятую: {", ".join(FORMATS)} (по умолчанию txt,pdf)')
+    parser.add_argument('--workers', type=int, default=1, help='число процессов для проверки правил')
+    parser.add_argument('--cache-dir', default=None, help='каталог кэша снимков разобранных файлов')
+    parser.add_argument('--state', default=None,
+                        help='файл состояния: следующая сверка пересчитает только изменившиеся строки')
+    parser.add_argument('--font', default=None, help='шрифт TTF с кириллицей для PDF')
+    parser.add_argument('--exact-ids', action='store_true',
+                        help='сверять только студентов с совпавшим идентификатором, без сопоставления по ИИН и ФИО')
+    args = parser.parse_args(argv)
+
+    loader = None
+    if args.cache_dir:
+        from workbook_cache import WorkbookCache
+
+        cache = WorkbookCache(args.cache_dir)
+
+        def cached_loader(path):
+            return cache.load(path, read_columns())
+
+        loader = cached_loader
+
+    try:
+        result = reconcile(args.file1, args.file2, args.out, args.format, loader=loader, state_path=args.state,
+                           workers=args.workers, font_path=args.font, match=not args.exact_ids)
+    except ReconcileError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    print(f"Различий: {len(result['diffs'])}, пересчитано строк: {result['stats']['evaluated']}", file=sys.stderr)
+    if result['matching'] is not None:
+        print('Сопоставление: ' + ', '.join(f'{key} {count}' for key, count in result['matching'].items()),
+              file=sys.stderr)
+    for filename in result['reports'].values():
+        print(os.path.join(args.out, filename))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,213 @@
+"""
+Хранилище результатов сверок в SQLite.
+
+Каждая сверка (задача /process) сохраняется как запуск, а ее строки различий -
+в общую таблицу с индексом по (запуск, поле, идентификатор обучающегося).
+По ней без поиска по текстовым файлам отвечаем на вопросы вроде
+"все изменения ИИК у студента за последний месяц" и листаем большие
+результаты постранично.
+"""
+import time
+from datetime import date, datetime
+
+import pandas as pd
+
+from auth_store import ConnectionPool
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 500
+DEFAULT_RETENTION_DAYS = 90
+INSERT_BATCH_SIZE = 10000
+EXPORT_BATCH_SIZE = 10000
+# Столбцы выгрузки различий, в порядке кортежей iter_rows
+EXPORT_COLUMNS = ['run_id', 'created', 'field', 'student_id', 'value1', 'value2', 'extra1', 'extra2']
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS runs (
+        id TEXT PRIMARY KEY,
+        owner TEXT NOT NULL,
+        created REAL NOT NULL,
+        file1 TEXT,
+        file2 TEXT,
+        diff_count INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS runs_owner_created ON runs (owner, created);
+    CREATE TABLE IF NOT EXISTS diffs (
+        run_id TEXT NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+        field TEXT NOT NULL,
+        student_id TEXT NOT NULL,
+        value1 TEXT,
+        value2 TEXT,
+        extra1 TEXT,
+        extra2 TEXT
+    );
+    CREATE INDEX IF NOT EXISTS diffs_run_field_student ON diffs (run_id, field, student_id);
+    CREATE INDEX IF NOT EXISTS diffs_student_field ON diffs (student_id, field);
+'''
+
+
+def _db_value(value):
+    """
+    Значение ячейки для записи в базу: пустые - NULL, даты - ISO, остальное - текст.
+    """
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+class ResultsStore:
+    """
+    Запись запусков сверки и постраничная выборка их различий.
+    """
+
+    def __init__(self, db_path, retention_days=DEFAULT_RETENTION_DAYS):
+        self.pool = ConnectionPool(db_path)
+        self.retention_days = retention_days
+
+    def _connection(self):
+        conn = self.pool.connection()
+        conn.execute('PRAGMA foreign_keys=ON')
+        return conn
+
+    def init_schema(self):
+        conn = self._connection()
+        conn.executescript(SCHEMA)
+        conn.commit()
+
+    def save_run(self, run_id, owner, diffs, file1=None, file2=None):
+        """
+        Сохраняет таблицу различий diff_engine одним запуском. Повторное сохранение заменяет запуск.
+        """
+        conn = self._connection()
+        rows = zip(diffs['field'], diffs['ID'], diffs['value1'], diffs['value2'],
+                   diffs['extra1'], diffs['extra2'])
+        with conn:
+            conn.execute('DELETE FROM runs WHERE id = ?', (run_id,))
+            conn.execute('INSERT INTO runs (id, owner, created, file1, file2, diff_count) VALUES (?, ?, ?, ?, ?, ?)',
+                         (run_id, owner, time.time(), file1, file2, len(diffs)))
+            batch = []
+            for field, student_id, value1, value2, extra1, extra2 in rows:
+                batch.append((run_id, field, str(student_id), _db_value(value1), _db_value(value2),
+                               _db_value(extra1), _db_value(extra2)))
+                if len(batch) >= INSERT_BATCH_SIZE:
+                    conn.executemany('INSERT INTO diffs VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+                    batch = []
+            if batch:
+                conn.executemany('INSERT INTO diffs VALUES (?, ?, ?, ?, ?, ?, ?)', batch)
+        self.prune()
+
+    def prune(self):
+        """
+        Удаляет запуски старше срока хранения вместе с их различиями.
+        """
+        if not self.retention_days:
+            return
+        deadline = time.time() - self.retention_days * 24 * 60 * 60
+        conn = self._connection()
+        with conn:
+            conn.execute('DELETE FROM runs WHERE created < ?', (deadline,))
+
+    def get_run(self, owner, run_id):
+        row = self._connection().execute(
+            'SELECT id, created, file1, file2, diff_count FROM runs WHERE id = ? AND owner = ?',
+            (run_id, owner)).fetchone()
+        return None if row is None else self._run_dict(row)
+
+    def list_runs(self, owner, limit=20):
+        rows = self._connection().execute(
+            'SELECT id, created, file1, file2, diff_count FROM runs WHERE owner = ? ORDER BY created DESC LIMIT ?',
+            (owner, limit)).fetchall()
+        return [self._run_dict(row) for row in rows]
+
+    @staticmethod
+    def _run_dict(row):
+        run_id, created, file1, file2, diff_count = row
+        return {
+            'id': run_id,
+            'created': datetime.fromtimestamp(created).isoformat(timespec='seconds'),
+            'file1': file1,
+            'file2': file2,
+            'diff_count': diff_count,
+        }
+
+    @staticmethod
+    def _filters(owner, run_id, field, student_id, since):
+        """
+        Условие WHERE, его параметры и порядок строк для выборки различий.
+        """
+        conditions = ['runs.owner = ?']
+        params = [owner]
+        for column, value in (('diffs.run_id', run_id), ('diffs.field', field),
+                              ('diffs.student_id', student_id)):
+            if value:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            conditions.append('runs.created >= ?')
+            params.append(since)
+        # Внутри одного запуска порядок совпадает с индексом (run_id, field, student_id) и сортировка не нужна
+        order = 'diffs.field, diffs.student_id' if run_id else 'runs.created DESC, diffs.run_id, diffs.field, diffs.student_id'
+        return ' AND '.join(conditions), params, order
+
+    def query(self, owner, run_id=None, field=None, student_id=None, since=None,
+              page=1, per_page=DEFAULT_PER_PAGE):
+        """
+        Постраничная выборка различий пользователя с фильтрами по запуску, полю,
+        идентификатору студента и времени запуска (since - unix time).
+        """
+        per_page = max(1, min(int(per_page), MAX_PER_PAGE))
+        page = max(1, int(page))
+        where, params, order = self._filters(owner, run_id, field, student_id, since)
+
+        conn = self._connection()
+        total = conn.execute(
+            f'SELECT COUNT(*) FROM diffs JOIN runs ON runs.id = diffs.run_id WHERE {where}',
+            params).fetchone()[0]
+        rows = conn.execute(
+            f'''SELECT diffs.run_id, runs.created, diffs.field, diffs.student_id,
+                       diffs.value1, diffs.value2, diffs.extra1, diffs.extra2
+                FROM diffs JOIN runs ON runs.id = diffs.run_id
+                WHERE {where}
+                ORDER BY {order}
+                LIMIT ? OFFSET ?''',
+            params + [per_page, (page - 1) * per_page]).fetchall()
+
+        items = [{
+            'run_id': run,
+            'created': datetime.fromtimestamp(created).isoformat(timespec='seconds'),
+            'field': field_key,
+            'student_id': student,
+            'value1': value1,
+            'value2': value2,
+            'extra1': extra1,
+            'extra2': extra2,
+        } for run, created, field_key, student, value1, value2, extra1, extra2 in rows]
+        return {
+            'items': items,
+            'total': total,
+            'page': page,
+            'per_page': per_page,
+            'pages': max(1, -(-total // per_page)),
+        }
+
+    def iter_rows(self, owner, run_id=None, field=None, student_id=None, since=None):
+        """
+        Все различия выборки кортежами в порядке EXPORT_COLUMNS, с теми же фильтрами, что query.
+        Строки читаются из курсора пачками, выборка целиком в память не загружается.
+        """
+        where, params, order = self._filters(owner, run_id, field, student_id, since)
+        cursor = self._connection().execute(
+            f'''SELECT diffs.run_id, runs.created, diffs.field, diffs.student_id,
+                       diffs.value1, diffs.value2, diffs.extra1, diffs.extra2
+                FROM diffs JOIN runs ON runs.id = diffs.run_id
+                WHERE {where}
+                ORDER BY {order}''',
+            params)
+        try:
+            for rows in iter(lambda: cursor.fetchmany(EXPORT_BATCH_SIZE), []):
+                for run, created, *values in rows:
+                    yield (run, datetime.fromtimestamp(created).isoformat(timespec='seconds'), *values)
+        finally:
+            cursor.close()
@@ -1,29 +1,34 @@
-from flask import Flask, render_template, request, redirect, url_for, session, send_file, flash
-import sqlite3
-import pandas as pd
+from flask import Flask, render_template, request, redirect, url_for, session, send_file, flash, jsonify, Response, g
+import logging
 import os
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.lib import fonts
-from reportlab.pdfbase import pdfmetrics
-from reportlab.lib.pagesizes import letter
-from datetime import datetime
-
-def read_excel_dynamic_skiprows(file_path):
-    """ Проверяет первую строку и определяет, нужно ли skiprows=5 на основе количества Unnamed столбцов. """
-    first_row = pd.read_excel(file_path, nrows=1)  # Читаем первую строку
-    unnamed_columns = sum(col.startswith("Unnamed") for col in first_row.columns)  # Считаем "Unnamed" столбцы
-    
-    if unnamed_columns > len(first_row.columns) / 2:  # Если более половины столбцов "Unnamed"
-        return pd.read_excel(file_path, skiprows=5)  # Пропускаем 5 строк
-    else:
-        return pd.read_excel(file_path)
+import threading
+import time
+import uuid
+from urllib.parse import quote
+import column_compare
+import diff_engine
+import batch
+import excel_stream
+import exports
+import matching
+import metrics
+import pdf_report
+import reconcile
+from workbook_cache import WorkbookCache
+from chunked_upload import ChunkedUploads, UploadError
+from auth_store import AuthStore
+from results_store import ResultsStore, EXPORT_COLUMNS
+from jobs import JobQueue, JobStore, JobError, QueueFullError, DONE, FAILED
+from workspaces import WorkspaceManager
+
+def read_excel_dynamic_skiprows(file_path, columns=None):
+    """ Читает файл построчно, сам определяя строку заголовков (skiprows=5 при шапке отчета), и возвращает только нужные столбцы.
+    Повторные чтения того же содержимого берутся из кэша снимков. """
+    return workbook_cache.load(file_path, columns)
 
 
 
 app = Flask(__name__)
-app.secret_key = os.urandom(24)  # Секретный ключ для сессий
 
 # Настройка папки для загрузок
 UPLOAD_FOLDER = 'uploads'
@@ -32,49 +37,197 @@ if not os.path.exists(UPLOAD_FOLDER):
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Кэш разобранных файлов: снимки по SHA-256 содержимого, не больше 512 МБ
+app.config['CACHE_FOLDER'] = os.path.join(UPLOAD_FOLDER, '.cache')
+app.config['CACHE_MAX_BYTES'] = 512 * 1024 * 1024
+workbook_cache = WorkbookCache(app.config['CACHE_FOLDER'], app.config['CACHE_MAX_BYTES'])
+
+# Фоновые задачи: не больше 2 сверок одновременно и 8 в очереди на процесс сервера
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_QUEUE_DEPTH'] = int(os.environ.get('JOB_QUEUE_DEPTH', 8))
+
+# Число процессов для параллельной проверки правил сверки
+app.config['DIFF_WORKERS'] = int(os.environ.get('DIFF_WORKERS', os.cpu_count() or 1))
+
+# Рабочие каталоги сессий: живут сутки, все вместе занимают не больше 2 ГБ
+app.config['WORKSPACE_FOLDER'] = os.path.join(UPLOAD_FOLDER, 'workspaces')
+app.config['WORKSPACE_TTL'] = 24 * 60 * 60
+app.config['WORKSPACE_QUOTA_BYTES'] = 2 * 1024 * 1024 * 1024
+workspaces = WorkspaceManager(app.config['WORKSPACE_FOLDER'], app.config['WORKSPACE_TTL'],
+                              app.config['WORKSPACE_QUOTA_BYTES'])
+
+# Загрузка частями (/uploads): части по 4 МБ, файл не больше 200 МБ
+app.config['UPLOAD_CHUNK_SIZE'] = int(os.environ.get('UPLOAD_CHUNK_SIZE', 4 * 1024 * 1024))
+app.config['UPLOAD_MAX_BYTES'] = int(os.environ.get('UPLOAD_MAX_BYTES', 200 * 1024 * 1024))
+# Разбор загруженных файлов заранее - не больше одного одновременно, чтобы не мешать сверкам
+_prefetch_slots = threading.Semaphore(1)
+
+
+def prefetch_workbook(path):
+    """
+    Разбирает только что загруженный файл в фоне, чтобы к запуску сверки его снимок уже был в кэше.
+    """
+    def run():
+        with _prefetch_slots:
+            try:
+                with metrics.stage('upload', 'parse', file=os.path.basename(path)) as timer:
+                    timer.rows = len(workbook_cache.load(path))
+            except Exception as e:  # Ошибку формата покажет сама сверка
+                metrics.log_event('prefetch_failed', level=logging.WARNING, file=os.path.basename(path), error=str(e))
+    threading.Thread(target=run, name='prefetch', daemon=True).start()
+
+
+chunked_uploads = ChunkedUploads(workspaces, app.config['UPLOAD_CHUNK_SIZE'], app.config['UPLOAD_MAX_BYTES'],
+                                 on_complete=prefetch_workbook)
+
+# Пакетная сверка: не больше 200 файлов учреждений за раз, разбор - по процессу на ядро
+app.config['BATCH_MAX_FILES'] = 200
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+
+# Шрифт PDF отчета с кириллицей; если не задан или не найден - встроенный DejaVu Sans
+app.config['REPORT_FONT_PATH'] = os.environ.get('REPORT_FONT_PATH')
+pdf_report.register_font(app.config['REPORT_FONT_PATH'])
+
 # --- База данных ---
+# Пользователи: пул соединений SQLite (WAL) и пароли в виде хэша scrypt.
+# Стоимость scrypt задается через окружение; n=2**14, r=8 - около 16 МБ памяти на проверку
+app.config['USERS_DB'] = os.environ.get('USERS_DB', 'users.db')
+app.config['AUTH_SCRYPT_N'] = int(os.environ.get('AUTH_SCRYPT_N', 2 ** 14))
+app.config['AUTH_SCRYPT_R'] = int(os.environ.get('AUTH_SCRYPT_R', 8))
+app.config['AUTH_SCRYPT_P'] = int(os.environ.get('AUTH_SCRYPT_P', 1))
+auth_store = AuthStore(app.config['USERS_DB'], app.config['AUTH_SCRYPT_N'],
+                       app.config['AUTH_SCRYPT_R'], app.config['AUTH_SCRYPT_P'])
+
+# Результаты сверок: строки различий каждого запуска, хранятся 90 дней
+app.config['RESULTS_DB'] = os.environ.get(
+    'RESULTS_DB', os.path.join(os.path.dirname(app.config['USERS_DB']), 'results.db'))
+app.config['RESULTS_RETENTION_DAYS'] = 90
+app.config['RESULTS_PER_PAGE'] = 50
+results_store = ResultsStore(app.config['RESULTS_DB'], app.config['RESULTS_RETENTION_DAYS'])
+results_store.init_schema()
+
+# Состояние фоновых задач в SQLite: под gunicorn с несколькими процессами запросы о задаче
+# приходят в любой процесс, а не только в тот, что ее выполняет
+app.config['JOBS_DB'] = os.environ.get(
+    'JOBS_DB', os.path.join(os.path.dirname(app.config['USERS_DB']), 'jobs.db'))
+job_store = JobStore(app.config['JOBS_DB'])
+job_store.init_schema()
+job_queue = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_QUEUE_DEPTH'], on_finish=metrics.observe_job,
+                     store=job_store)
+
+
+def load_secret_key(path):
+    """
+    Ключ подписи сессий из файла; при первом запуске создается случайный. Все процессы
+    сервера должны подписывать cookie одним ключом, иначе сессия теряется при попадании
+    запроса в другой процесс.
+    """
+    if not os.path.exists(path):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as f:
+            f.write(os.urandom(32))
+        try:
+            os.link(tmp_path, path)  # Если ключ уже создал другой процесс, берем его
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+# Секретный ключ для сессий: SECRET_KEY из окружения или общий файл рядом с базой пользователей
+app.config['SECRET_KEY_FILE'] = os.environ.get(
+    'SECRET_KEY_FILE', os.path.join(os.path.dirname(app.config['USERS_DB']), 'secret.key'))
+app.secret_key = os.environ.get('SECRET_KEY') or load_secret_key(app.config['SECRET_KEY_FILE'])
+
+# За nginx отчеты отдает сам nginx: X_ACCEL_PREFIX - внутренний location, смотрящий
+# в папку загрузок (см. deploy/nginx.conf), процесс приложения передачей файла не занят
+app.config['X_ACCEL_PREFIX'] = os.environ.get('X_ACCEL_PREFIX')
+
+# Метрики Prometheus (/metrics) и JSON-логи. Если задан METRICS_TOKEN, /metrics требует его
+# в заголовке Authorization: Bearer <токен>. Метрики у каждого процесса сервера свои (см. metrics.py)
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+metrics.configure_logging()
+metrics.register_cache('workbook', workbook_cache)
+metrics.register_cache('auth', auth_store)
+metrics.register_job_queue(job_queue)
+
+# Выборочный профилировщик: при PROFILE_REQUESTS=1 запрос с параметром ?profile=1
+# (для /process и /compare - вся фоновая задача) пишет свернутые стеки в PROFILE_FOLDER
+app.config['PROFILING_ENABLED'] = os.environ.get('PROFILE_REQUESTS') == '1'
+app.config['PROFILE_FOLDER'] = os.path.join(UPLOAD_FOLDER, 'profiles')
+
+
+def profiling_requested():
+    return app.config['PROFILING_ENABLED'] and request.args.get('profile') == '1'
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.profiler = metrics.SamplingProfiler().start() if profiling_requested() else None
+
+
+def write_request_profile(profiler):
+    profiler.stop()
+    path = profiler.write_folded(
+        os.path.join(app.config['PROFILE_FOLDER'], f'request-{uuid.uuid4().hex}.folded'))
+    return os.path.basename(path)
+
+
+@app.after_request
+def attach_request_profile(response):
+    g.response_status = response.status_code
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        response.headers['X-Profile'] = write_request_profile(profiler)
+    return response
+
+
+@app.teardown_request
+def record_request_metrics(error=None):
+    # teardown вызывается всегда, а after_request пропускается, если представление упало
+    # с исключением (в режиме отладки) - тогда профилировщик останавливается здесь
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        write_request_profile(profiler)
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    metrics.observe_request(endpoint, request.method, g.pop('response_status', 500),
+                            time.perf_counter() - g.pop('request_started', time.perf_counter()),
+                            user=session.get('username'))
+
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """
+    Метрики приложения в текстовом формате Prometheus.
+    """
+    token = app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return Response('Требуется токен.\n', status=401, mimetype='text/plain')
+    return Response(metrics.REGISTRY.render(), mimetype=metrics.CONTENT_TYPE)
+
+
 def init_db():
     """
     Инициализирует базу данных и создает таблицу пользователей, если она не существует.
     """
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    # Создаем таблицу пользователей, если она не существует
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL UNIQUE,
-            password TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    auth_store.init_schema()
 
 def add_user(username, password):
     
     """
     Добавляет нового пользователя в базу данных.
     """
-    try:
-        conn = sqlite3.connect('users.db')
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO users (username, password) VALUES (?, ?)', (username, password))
-        conn.commit()
-    except sqlite3.IntegrityError:
+    if not auth_store.add_user(username, password):
         print(f"Пользователь {username} уже существует.")
-    finally:
-        conn.close()
 
 def validate_user(username, password):
     """
     Проверяет, существует ли пользователь с заданными учетными данными.
     """
-    conn = sqlite3.connect('users.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM users WHERE username = ? AND password = ?', (username, password))
-    user = cursor.fetchone()
-    conn.close()
-    return user
+    return auth_store.validate_user(username, password)
 
 # --- Роуты ---
 @app.route('/')
@@ -133,327 +286,382 @@ def upload_files():
             flash('Пожалуйста, выберите оба файла для загрузки.', 'danger')
             return redirect(request.url)
 
-        # Сохранение файлов
-        file1.save(os.path.join(app.config['UPLOAD_FOLDER'], 'file1.xlsx'))
-        file2.save(os.path.join(app.config['UPLOAD_FOLDER'], 'file2.xlsx'))
+        # Сохранение файлов в рабочий каталог сессии
+        save_uploaded_files(file1, file2)
 
         flash('Файлы успешно загружены.', 'success')
         return redirect(url_for('process_files'))
 
     return render_template('upload.html')
 
+def current_workspace():
+    """
+    Возвращает рабочий каталог текущей сессии, создавая его при необходимости.
+    """
+    workspace_id = session.get('workspace')
+    if not workspaces.exists(workspace_id):
+        workspace_id = workspaces.create()
+        session['workspace'] = workspace_id
+        session.pop('file1', None)
+        session.pop('file2', None)
+    workspaces.touch(workspace_id)
+    return workspace_id
+
+
+def save_uploaded_files(file1, file2):
+    """
+    Сохраняет оба файла в рабочий каталог под именами по содержимому и запоминает их в сессии.
+    """
+    workspace_id = current_workspace()
+    session['file1'] = os.path.basename(workspaces.save_input(workspace_id, file1))
+    session['file2'] = os.path.basename(workspaces.save_input(workspace_id, file2))
+    workspaces.cleanup(keep=(workspace_id,))
+
+
+def uploaded_file_paths():
+    """
+    Пути к загруженным в этой сессии файлам или (None, None), если их нет.
+    """
+    workspace_id = current_workspace()
+    if not session.get('file1') or not session.get('file2'):
+        return None, None
+    file1_path = workspaces.path(workspace_id, 'inputs', os.path.basename(session['file1']))
+    file2_path = workspaces.path(workspace_id, 'inputs', os.path.basename(session['file2']))
+    if not os.path.exists(file1_path) or not os.path.exists(file2_path):
+        return None, None
+    return file1_path, file2_path
+
+
+@app.errorhandler(UploadError)
+def upload_error(e):
+    return jsonify(error=str(e)), e.status
+
+
+@app.route('/uploads', methods=['POST'])
+def create_upload():
+    """
+    Заводит загрузку файла частями. Принимает JSON {filename, size, sha256?},
+    возвращает идентификатор загрузки, размер части и число частей.
+    """
+    if 'username' not in session:
+        return jsonify(error='Требуется вход в систему.'), 401
+
+    data = request.get_json(silent=True) or {}
+    workspace_id = current_workspace()
+    workspaces.cleanup(keep=(workspace_id,))
+    return jsonify(chunked_uploads.create(workspace_id, data.get('filename'), data.get('size'),
+                                          data.get('sha256'))), 201
+
+
+@app.route('/uploads/<upload_id>')
+def upload_status(upload_id):
+    """
+    Состояние загрузки: полученные и недостающие части. По нему клиент докачивает файл после обрыва.
+    """
+    if 'username' not in session:
+        return jsonify(error='Требуется вход в систему.'), 401
+    return jsonify(chunked_uploads.status(current_workspace(), upload_id))
+
+
+@app.route('/uploads/<upload_id>/chunks/<int:index>', methods=['PUT'])
+def upload_chunk(upload_id, index):
+    """
+    Принимает одну часть файла телом запроса. Тело пишется на диск по мере получения;
+    заголовок X-Chunk-SHA256 - контрольная сумма части.
+    """
+    if 'username' not in session:
+        return jsonify(error='Требуется вход в систему.'), 401
+    return jsonify(chunked_uploads.write_chunk(current_workspace(), upload_id, index, request.stream,
+                                               request.headers.get('X-Chunk-SHA256')))
+
+
+@app.route('/uploads/use', methods=['POST'])
+def use_uploads():
+    """
+    Выбирает две завершенные загрузки JSON {file1, file2} как файлы для сверки.
+    """
+    if 'username' not in session:
+        return jsonify(error='Требуется вход в систему.'), 401
+
+    data = request.get_json(silent=True) or {}
+    workspace_id = current_workspace()
+    session['file1'] = chunked_uploads.file_name(workspace_id, data.get('file1'))
+    session['file2'] = chunked_uploads.file_name(workspace_id, data.get('file2'))
+    return jsonify(process_url=url_for('process_files'), select_columns_url=url_for('select_columns'))
+
+
 @app.route('/process')
 def process_files():
     """
-    Обрабатывает загруженные файлы, сравнивает данные и генерирует отчеты.
+    Ставит сверку загруженных файлов в очередь и перенаправляет на страницу задачи.
     """
     if 'username' not in session:
         flash('Пожалуйста, войдите в систему.', 'warning')
         return redirect(url_for('login'))
 
-    file1_path = os.path.join(app.config['UPLOAD_FOLDER'], 'file1.xlsx')
-    file2_path = os.path.join(app.config['UPLOAD_FOLDER'], 'file2.xlsx')
+    file1_path, file2_path = uploaded_file_paths()
 
     # Проверка наличия загруженных файлов
-    if not os.path.exists(file1_path) or not os.path.exists(file2_path):
+    if file1_path is None:
         flash('Оба файла должны быть загружены перед обработкой.', 'danger')
         return redirect(url_for('upload_files'))
 
-    # Чтение Excel файлов, пропуская первые 5 строк
+    return submit_job('process', run_reconciliation, file1_path, file2_path, current_workspace())
+
+
+def run_reconciliation(job, file1_path, file2_path, workspace_id):
+    """
+    Фоновая задача: сравнивает данные двух файлов и генерирует отчеты
+    в каталоге задачи. Сама сверка - в модуле reconcile, здесь этапы задачи,
+    метрики и сохранение различий. Возвращает словарь доступных отчетов.
+    """
+    output_folder = workspaces.job_dir(workspace_id, job.id)
+
+    # Чтение Excel файлов, только столбцы, участвующие в сверке и сопоставлении студентов
+    job.update(stage='Чтение файлов')
+    with metrics.stage('process', 'parse', job_id=job.id) as timer:
+        data1, data2 = reconcile.read_inputs(
+            file1_path, file2_path,
+            loader=lambda path: read_excel_dynamic_skiprows(path, reconcile.read_columns()))
+        timer.rows = len(data1) + len(data2)
+
+    # Студенты без общего идентификатора сопоставляются по ИИН, затем по ФИО и дате рождения
+    job.update(stage='Сопоставление студентов', rows_total=len(data1) + len(data2))
+    with metrics.stage('process', 'match', rows=len(data1) + len(data2), job_id=job.id):
+        aligned, matches = reconcile.match_inputs(data1, data2)
+    counts = matching.match_counts(matches)
+
+    # Одна таблица различий по всем полям, из нее строятся все отчеты.
+    # Пересчитываются только строки, изменившиеся с прошлой сверки в этом рабочем каталоге
+    job.update(stage=f"Сравнение: по идентификатору {counts['id']}, по ИИН {counts['iin']}, "
+                     f"по ФИО и дате рождения {counts['name_birthdate']}, неоднозначных {counts['ambiguous']}")
+    with metrics.stage('process', 'diff', job_id=job.id) as timer:
+        diffs, stats = reconcile.build_diffs(data1, data2, workspaces.path(workspace_id, 'last_run.pkl'),
+                                             workers=app.config['DIFF_WORKERS'], aligned=aligned)
+        timer.rows = stats['evaluated']
+    job.update(stage=f"Сравнение: пересчитано строк {stats['evaluated']} "
+                     f"(новых {stats['inserted']}, изменено {stats['changed']}, удалено {stats['deleted']})",
+               rows_processed=len(data1) + len(data2))
+
+    with metrics.stage('process', 'store', rows=len(diffs), job_id=job.id):
+        results_store.save_run(job.id, job.owner, diffs,
+                               os.path.basename(file1_path), os.path.basename(file2_path))
+
+    # Отдельные отчеты по полям, файл создается только если есть различия
+    job.update(stage='Текстовые отчеты')
+    with metrics.stage('process', 'text_reports', rows=len(diffs), job_id=job.id):
+        reports = reconcile.write_reports(diffs, output_folder, ('txt',))
+        # Пары не по идентификатору, неоднозначные совпадения и студенты без пары
+        if reconcile.write_matching(matches, output_folder):
+            reports['matching'] = reconcile.MATCHING_FILE
+
+    # Общий PDF отчет рисуется прямо из таблицы различий
+    job.update(stage='PDF')
+    with metrics.stage('process', 'pdf', rows=len(diffs), job_id=job.id):
+        reports.update(reconcile.write_reports(diffs, output_folder, ('pdf',)))
+
+    return reports
+
+
+@app.route('/batch', methods=['GET', 'POST'])
+def batch_upload():
+    """
+    Пакетная сверка: эталонный реестр против многих файлов учреждений одной задачей.
+    """
+    if 'username' not in session:
+        flash('Пожалуйста, войдите в систему.', 'warning')
+        return redirect(url_for('login'))
+
+    if request.method == 'POST':
+        reference = request.files.get('reference')
+        files = [file for file in request.files.getlist('files') if file.filename]
+        if reference is None or reference.filename == '' or not files:
+            flash('Выберите эталонный файл и хотя бы один файл учреждения.', 'danger')
+            return redirect(request.url)
+        if len(files) > app.config['BATCH_MAX_FILES']:
+            flash(f"За один раз можно сверить не больше {app.config['BATCH_MAX_FILES']} файлов.", 'danger')
+            return redirect(request.url)
+
+        workspace_id = current_workspace()
+        reference_path = workspaces.save_input(workspace_id, reference)
+        paths = [workspaces.save_input(workspace_id, file) for file in files]
+        names = [os.path.basename(file.filename) for file in files]
+        workspaces.cleanup(keep=(workspace_id,))
+        return submit_job('batch', run_batch_job, reference_path, paths, names, workspace_id)
+
+    return render_template('batch.html')
+
+
+def run_batch_job(job, reference_path, paths, names, workspace_id):
+    """
+    Фоновая задача пакетной сверки. Возвращает сводку по файлам и доступные общие отчеты.
+    """
+    job.update(stage='Чтение и сравнение файлов', rows_processed=0, rows_total=len(paths))
+
+    def progress(done, total):
+        job.update(stage=f'Сверено файлов: {done} из {total}', rows_processed=done)
+
+    with metrics.stage('batch', 'run', job_id=job.id, files=len(paths)) as timer:
+        result = batch.run_batch(reference_path, paths, workspaces.job_dir(workspace_id, job.id), names=names,
+                                 cache_dir=app.config['CACHE_FOLDER'], workers=app.config['BATCH_WORKERS'],
+                                 progress=progress)
+        timer.rows = sum(row.get('rows') or 0 for row in result['summary'])
+    return result
+
+
+def submit_job(kind, func, *args):
+    """
+    Ставит задачу в очередь. Браузер перенаправляется на страницу задачи,
+    API-клиент получает идентификатор задачи в JSON.
+    """
+    if profiling_requested():
+        func = metrics.profiled(func, app.config['PROFILE_FOLDER'])
+    # Пока задача в очереди и выполняется, очистка не удалит ее рабочий каталог
+    workspace_id = current_workspace()
+    token = workspaces.acquire(workspace_id)
+
+    def run(job, *job_args):
+        try:
+            return func(job, *job_args)
+        finally:
+            workspaces.release(workspace_id, token)
+
     try:
-        data1 = pd.read_excel(file1_path, skiprows=5)
-        data2 = pd.read_excel(file2_path, skiprows=5)
-    except Exception as e:
-        flash(f'Ошибка при чтении Excel файлов: {e}', 'danger')
+        job = job_queue.submit(kind, run, *args, owner=session['username'])
+    except QueueFullError as e:
+        workspaces.release(workspace_id, token)
+        flash(str(e), 'danger')
         return redirect(url_for('upload_files'))
 
-    id_column = "Идентификатор обучающегося"
-
-    # Проверка наличия необходимых столбцов
-    required_columns = [id_column, "ИИК", "БИК", "ИИН", "Приказ о назначении стипендии", "Квота","Сирота", "Имеет инвалидность по слуху", "Вид стипендии"]
-    for col in required_columns:
-        if col not in data1.columns or col not in data2.columns:
-            flash(f'Отсутствует обязательный столбец: {col}', 'danger')
-            return redirect(url_for('upload_files'))
-
-    # Приведение идентификаторов к строковому типу
-    data1[id_column] = data1[id_column].astype(str)
-    data2[id_column] = data2[id_column].astype(str)
-
-    # Нахождение общих идентификаторов
-    common_ids = set(data1[id_column]) & set(data2[id_column])
-
-    # Инициализация списков для различий
-    iik_diff = []
-    bik_diff = []
-    iin_diff = []
-    date_diff = []
-    sirota_diff=[]
-    kvota_diff=[]
-    hear_diff=[]
-    step_diff=[]
-    vision_diff=[]
-    period_diff=[]
-
-    # Определение столбцов для сравнения
-    columns_to_compare = {
-        'iik': "ИИК",
-        'bik': "БИК",
-        'iin': "ИИН",
-        'date': "Приказ о назначении стипендии",
-        'sirota': "Сирота",
-        'kvota': "Квота",
-        'hear':"Имеет инвалидность по слуху",
-        'vision': "Имеет инвалидность по зрению",
-        'period': "Unnamed: 26"
-        
-    }
-    reports={}
-
-    # Итерация по общим идентификаторам и поиск различий
-    for student_id in common_ids:
-        row1 = data1[data1[id_column] == student_id].iloc[0]
-        row2 = data2[data2[id_column] == student_id].iloc[0]
-
-        # Сравнение ИИК
-        if row1[columns_to_compare['iik']] != row2[columns_to_compare['iik']]:
-            iik_diff.append({
-                "ID": student_id,
-                "File1_ИИК": row1[columns_to_compare['iik']],
-                "File2_ИИК": row2[columns_to_compare['iik']]
-            })
-        if iik_diff:
-            reports['iik']='reports_iik.txt'
-
-        # Сравнение БИК
-        if row1[columns_to_compare['bik']] != row2[columns_to_compare['bik']]:
-            bik_diff.append({
-                "ID": student_id,
-                "File1_БИК": row1[columns_to_compare['bik']],
-                "File2_БИК": row2[columns_to_compare['bik']]
-            })
-        if bik_diff:
-            reports['bik']='reports_bil.txt'
-
-        # Сравнение ИИН
-        if row1[columns_to_compare['iin']] != row2[columns_to_compare['iin']]:
-            iin_diff.append({
-                "ID": student_id,
-                "File1_IIN": row1[columns_to_compare['iin']],
-                "File2_IIN": row2[columns_to_compare['iin']]
-            })
-        if iin_diff:
-            reports['iin']='reports_iin.txt'
-
-        # Сравнение периодов
-        if row1[columns_to_compare['period']] != row2[columns_to_compare['period']]:
-            period_diff.append({
-                "ID": student_id,
-                "File1_Period": row1[columns_to_compare['period']],
-                "File2_Period": row2[columns_to_compare['period']]
-            })
-        if period_diff:
-            reports['period']='reports_period.txt'
-
-        # Сравнение даты приказа
-        if row1[columns_to_compare['date']] != row2[columns_to_compare['date']]:
-            date_diff.append({
-                "ID": student_id,
-                "File1_Date": row1[columns_to_compare['date']],
-                "File2_Date": row2[columns_to_compare['date']]
-            })
-            if date_diff:
-                reports['date']='reports_date.txt'
-        #sirota
-        if row1[columns_to_compare['sirota']] != row2[columns_to_compare['sirota']] :
-            sirota_diff.append({
-                "ID": student_id,
-                "File1_SIROTA": row1[columns_to_compare['sirota']],
-                "File2_SIROTA": row2[columns_to_compare['sirota']]
-            })
-        if sirota_diff:
-            reports['sirota']='reports_sirota.txt'
-        
-
-        
-        # Названия столбцов
-        scholarship_column = "Вид стипендии"  # Проверяем наличие данных
-        performance_column = "Общая успеваемость"  # Проверяем, входит ли в [0, 1, 3]
-
-# Проверяем, если есть данные в "Вид стипендий" и "Общая успеваемость" равна 0, 1 или 3
-        if pd.notna(row1[scholarship_column]) and row1[performance_column] in [0, 1, 3]:
-            step_diff.append({
-        "ID": student_id,
-        "File1_Вид_стипендий": row1[scholarship_column],
-        "File1_Общая_успеваемость": row1[performance_column]
-    })
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(job_id=job.id, status_url=url_for('job_status', job_id=job.id)), 202
+    return redirect(url_for('job_page', job_id=job.id))
 
-        if pd.notna(row2[scholarship_column]) and row2[performance_column] in [0, 1, 3]:
-            step_diff.append({
-        "ID": student_id,
-        "File2_Вид_стипендий": row2[scholarship_column],
-        "File2_Общая_успеваемость": row2[performance_column]
-    })
 
-        #kvota
-        if row1[columns_to_compare['kvota']] != row2[columns_to_compare['kvota']]:
-            kvota_diff.append({
-                "ID": student_id,
-                "File1_Kvota":row1[columns_to_compare['kvota']],
-                "File2_Kvota":row2[columns_to_compare['kvota']]
-            })
-        if kvota_diff:
-            reports['kvota']='reports_kvota.txt'
-        #invalid_hear
-
-        today=datetime.today().date()
-        
-        start_row = 8  # Начинать проверку с этой строки
-        date_column = "Дата окончания инвалидности"  # Название столбца с датами   
-        date_col_index = 41
-
-        if row1[columns_to_compare['hear']]!=row2[columns_to_compare['hear']]:
-            date1 = pd.to_datetime(row1[date_column], errors='coerce').date() if pd.notna(row1[date_column]) else None
-            date2 = pd.to_datetime(row2[date_column], errors='coerce').date() if pd.notna(row2[date_column]) else None
-    
-    # Проверяем, если дата существует и она меньше сегодняшней
-    is_expired1 = date1 is not None and date1 < today
-    is_expired2 = pd.notna(date2) and date2.date() < today
-
-    hear_diff.append({
-        "ID": student_id,
-        "File1_Hear": row1[columns_to_compare['hear']],
-        "File2_Hear": row2[columns_to_compare['hear']],
-        "File1_Date": date1,
-        "File2_Date": date2,
-        "Expired_File1": "Да" if is_expired1 else "Нет",
-        "Expired_File2": "Да" if is_expired2 else "Нет"
-    })
-    if hear_diff:
-            reports['hear'] = 'report_hear.txt'
+def get_user_job(job_id, with_result=False):
+    """
+    Возвращает задачу текущего пользователя или None. Результат задачи из другого
+    процесса сервера загружается, только если задан with_result.
+    """
+    job = job_queue.get(job_id, with_result)
+    if job is None or job.owner != session.get('username'):
+        return None
+    return job
 
 
-    # Словарь для отслеживания доступных отчетов
-    reports = {}
+@app.route('/jobs/<job_id>')
+def job_page(job_id):
+    """
+    Показывает ход выполнения задачи, а после завершения - ее результат.
+    """
+    if 'username' not in session:
+        flash('Пожалуйста, войдите в систему.', 'warning')
+        return redirect(url_for('login'))
 
-     #invalid_vision
+    job = get_user_job(job_id, with_result=True)
+    if job is None:
+        flash('Задача не найдена.', 'danger')
+        return redirect(url_for('upload_files'))
 
-        
-    start_row = 8  # Начинать проверку с этой строки
-    date_column = "Дата окончания инвалидности"  # Название столбца с датами   
-    date_col_index = 44
+    if job.status == FAILED:
+        flash(job.error, 'danger')
+        return redirect(url_for({'compare': 'select_columns', 'batch': 'batch_upload'}.get(job.kind, 'upload_files')))
+
+    if job.status == DONE:
+        if job.kind == 'compare':
+            if column_compare.has_differences(job.result):
+                # Отчет пишется прямо в ответ построчно, без промежуточного файла
+                lines = (line + "\n" for line in column_compare.iter_report_lines(job.result))
+                return Response(lines, mimetype='text/plain; charset=utf-8', headers={
+                    'Content-Disposition': 'attachment; filename=compare_report.txt'})
+            flash("Нет различий в выбранных столбцах!", "success")
+            return redirect(url_for('select_columns'))
+        if job.kind == 'batch':
+            return render_template('batch.html', job_id=job.id, summary=job.result['summary'],
+                                   reports=job.result['reports'], field_titles=REPORT_TITLES)
+        # Передача списка доступных отчетов и страницы различий в шаблон
+        filters = dict(results_filters(), run_id=job.id)
+        return render_template('report.html', reports=job.result, job_id=job.id, results=query_results(filters),
+                               filters=filters, field_titles=REPORT_TITLES)
+
+    return render_template('job.html', job=job)
+
+
+@app.route('/jobs/<job_id>/status')
+def job_status(job_id):
+    """
+    Возвращает состояние задачи в JSON: этап и число обработанных строк.
+    """
+    if 'username' not in session:
+        return jsonify(error='Требуется вход в систему.'), 401
 
-    if row1[columns_to_compare['vision']]!=row2[columns_to_compare['vision']]:
-            date1 = pd.to_datetime(row1[date_column], errors='coerce').date() if pd.notna(row1[date_column]) else None
-            date2 = pd.to_datetime(row2[date_column], errors='coerce').date() if pd.notna(row2[date_column]) else None
-    
-    # Проверяем, если дата существует и она меньше сегодняшней
-    is_expired1 = date1 is not None and date1 < today
-    is_expired2 = pd.notna(date2) and date2.date() < today
-
-    vision_diff.append({
-        "ID": student_id,
-        "File1_vision": row1[columns_to_compare['hear']],
-        "File2_vision": row2[columns_to_compare['hear']],
-        "File1_Date": date1,
-        "File2_Date": date2,
-        "Expired_File1": "Да" if is_expired1 else "Нет",
-        "Expired_File2": "Да" if is_expired2 else "Нет"
-    })
-    if vision_diff:
-            reports['vision'] = 'report_vision.txt'
+    job = get_user_job(job_id)
+    if job is None:
+        return jsonify(error='Задача не найдена.'), 404
+    return jsonify(job.to_dict())
 
+REPORT_TITLES = {key: title for key, title, _ in diff_engine.REPORTS}
 
-    # Словарь для отслеживания доступных отчетов
-    reports = {}
-    
 
-    # Функция для генерации и сохранения отчета, если есть различия
-    def generate_report(diff_list, report_key, report_title, headers):
-        if diff_list:
-            report_content = f"Изменения по {report_title}:\n"
-            report_content += ", ".join(headers) + "\n"
-            for diff in diff_list:
-                report_content += ", ".join([f"{key}: {value}" for key, value in diff.items()]) + "\n"
-            report_filename = f'report_{report_key}.txt'
-            report_path = os.path.join(app.config['UPLOAD_FOLDER'], report_filename)
-            with open(report_path, 'w', encoding='utf-8') as f:
-                f.write(report_content)
-            reports[report_key] = report_filename
-
-    # Генерация отдельных отчетов
-    generate_report(iik_diff, 'iik', 'ИИК', ["ID", "File1_ИИК", "File2_ИИК"])
-    generate_report(bik_diff, 'bik', 'БИК', ["ID", "File1_БИК", "File2_БИК"])
-    generate_report(iin_diff, 'iin', 'ИИН', ["ID", "File1_IIN", "File2_IIN"])
-    generate_report(date_diff, 'date', 'датам приказов', ["ID", "File1_Date", "File2_Date"])
-    generate_report(sirota_diff, 'sirota', 'сиротам', ["ID", "File1_SIROTA", "File2_SIROTA"])
-    generate_report(kvota_diff, 'kvota', 'квоте', ["ID", "File1_kvota", "File2_kvota"])
-    generate_report(hear_diff,'hear','слуху', ["ID", "File1_Hear", "File2_Hear"])
-    generate_report(step_diff, scholarship_column, 'стипендий', ["ID", "File1_Вид_стипендий", "File1_Общая_успеваемость"])
-    generate_report(vision_diff, 'vision', 'зрению', ["ID", "File1_vision", "File2_vision"])
-    generate_report(period_diff, 'period', 'периоду', ["ID", "File1_Period", "File2_Period"] )
-    
+def _int_arg(name, default):
+    try:
+        return int(request.args.get(name, default))
+    except (TypeError, ValueError):
+        return default
 
 
+def results_filters():
+    """
+    Фильтры выборки различий из параметров запроса: run, field, student, days, page, per_page.
+    """
+    return {
+        'run_id': request.args.get('run') or None,
+        'field': request.args.get('field') or None,
+        'student_id': request.args.get('student') or None,
+        'days': _int_arg('days', 0) or None,
+        'page': max(1, _int_arg('page', 1)),
+        'per_page': _int_arg('per_page', app.config['RESULTS_PER_PAGE']),
+    }
+
+
+def query_results(filters):
+    since = time.time() - filters['days'] * 24 * 60 * 60 if filters['days'] else None
+    return results_store.query(session['username'], run_id=filters['run_id'], field=filters['field'],
+                               student_id=filters['student_id'], since=since,
+                               page=filters['page'], per_page=filters['per_page'])
+
+
+@app.route('/api/results')
+def api_results():
+    """
+    Различия сверок пользователя в JSON, постранично, с фильтрами по запуску, полю,
+    идентификатору студента и давности (days).
+    """
+    if 'username' not in session:
+        return jsonify(error='Требуется вход в систему.'), 401
+    return jsonify(query_results(results_filters()))
 
-    pdfmetrics.registerFont(TTFont('Times New Roman', 'C:/Users/админ/AppData/Local/Microsoft/Windows/Fonts/Times New Roman.ttf'))  # Укажите путь к своему шрифту
-    pdf_path = os.path.join(app.config['UPLOAD_FOLDER'], 'report_all.pdf')
-    c = canvas.Canvas(pdf_path, pagesize=A4)
-# Устанавливаем шрифт
-    c.setFont("Times New Roman", 12)
-
-    # Генерация общего отчета, если есть хотя бы один индивидуальный отчет
-    if reports:
-        width, height = A4
-    y_position = height - 50  # Начальная позиция текста
-   
-    c.setFont("Times New Roman", 14)
-    c.drawString(50, y_position, "Общий отчет по различиям")
-    y_position -= 20  # Отступ вниз
-
-    has_content = False  # Флаг, есть ли изменения хотя бы в одном разделе
-
-    for key in ['iik', 'bik', 'iin', 'date', 'sirota', "kvota", 'hear', scholarship_column, 'vision', 'period']:
-        if key in reports:
-            report_path = os.path.join(app.config['UPLOAD_FOLDER'], reports[key])
-            if os.path.exists(report_path):  
-                with open(report_path, 'r', encoding='utf-8') as f:
-                    content = f.readlines()
-
-                # **Фильтруем пустые строки и nan**
-                filtered_lines = [line for line in content if "nan" not in line.strip()]
-
-                if filtered_lines:  # Если есть хотя бы одна строка с изменением
-                    has_content = True
-                    y_position -= 20
-                    c.setFont("Times New Roman", 12)
-                    c.drawString(50, y_position, f"Раздел: {key.upper()}")
-                    y_position -= 10
-
-                    c.setFont("Times New Roman", 10)
-                    for line in filtered_lines:
-                        y_position -= 15
-                        if y_position < 50:
-                            c.showPage()
-                            c.setFont("Times New Roman", 10)
-                            y_position = height - 50
-                        c.drawString(50, y_position, line.strip())
-
-    if has_content:
-        c.save()
-        reports['all'] = 'report_all.pdf'
-    else:
-        os.remove(pdf_path)  # Удаляем пустой PDF, если нет изменений
 
-    # Передача списка доступных отчетов в шаблон
-    return render_template('report.html', reports=reports)
+@app.route('/results')
+def results_page():
+    """
+    Поиск по сохраненным результатам сверок.
+    """
+    if 'username' not in session:
+        flash('Пожалуйста, войдите в систему.', 'warning')
+        return redirect(url_for('login'))
+
+    filters = results_filters()
+    return render_template('results.html', results=query_results(filters), filters=filters,
+                           runs=results_store.list_runs(session['username']), field_titles=REPORT_TITLES)
 
 # 🔹 Страница выбора столбцов для сравнения
 # 🔹 Выбор столбцов
 @app.route('/select_columns', methods=['GET', 'POST'])
 def select_columns():
-    file1_path = os.path.join(app.config['UPLOAD_FOLDER'], 'file1.xlsx')
-    file2_path = os.path.join(app.config['UPLOAD_FOLDER'], 'file2.xlsx')
+    if 'username' not in session:
+        flash('Пожалуйста, войдите в систему.', 'warning')
+        return redirect(url_for('login'))
 
     # Если загружаем файлы
     if request.method == 'POST' and 'file1' in request.files and 'file2' in request.files:
@@ -464,26 +672,23 @@ def select_columns():
             flash("Пожалуйста, загрузите оба файла!", "danger")
             return redirect(request.url)
 
-        file1.save(file1_path)
-        file2.save(file2_path)
+        save_uploaded_files(file1, file2)
         flash("Файлы успешно загружены!", "success")
         return redirect(url_for('select_columns'))  # Перезагрузка страницы
 
     # Проверяем, загружены ли файлы
-    if not os.path.exists(file1_path) or not os.path.exists(file2_path):
+    file1_path, file2_path = uploaded_file_paths()
+    if file1_path is None:
         flash("Сначала загрузите файлы!", "danger")
         return redirect(url_for('upload_files'))
 
     try:
-        # Читаем файлы с заголовками с 6-й строки
-        df1 = pd.read_excel(file1_path)
-        df2 = pd.read_excel(file2_path)
-
-        # Передаем столбцы как списки
-        columns1 = df1.columns.tolist()
-        columns2 = df2.columns.tolist()
+        # Читаем только строку заголовков, сами данные не нужны
+        columns1 = excel_stream.read_header(file1_path)
+        columns2 = excel_stream.read_header(file2_path)
 
-        return render_template('select_columns.html', columns1=columns1, columns2=columns2)
+        return render_template('select_columns.html', columns1=columns1, columns2=columns2,
+                               default_key=diff_engine.ID_COLUMN)
 
     except Exception as e:
         flash(f"Ошибка при чтении файлов: {e}", "danger")
@@ -493,75 +698,167 @@ def select_columns():
 # 🔹 Обработка сравнения столбцов
 @app.route('/compare', methods=['POST'])
 def compare():
+    if 'username' not in session:
+        flash('Пожалуйста, войдите в систему.', 'warning')
+        return redirect(url_for('login'))
+
     selected_columns1 = request.form.getlist('columns1')
     selected_columns2 = request.form.getlist('columns2')
+    key_column1 = request.form.get('key1')
+    key_column2 = request.form.get('key2')
 
     if not selected_columns1 or not selected_columns2:
         flash("Выберите хотя бы один столбец из каждого файла!", "danger")
         return redirect(url_for('select_columns'))
 
-    file1_path = os.path.join(app.config['UPLOAD_FOLDER'], 'file1.xlsx')
-    file2_path = os.path.join(app.config['UPLOAD_FOLDER'], 'file2.xlsx')
-
-    df1 = pd.read_excel(file1_path, skiprows=5, usecols=selected_columns1)
-    df2 = pd.read_excel(file2_path, skiprows=5, usecols=selected_columns2)
-
-    report_lines = []
-    common_rows = min(len(df1), len(df2))  # Сравниваем только одинаковые строки
-
-    for i in range(common_rows):
-        row_diff = []
-        for col1, col2 in zip(selected_columns1, selected_columns2):
-            if str(df1.iloc[i][col1]) != str(df2.iloc[i][col2]):  # Исправлено
-                row_diff.append(f"{col1}: {df1.iloc[i][col1]} -> {df2.iloc[i][col2]}")
-
-        if row_diff:
-            report_lines.append(f"Строка {i + 1}: " + "; ".join(row_diff))
-
-    report_path = os.path.join(app.config['UPLOAD_FOLDER'], 'report.txt')
-
-    if report_lines:
-        with open(report_path, 'w', encoding='utf-8') as f:
-            f.write("\n".join(report_lines))
-        return send_file(report_path, as_attachment=True)
-    else:
-        flash("Нет различий в выбранных столбцах!", "success")
+    if not key_column1 or not key_column2:
+        flash("Выберите ключевой столбец, по которому сопоставляются строки!", "danger")
         return redirect(url_for('select_columns'))
 
+    file1_path, file2_path = uploaded_file_paths()
+    if file1_path is None:
+        flash("Сначала загрузите файлы!", "danger")
+        return redirect(url_for('upload_files'))
+
+    return submit_job('compare', run_compare, file1_path, file2_path, key_column1, key_column2,
+                      selected_columns1, selected_columns2)
 
 
-@app.route('/download/<report_type>')
-def download_report(report_type):
+def run_compare(job, file1_path, file2_path, key_column1, key_column2, selected_columns1, selected_columns2):
     """
-    Обрабатывает скачивание отчета по типу.
+    Фоновая задача: сопоставляет строки файлов по ключевому столбцу и сравнивает выбранные пары столбцов.
+    Возвращает результат сравнения, отчет по нему строится при скачивании.
+    """
+    # Ключевой столбец может быть выбран и для сравнения - читаем его один раз
+    columns1 = list(dict.fromkeys([key_column1] + selected_columns1))
+    columns2 = list(dict.fromkeys([key_column2] + selected_columns2))
+    job.update(stage='Чтение файлов')
+    with metrics.stage('compare', 'parse', job_id=job.id) as timer:
+        df1 = read_excel_dynamic_skiprows(file1_path, columns1)
+        df2 = read_excel_dynamic_skiprows(file2_path, columns2)
+        timer.rows = len(df1) + len(df2)
+
+    for data, columns in ((df1, columns1), (df2, columns2)):
+        missing = [col for col in columns if col not in data.columns]
+        if missing:
+            raise JobError(f'Отсутствует столбец: {missing[0]}')
+
+    job.update(stage='Сравнение', rows_total=len(df1) + len(df2))
+    with metrics.stage('compare', 'compare', rows=len(df1) + len(df2), job_id=job.id):
+        result = column_compare.compare_by_key(df1, df2, key_column1, key_column2,
+                                               selected_columns1, selected_columns2)
+    job.update(rows_processed=len(df1) + len(df2))
+    return result
+
+
+@app.route('/download/<job_id>/<report_type>')
+def download_report(job_id, report_type):
+    """
+    Обрабатывает скачивание отчета задачи по типу из рабочего каталога сессии.
     """
     if 'username' not in session:
         flash('Пожалуйста, войдите в систему.', 'warning')
         return redirect(url_for('login'))
 
-    # Сопоставление типов отчетов с именами файлов
-    report_files = {
-        'iik': 'report_iik.txt',
-        'bik': 'report_bik.txt',
-        'iin': 'report_iin.txt',
-        'date': 'report_date.txt',
+    # Сопоставление типов отчетов с именами файлов: текстовые отчеты по всем полям реестра правил,
+    # общий PDF, итоги сопоставления студентов и сводка с различиями пакетной сверки
+    report_files = {key: f'report_{key}.txt' for key in diff_engine.REPORT_KEYS}
+    report_files.update({
         'all': 'report_all.pdf',
-        'sirota': 'report_sirota.txt'
-    }
+        'summary': batch.SUMMARY_FILE,
+        'diffs': batch.DIFFS_FILE,
+        'matching': reconcile.MATCHING_FILE,
+    })
 
     # Проверка валидности типа отчета
     if report_type not in report_files:
         flash('Неверный тип отчета.', 'danger')
-        return redirect(url_for('process_files'))
+        return redirect(url_for('upload_files'))
 
-    report_path = os.path.join(app.config['UPLOAD_FOLDER'], report_files[report_type])
+    report_path = workspaces.resolve(current_workspace(), job_id, report_files[report_type])
 
     # Проверка существования файла отчета
-    if not os.path.exists(report_path):
+    if report_path is None:
         flash('Отчет не найден или изменений не обнаружено.', 'warning')
-        return redirect(url_for('process_files'))
+        return redirect(url_for('upload_files'))
 
-    return send_file(report_path, as_attachment=True)
+    return send_stored_file(report_path)
+
+
+def send_stored_file(path):
+    """
+    Отдает файл из папки загрузок. Если задан X_ACCEL_PREFIX, в ответе только заголовки,
+    а сам файл по X-Accel-Redirect отправляет nginx.
+    """
+    response = send_file(path, as_attachment=True)
+    prefix = app.config['X_ACCEL_PREFIX']
+    if prefix:
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(UPLOAD_FOLDER))
+        response.close()
+        response.direct_passthrough = False
+        response.set_data(b'')
+        response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(relative.replace(os.sep, '/'))
+    return response
+
+
+@app.route('/download/<job_id>/reports.zip')
+def download_archive(job_id):
+    """
+    Все отчеты задачи одним zip-архивом. Архив собирается по мере отправки и в памяти
+    целиком не хранится; для сверки двух файлов в него добавляется выгрузка различий diffs.csv.
+    """
+    if 'username' not in session:
+        flash('Пожалуйста, войдите в систему.', 'warning')
+        return redirect(url_for('login'))
+
+    owner = session['username']
+    workspace_id = current_workspace()
+    filenames = workspaces.job_files(workspace_id, job_id)
+    entries = [(filename, exports.file_chunks(workspaces.resolve(workspace_id, job_id, filename)))
+               for filename in filenames]
+    if results_store.get_run(owner, job_id) is not None and reconcile.EXPORT_FILES['csv'] not in filenames:
+        entries.append((reconcile.EXPORT_FILES['csv'], exports.iter_csv(EXPORT_COLUMNS, results_store.iter_rows(owner, run_id=job_id))))
+    if not entries:
+        flash('Отчеты не найдены или изменений не обнаружено.', 'warning')
+        return redirect(url_for('upload_files'))
+
+    return Response(exports.iter_zip(entries), mimetype=exports.MIMETYPES['zip'], headers={
+        'Content-Disposition': f'attachment; filename=reports-{job_id}.zip'})
+
+
+@app.route('/export/<fmt>')
+def export_results(fmt):
+    """
+    Выгрузка различий в CSV, XLSX или Parquet с теми же фильтрами, что /results
+    (run, field, student, days): одна сверка, одно поле или все результаты пользователя.
+    CSV отдается потоком прямо из базы, XLSX и Parquet пишутся во временный файл.
+    """
+    if 'username' not in session:
+        flash('Пожалуйста, войдите в систему.', 'warning')
+        return redirect(url_for('login'))
+    if fmt not in exports.FORMATS:
+        flash('Неверный формат выгрузки.', 'danger')
+        return redirect(url_for('results_page'))
+
+    filters = results_filters()
+    since = time.time() - filters['days'] * 24 * 60 * 60 if filters['days'] else None
+    rows = results_store.iter_rows(session['username'], run_id=filters['run_id'], field=filters['field'],
+                                   student_id=filters['student_id'], since=since)
+    download_name = f"diffs-{filters['run_id'] or 'all'}.{fmt}"
+    if fmt == 'csv':
+        # content_type, а не mimetype: кодировка уже указана, Werkzeug добавил бы ее второй раз
+        return Response(exports.iter_csv(EXPORT_COLUMNS, rows), content_type=exports.MIMETYPES['csv'], headers={
+            'Content-Disposition': f'attachment; filename={download_name}'})
+
+    path = workspaces.path(current_workspace(), f'export-{uuid.uuid4().hex}.{fmt}')
+    try:
+        with metrics.stage('export', fmt):
+            exports.write(fmt, EXPORT_COLUMNS, rows, path)
+        export_file = open(path, 'rb')
+    finally:
+        if os.path.exists(path):
+            os.remove(path)  # Открытый файл остается доступен до конца отправки
+    return send_file(export_file, mimetype=exports.MIMETYPES[fmt], as_attachment=True, download_name=download_name)
 
 # --- Запуск приложения ---
 if __name__ == '__main__':
@@ -0,0 +1,247 @@
+"""
+Кэш разобранных Excel файлов.
+
+Ключ кэша - SHA-256 содержимого файла, значение - снимок таблицы на диске
+в колоночном формате Parquet (если установлен pyarrow) или в pickle.
+Из xlsx читаются только запрошенные столбцы; снимок помнит, какие столбцы
+запрашивались, и если позже нужны другие, файл разбирается еще раз уже
+с объединенным набором. Снимок без этой отметки содержит все столбцы файла.
+Размер кэша ограничен, при переполнении удаляются давно не использованные снимки.
+"""
+import hashlib
+import json
+import os
+import threading
+
+import pandas as pd
+
+import excel_stream
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pyarrow необязателен, без него снимки пишутся в pickle
+    pq = None
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+# Версия содержимого снимков: меняется, когда меняется разбор (например, типы столбцов),
+# чтобы снимки старого вида не смешивались с новыми
+SNAPSHOT_FORMAT = 3
+SNAPSHOT_EXTENSIONS = ('.parquet', '.pkl')
+# Метаданные снимка со списком запрошенных при разборе столбцов (в Parquet - схемы, в pickle - attrs)
+COLUMNS_KEY = 'workbook_cache.columns'
+
+
+def file_digest(file_path):
+    """
+    Считает SHA-256 файла, читая его частями.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _arrow_types(pa_type):
+    # Байты фиксированной длины (ИИК, см. column_types) pandas по метаданным Parquet не восстанавливает
+    if pa.types.is_fixed_size_binary(pa_type):
+        return pd.ArrowDtype(pa_type)
+    return None
+
+
+def _to_pandas(table):
+    """
+    Таблица pyarrow в DataFrame. Из метаданных pandas убираются непрочитанные столбцы:
+    pandas разбирает типы всех перечисленных там столбцов, а тип ИИК по имени не восстанавливает.
+    """
+    metadata = table.schema.metadata or {}
+    if b'pandas' in metadata:
+        pandas_metadata = json.loads(metadata[b'pandas'])
+        names = set(table.column_names)
+        pandas_metadata['columns'] = [column for column in pandas_metadata['columns']
+                                      if column.get('field_name', column['name']) in names]
+        metadata = dict(metadata)
+        metadata[b'pandas'] = json.dumps(pandas_metadata).encode()
+        table = table.replace_schema_metadata(metadata)
+    return table.to_pandas(types_mapper=_arrow_types)
+
+
+def _covers(covered, columns):
+    """
+    Есть ли в снимке, разобранном по столбцам covered (None - все), все столбцы columns.
+    """
+    return covered is None or (columns is not None and set(columns) <= covered)
+
+
+class WorkbookCache:
+    """
+    Хранит снимки разобранных файлов и отдает их вместо повторного чтения xlsx.
+    """
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._digests = {}  # путь -> (mtime, размер, хэш)
+        self._loading = {}  # хэш -> [блокировка разбора этого содержимого, число ждущих ее потоков]
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def digest(self, file_path):
+        """
+        Возвращает хэш файла, пересчитывая его только если изменились время изменения или размер.
+        Загруженные файлы хранятся под именем по содержимому, так что по одному пути
+        другое содержимое не появляется.
+        """
+        stat = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        with self._lock:
+            known = self._digests.get(key)
+        if known and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return known[2]
+        digest = file_digest(file_path)
+        with self._lock:
+            self._digests[key] = (stat.st_mtime_ns, stat.st_size, digest)
+        return digest
+
+    def _snapshot_path(self, digest):
+        for ext in SNAPSHOT_EXTENSIONS:
+            path = os.path.join(self.cache_dir, f'{digest}-v{SNAPSHOT_FORMAT}{ext}')
+            if os.path.exists(path):
+                return path
+        return None
+
+    def load(self, file_path, columns=None):
+        """
+        Возвращает таблицу файла (только выбранные столбцы) из снимка или разбирает xlsx.
+        Если тот же файл уже разбирается в другом потоке (например, сразу после загрузки),
+        ждет его снимок вместо повторного разбора.
+        """
+        digest = self.digest(file_path)
+        with self._lock:
+            loading = self._loading.setdefault(digest, [threading.Lock(), 0])
+            loading[1] += 1
+        try:
+            with loading[0]:
+                return self._load(file_path, digest, columns)
+        finally:
+            # Блокировка нужна, только пока файл кто-то читает, иначе словарь растет без предела
+            with self._lock:
+                loading[1] -= 1
+                if not loading[1]:
+                    del self._loading[digest]
+
+    def _load(self, file_path, digest, columns):
+        snapshot = self._snapshot_path(digest)
+        wanted = columns
+        if snapshot:
+            try:
+                data, covered = self._read_snapshot(snapshot, columns)
+            except (OSError, ValueError):
+                data, covered = None, set()  # снимок удален при очистке или поврежден - читаем заново
+            if data is not None:
+                self.hits += 1
+                try:
+                    os.utime(snapshot)  # отмечаем использование для LRU
+                except OSError:
+                    pass
+                return data
+            # В снимке не все нужные столбцы - разбираем файл с прежними и новыми
+            wanted = None if columns is None else sorted(covered | set(columns))
+
+        self.misses += 1
+        data = excel_stream.read_frame(file_path, wanted)
+        self._write_snapshot(digest, data, wanted)
+        if columns is not None:
+            data = data[[col for col in data.columns if col in set(columns)]]
+        return data
+
+    def _read_snapshot(self, snapshot, columns):
+        """
+        Возвращает (таблица с выбранными столбцами или None, если при разборе запрашивались
+        не все из них; запрошенные при разборе столбцы или None, если снимок полный).
+        """
+        if snapshot.endswith('.parquet'):
+            schema = pq.read_schema(snapshot)
+            covered = (schema.metadata or {}).get(COLUMNS_KEY.encode())
+            covered = set(json.loads(covered)) if covered is not None else None
+            if not _covers(covered, columns):
+                return None, covered
+            if columns is not None:
+                # Повторы в списке дали бы столбцы с одинаковыми именами
+                present = set(schema.names)
+                columns = [col for col in dict.fromkeys(columns) if col in present]
+            return _to_pandas(pq.read_table(snapshot, columns=columns)), covered
+        data = pd.read_pickle(snapshot)
+        covered = data.attrs.get(COLUMNS_KEY)
+        covered = set(covered) if covered is not None else None
+        if not _covers(covered, columns):
+            return None, covered
+        if columns is not None:
+            data = data[[col for col in data.columns if col in set(columns)]]
+        return data, covered
+
+    def _write_snapshot(self, digest, data, columns=None):
+        """
+        Пишет снимок через временный файл, чтобы параллельные запросы и процессы не прочитали его недописанным.
+        columns - столбцы, запрошенные при разборе (None - все столбцы файла).
+        """
+        base = os.path.join(self.cache_dir, f'{digest}-v{SNAPSHOT_FORMAT}')
+        tmp_path = f'{base}.{os.getpid()}.{threading.get_ident()}.tmp'
+        path = None
+        if pq is not None:
+            try:
+                table = pa.Table.from_pandas(data, preserve_index=False)
+                if columns is not None:
+                    metadata = dict(table.schema.metadata or {})
+                    metadata[COLUMNS_KEY.encode()] = json.dumps(list(columns), ensure_ascii=False).encode()
+                    table = table.replace_schema_metadata(metadata)
+                pq.write_table(table, tmp_path)
+                path = base + '.parquet'
+            except (ValueError, TypeError):
+                # Столбцы со смешанными типами (число и текст) Parquet не принимает
+                path = None
+        if path is None:
+            if columns is not None:
+                data = data.copy(deep=False)
+                data.attrs[COLUMNS_KEY] = list(columns)
+            data.to_pickle(tmp_path)
+            path = base + '.pkl'
+        os.replace(tmp_path, path)
+        # Прежний снимок в другом формате (например, Parquet до того, как разбор дал столбец
+        # со смешанными типами) иначе находился бы первым и заслонял новый
+        for ext in SNAPSHOT_EXTENSIONS:
+            if base + ext != path:
+                try:
+                    os.remove(base + ext)
+                except FileNotFoundError:
+                    pass
+        self.evict()
+
+    def evict(self):
+        """
+        Удаляет самые давно использованные снимки, пока кэш не уложится в лимит.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
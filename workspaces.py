@@ -0,0 +1,223 @@
+"""
+Рабочие каталоги пользователей.
+
+У каждой сессии свой каталог: загруженные файлы хранятся в нем под именем
+SHA-256 содержимого, а результаты каждой задачи - в отдельном подкаталоге.
+Параллельные сверки разных операторов не перезаписывают файлы друг друга.
+Старые каталоги удаляются по сроку жизни и при превышении квоты на диск;
+каталоги с задачами в очереди или в работе и только что завершенными
+задачами при этом не трогаются.
+"""
+import hashlib
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_QUOTA_BYTES = 2 * 1024 * 1024 * 1024
+CLEANUP_INTERVAL = 60
+# Каталог, где задача недавно завершилась или что-то загружалось, квота не трогает столько секунд
+DEFAULT_RECENT_GRACE = 15 * 60
+# Подкаталог с отметками задач, которые стоят в очереди или выполняются
+BUSY_DIR = 'busy'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_ID_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def is_valid_id(value):
+    """
+    Проверяет идентификатор каталога или задачи (32 шестнадцатеричных символа).
+    """
+    return bool(value) and bool(_ID_PATTERN.match(value))
+
+
+def _is_busy(path, now, ttl):
+    """
+    Есть ли в каталоге отметки незавершенных задач. Отметки старше срока жизни
+    (процесс упал, не сняв их) не учитываются.
+    """
+    try:
+        markers = os.scandir(os.path.join(path, BUSY_DIR))
+    except OSError:
+        return False
+    with markers:
+        for marker in markers:
+            try:
+                if now - marker.stat().st_mtime <= ttl:
+                    return True
+            except OSError:
+                continue
+    return False
+
+
+def _tree_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class WorkspaceManager:
+    """
+    Создает рабочие каталоги, сохраняет в них входные файлы и чистит устаревшие.
+    """
+
+    def __init__(self, root, ttl=DEFAULT_TTL, quota_bytes=DEFAULT_QUOTA_BYTES, recent_grace=DEFAULT_RECENT_GRACE):
+        self.root = root
+        self.ttl = ttl
+        self.quota_bytes = quota_bytes
+        self.recent_grace = recent_grace
+        self._last_cleanup = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def create(self):
+        workspace_id = uuid.uuid4().hex
+        os.makedirs(self.path(workspace_id), exist_ok=True)
+        return workspace_id
+
+    def path(self, workspace_id, *parts):
+        """
+        Путь внутри рабочего каталога. Чужие и некорректные идентификаторы не принимаются.
+        """
+        if not is_valid_id(workspace_id):
+            raise ValueError('Некорректный идентификатор рабочего каталога.')
+        return os.path.join(self.root, workspace_id, *parts)
+
+    def exists(self, workspace_id):
+        return is_valid_id(workspace_id) and os.path.isdir(self.path(workspace_id))
+
+    def touch(self, workspace_id):
+        """
+        Отмечает использование каталога, чтобы его не удалили по сроку жизни.
+        """
+        try:
+            os.utime(self.path(workspace_id))
+        except OSError:
+            pass
+
+    def acquire(self, workspace_id):
+        """
+        Отмечает каталог занятым задачей, пока та стоит в очереди или выполняется.
+        Отметка - файл на диске, поэтому ее видит очистка в любом процессе сервера.
+        Возвращает ключ отметки для release.
+        """
+        busy = self.path(workspace_id, BUSY_DIR)
+        os.makedirs(busy, exist_ok=True)
+        token = uuid.uuid4().hex
+        open(os.path.join(busy, token), 'w').close()
+        self.touch(workspace_id)
+        return token
+
+    def release(self, workspace_id, token):
+        """
+        Снимает отметку задачи. Время завершения остается временем изменения каталога.
+        """
+        try:
+            os.remove(self.path(workspace_id, BUSY_DIR, token))
+        except OSError:
+            pass
+        self.touch(workspace_id)
+
+    def save_input(self, workspace_id, file):
+        """
+        Потоково сохраняет загруженный файл под именем SHA-256 его содержимого и возвращает путь.
+        """
+        inputs = self.path(workspace_id, 'inputs')
+        os.makedirs(inputs, exist_ok=True)
+        tmp_path = os.path.join(inputs, f'{uuid.uuid4().hex}.tmp')
+        digest = hashlib.sha256()
+        with open(tmp_path, 'wb') as out:
+            for chunk in iter(lambda: file.stream.read(COPY_CHUNK_SIZE), b''):
+                digest.update(chunk)
+                out.write(chunk)
+        return self.store_input(workspace_id, tmp_path, digest.hexdigest())
+
+    def store_input(self, workspace_id, tmp_path, digest):
+        """
+        Переносит уже записанный файл во входные файлы под именем его SHA-256 и возвращает путь.
+        """
+        inputs = self.path(workspace_id, 'inputs')
+        os.makedirs(inputs, exist_ok=True)
+        path = os.path.join(inputs, f'{digest}.xlsx')
+        if os.path.exists(path):
+            os.remove(tmp_path)  # Такой файл уже загружен
+        else:
+            os.replace(tmp_path, path)
+        self.touch(workspace_id)
+        return path
+
+    def job_dir(self, workspace_id, job_id):
+        """
+        Каталог результатов задачи, создается при первом обращении.
+        """
+        path = self.path(workspace_id, 'jobs', job_id)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def resolve(self, workspace_id, job_id, filename):
+        """
+        Возвращает путь к файлу результата задачи или None, если его нет.
+        """
+        if not is_valid_id(job_id) or os.path.basename(filename) != filename:
+            return None
+        path = self.path(workspace_id, 'jobs', job_id, filename)
+        return path if os.path.isfile(path) else None
+
+    def job_files(self, workspace_id, job_id):
+        """
+        Имена файлов результата задачи по алфавиту, пустой список, если их нет.
+        """
+        if not is_valid_id(job_id):
+            return []
+        path = self.path(workspace_id, 'jobs', job_id)
+        if not os.path.isdir(path):
+            return []
+        return sorted(name for name in os.listdir(path) if os.path.isfile(os.path.join(path, name)))
+
+    def cleanup(self, keep=(), force=False):
+        """
+        Удаляет каталоги старше срока жизни, затем самые старые, пока не уложимся в квоту.
+        Каталоги с незавершенными задачами не удаляются, а использованные последние
+        recent_grace секунд (только что завершенная задача, загрузка) - и ради квоты.
+        Запускается не чаще раза в минуту, если не указан force.
+        """
+        with self._lock:
+            now = time.time()
+            if not force and now - self._last_cleanup < CLEANUP_INTERVAL:
+                return
+            self._last_cleanup = now
+
+            entries = []
+            for name in os.listdir(self.root):
+                path = os.path.join(self.root, name)
+                if not is_valid_id(name) or not os.path.isdir(path) or name in keep:
+                    continue
+                try:
+                    mtime = os.path.getmtime(path)
+                except OSError:
+                    continue
+                busy = _is_busy(path, now, self.ttl)
+                if now - mtime > self.ttl and not busy:
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    # Занятые и недавние каталоги занимают квоту, но не удаляются
+                    removable = not busy and now - mtime > self.recent_grace
+                    entries.append((mtime, _tree_size(path), path, removable))
+
+            total = sum(size for _, size, _, _ in entries)
+            for _, size, path, removable in sorted(entries):
+                if total <= self.quota_bytes:
+                    break
+                if not removable:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
@@ -0,0 +1,11 @@
+"""
+Точка входа для WSGI-сервера:
+
+    gunicorn wsgi:app
+
+Настройки процессов и потоков - в gunicorn.conf.py. Схема базы пользователей
+создается при загрузке приложения в каждом процессе (CREATE TABLE IF NOT EXISTS).
+"""
+from test1 import app, init_db
+
+init_db()